@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+"""Benchmark of the start up time of the CLI, with `python -X importtime`.
+
+Every module is imported in a fresh interpreter several times and the best
+cumulative import time is compared with its budget.
+"""
+import statistics
+import subprocess
+import sys
+
+import click
+
+# Module imported by every command, and the ones imported by `gst`
+MODULES = ['ratp_poll.cli', 'ratp_poll.ratp_api.stop_times']
+
+
+def import_time(module):
+    """Import a module in a fresh interpreter.
+
+    Returns:
+        float: Cumulative import time of the module in milliseconds.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             'import ' + module],
+                            stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True)
+    for line in reversed(result.stderr.splitlines()):
+        fields = [field.strip() for field in line.split('|')]
+        if (len(fields) == 3 and fields[2] == module):
+            return int(fields[1]) / 1000
+    raise RuntimeError('No import time of ' + module)
+
+
+@click.command()
+@click.option('--runs', default=10, show_default=True,
+              help='Fresh interpreters per module.')
+@click.option('--budget', default=60.0, show_default=True,
+              help='Maximum best import time in ms of ratp_poll.cli. Exits '
+              'with 1 if exceeded.')
+def main(runs, budget):
+    """Measure the import time of the CLI and of the fetching module."""
+    over_budget = False
+    for module in MODULES:
+        times = [import_time(module) for _ in range(runs)]
+        click.echo('{}: best {:.1f} ms, median {:.1f} ms'.format(
+                module, min(times), statistics.median(times)))
+        if (module == 'ratp_poll.cli' and min(times) > budget):
+            click.echo('Over the budget of {} ms'.format(budget), err=True)
+            over_budget = True
+    if (over_budget):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""Benchmark of the gstbp response parser against the previous one."""
+import gc
+import json
+import pathlib
+import random
+import time
+
+import click
+
+from ratp_poll.ratp_api import parser
+
+DESTINATIONS = ['Porte d\'Auteuil', 'La Défense, Grande Arche',
+                'Gare de Lyon', 'Château de Vincennes', 'Pont de Levallois']
+MESSAGES = ['{} mn'.format(i) for i in range(1, 30)] + \
+           ['A l\'approche', 'A quai', 'Service terminé']
+
+
+def legacy_parse_stop_times(bodies):
+    """Parser used by get_stop_times_batch_parsed before the parser module,
+    including the decoding done by `response.text()`.
+    """
+    csv_array = []
+
+    for body in bodies:
+        stop = body.decode('utf-8')
+        try:
+            split_stop = stop.split('{', 1)
+        except AttributeError:
+            continue
+
+        if (len(split_stop) > 1):
+            stop = '{' + split_stop[1]
+
+        try:
+            stop_json = json.loads(stop)
+        except ValueError:
+            continue
+
+        try:
+            schedules = stop_json['result']['schedules']
+            metadata = stop_json['_metadata']
+            for schedule in schedules:
+                selected_fields = [
+                        metadata['date'],
+                        metadata['call'],
+                        schedule['message'].replace(' mn', ''),
+                        schedule['destination'],
+                        ]
+                row = ','.join(selected_fields)
+                csv_array.append(row)
+        except (KeyError, TypeError):
+            continue
+
+    return csv_array
+
+
+def parse_stop_times(bodies):
+    """Parse with the parser module."""
+    csv_formatter = parser.CSVFormatter()
+    csv_array = []
+    for body in bodies:
+        csv_array.extend(csv_formatter.format_rows(
+                            parser.parse_response(body)))
+    return csv_array
+
+
+def synthetic_response(index):
+    """Generate a response like the ones of the API."""
+    schedules = [{'message': random.choice(MESSAGES),
+                  'destination': random.choice(DESTINATIONS)}
+                 for _ in range(random.randint(1, 4))]
+    return json.dumps({
+        'result': {'schedules': schedules},
+        '_metadata': {
+            'call': 'GET /schedules/buses/{}/Station+{}/A'.format(
+                        index % 400, index),
+            'date': '2020-09-01T10:00:00+02:00',
+            'version': 4}}).encode('utf-8')
+
+
+def load_corpus(corpus_dir, size):
+    """Load the recorded responses of a directory (one per file) or generate
+    synthetic ones.
+    """
+    if (corpus_dir):
+        return [path.read_bytes()
+                for path in sorted(pathlib.Path(corpus_dir).iterdir())
+                if path.is_file()]
+    return [synthetic_response(i) for i in range(size)]
+
+
+def best_time(func, args, repeat):
+    """Best wall time of several runs, without the garbage collector."""
+    times = []
+    func(args)
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            t_1 = time.perf_counter()
+            func(args)
+            times.append(time.perf_counter() - t_1)
+    finally:
+        gc.enable()
+    return min(times)
+
+
+@click.command()
+@click.option('--corpus', type=click.Path(exists=True, file_okay=False),
+              help='Directory with one recorded response per file.')
+@click.option('--size', default=10000, show_default=True,
+              help='Synthetic responses to generate without --corpus.')
+@click.option('--repeat', default=5, show_default=True,
+              help='Runs per implementation (the best one is reported).')
+def main(corpus, size, repeat):
+    """Compare the parser module with the previous gstbp parser."""
+    bodies = load_corpus(corpus, size)
+
+    legacy_time = best_time(legacy_parse_stop_times, bodies, repeat)
+    parser_time = best_time(parse_stop_times, bodies, repeat)
+
+    click.echo('responses: {} json backend: {}'.format(
+                len(bodies), parser.json_backend))
+    click.echo('legacy: {:.4f} s ({:.1f} us/response)'.format(
+                legacy_time, legacy_time / len(bodies) * 1e6))
+    click.echo('parser: {:.4f} s ({:.1f} us/response)'.format(
+                parser_time, parser_time / len(bodies) * 1e6))
+    click.echo('speed-up: {:.2f}x'.format(legacy_time / parser_time))
+
+
+if __name__ == '__main__':
+    main()
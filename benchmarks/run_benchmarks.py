@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+
+"""Benchmarks of the fetching hot paths against a local stand-in API.
+
+Every scenario runs in its own process, so its peak RSS and CPU time are not
+mixed with the other ones, while the stand-in API runs in another one.
+"""
+import asyncio
+import csv
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import socket
+import sys
+import tempfile
+import time
+
+import click
+
+from ratp_poll.daemon import daemon
+from ratp_poll.ratp_api import log_writer, replay, stop_times, transport
+from server import serve
+
+SCENARIOS = ['gstb', 'gstbp', 'daemon']
+# Seconds between the checks of a running scenario process
+POLL_INTERVAL = 1.0
+
+
+def synthetic_queries(size):
+    """Generate distinct queries."""
+    return [('buses', str(i % 400), 'Station {}'.format(i), 'A')
+            for i in range(size)]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values."""
+    if (not values):
+        return None
+    index = max(0, int(round(fraction * len(values) + 0.5)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def read_fetch_log(path):
+    """Read the response times and outcomes of a fetch log."""
+    resp_times = []
+    timeouts = 0
+    connection_errors = 0
+    errors = 0
+    if (not os.path.exists(path)):
+        return resp_times, timeouts, connection_errors, errors
+    with open(path) as f:
+        for row in csv.DictReader(f):
+            if (row['timeout'] == 'True'):
+                timeouts += 1
+            elif (row['connection_error'] == 'True'):
+                connection_errors += 1
+            elif (row['resp_status'] != '200'):
+                errors += 1
+            else:
+                resp_times.append(float(row['resp_time']))
+    return sorted(resp_times), timeouts, connection_errors, errors
+
+
+def run_scenario(scenario, queries, fetch_conf, ticks, results):
+    """Run a scenario and put its metrics in the results queue.
+
+    With `http2` in fetch_conf, the scenario is named `<scenario>-http2`.
+    """
+    work_dir = tempfile.mkdtemp(prefix='ratp_poll_bench_')
+    fetch_conf = dict(fetch_conf, log=os.path.join(work_dir, 'fetch_log'))
+    output_file = os.path.join(work_dir, 'output')
+
+    cpu_1 = time.process_time()
+    t_1 = time.perf_counter()
+    if (scenario == 'gstb'):
+        for _ in range(ticks):
+            stop_times.get_stop_times_batch(queries, fetch_conf)
+    elif (scenario == 'gstbp'):
+        for _ in range(ticks):
+            stop_times.get_stop_times_batch_parsed(queries, fetch_conf)
+    elif (scenario == 'daemon'):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(daemon.run_persistent_daemon(
+                stop_times.iter_stop_times, queries, output_file, 0, 1,
+                [fetch_conf['max_connections']] * ticks, fetch_conf))
+    wall_time = time.perf_counter() - t_1
+    cpu_time = time.process_time() - cpu_1
+    log_writer.flush_fetch_logs()
+
+    resp_times, timeouts, connection_errors, errors = read_fetch_log(
+            fetch_conf['log'])
+    total = len(queries) * ticks
+    results.put({
+        'scenario': scenario + ('-http2' if fetch_conf.get('http2') else ''),
+        'queries': total,
+        'ok': len(resp_times),
+        'timeouts': timeouts,
+        'connection_errors': connection_errors,
+        'errors': errors,
+        'wall_time': wall_time,
+        'throughput': total / wall_time,
+        'latency_p50': percentile(resp_times, 0.50),
+        'latency_p95': percentile(resp_times, 0.95),
+        'latency_p99': percentile(resp_times, 0.99),
+        'cpu_per_1000': cpu_time / total * 1000,
+        # Kilobytes on Linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    })
+
+
+def collect_result(process, results, scenario_timeout):
+    """Wait for the result of a scenario process.
+
+    Returns:
+        dict: The result, or None if the process exited without one or did
+            not finish within scenario_timeout seconds (it is then killed).
+    """
+    deadline = time.monotonic() + scenario_timeout
+    while True:
+        try:
+            return results.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            pass
+        if (process.exitcode is not None):
+            # The result can arrive right after the process exits
+            try:
+                return results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                return None
+        if (time.monotonic() > deadline):
+            process.terminate()
+            return None
+
+
+def format_result(result):
+    """Summarize the result of a scenario in a line."""
+    def seconds(value):
+        return 'n/a' if value is None else '{:.4f} s'.format(value)
+
+    return ('{}: {:.1f} queries/s, p50 {}, p95 {}, p99 {}, {:.3f} CPU s/1000 '
+            'queries, peak RSS {} kB'.format(
+                result['scenario'], result['throughput'],
+                seconds(result['latency_p50']),
+                seconds(result['latency_p95']),
+                seconds(result['latency_p99']), result['cpu_per_1000'],
+                result['peak_rss_kb']))
+
+
+def wait_for_port(host, port, timeout=10):
+    """Wait until a TCP port accepts connections."""
+    deadline = time.monotonic() + timeout
+    while (time.monotonic() < deadline):
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('Stand-in API not listening on port ' + str(port))
+
+
+def compare(results, baseline_file, tolerance):
+    """Compare the results with a baseline results file.
+
+    Returns:
+        list: Descriptions of the regressions beyond the tolerance.
+    """
+    with open(baseline_file) as f:
+        baseline = {r['scenario']: r for r in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        base = baseline.get(result['scenario'])
+        if (base is None):
+            continue
+        checks = [('throughput', -1), ('latency_p99', 1),
+                  ('cpu_per_1000', 1), ('peak_rss_kb', 1)]
+        for metric, sign in checks:
+            if (base.get(metric) is None or result.get(metric) is None):
+                continue
+            change = (result[metric] - base[metric]) / base[metric]
+            if (sign * change > tolerance):
+                regressions.append('{} {}: {:.4g} -> {:.4g} ({:+.1%})'.format(
+                    result['scenario'], metric, base[metric],
+                    result[metric], change))
+    return regressions
+
+
+@click.command()
+@click.option('--queries', default=1000, show_default=True,
+              help='Queries per tick.')
+@click.option('--ticks', default=3, show_default=True,
+              help='Batches run per scenario.')
+@click.option('--scenario', 'scenarios', multiple=True,
+              type=click.Choice(SCENARIOS), help='Scenarios to run (all by '
+              'default).')
+@click.option('--max-connections', default=100, show_default=True)
+@click.option('--timeout', default=10, show_default=True)
+@click.option('--port', default=8089, show_default=True)
+@click.option('--latency', default='lognormal', show_default=True,
+              type=click.Choice(['constant', 'uniform', 'lognormal']))
+@click.option('--latency-mean', default=0.05, show_default=True)
+@click.option('--latency-sigma', default=0.5, show_default=True)
+@click.option('--error-rate', default=0.0, show_default=True)
+@click.option('--timeout-rate', default=0.0, show_default=True)
+@click.option('--schedules', default=2, show_default=True,
+              help='Schedules per answer (payload size).')
+@click.option('--limit-per-host', default=0, show_default=True)
+@click.option('--keepalive', default=15.0, show_default=True)
+@click.option('--dns-ttl', default=10, show_default=True)
+@click.option('--http2', 'compare_http2', is_flag=True,
+              help='Run every scenario with the HTTP/2 (httpx) transport '
+              'too.')
+@click.option('--api-url', help='Benchmark an external API (e.g. an HTTPS '
+              'endpoint speaking HTTP/2) instead of the local stand-in, '
+              'which only speaks HTTP/1.1.')
+@click.option('--replay', 'replay_file', type=click.Path(exists=True,
+                                                         dir_okay=False),
+              help='Serve the answers of a corpus recorded with `ratp_poll '
+              '--record` instead of the stand-in API, fetching its queries.')
+@click.option('--replay-speed', default=1.0, show_default=True,
+              help='Divide the recorded latencies (0 to answer '
+              'immediately).')
+@click.option('--output', default='bench_results.json', show_default=True,
+              type=click.Path(dir_okay=False, writable=True),
+              help='Machine-readable results file.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False),
+              help='Results file to compare with. Exits with 1 on '
+              'regressions.')
+@click.option('--tolerance', default=0.1, show_default=True,
+              help='Relative change accepted against the baseline.')
+@click.option('--scenario-timeout', default=3600, show_default=True,
+              help='Seconds after which a scenario is killed.')
+def main(queries, ticks, scenarios, max_connections, timeout, port, latency,
+         latency_mean, latency_sigma, error_rate, timeout_rate, schedules,
+         limit_per_host, keepalive, dns_ttl, compare_http2, api_url,
+         replay_file, replay_speed, output, baseline, tolerance,
+         scenario_timeout):
+    """Benchmark gstb, gstbp and the persistent daemon against a local
+    stand-in of the RATP API.
+    """
+    api_conf = {
+        'latency': latency,
+        'latency_mean': latency_mean,
+        'latency_sigma': latency_sigma,
+        'error_rate': error_rate,
+        'timeout_rate': timeout_rate,
+        'timeout_delay': timeout * 2,
+        'schedules': schedules,
+    }
+    if (compare_http2 and replay_file is not None):
+        raise click.UsageError('--http2 does not support --replay.')
+    if (compare_http2 and not transport.http2_available()):
+        raise click.UsageError('--http2 needs httpx[http2] installed.')
+    server = None
+    if (replay_file is not None):
+        api_url = None
+    elif (api_url is None):
+        server = multiprocessing.Process(target=serve, kwargs=dict(
+                api_conf, host='127.0.0.1', port=port), daemon=True)
+        server.start()
+        api_url = 'http://127.0.0.1:{}/v4/schedules/'.format(port)
+    try:
+        if (server is not None):
+            wait_for_port('127.0.0.1', port)
+        fetch_conf = {
+            'log': None,
+            'timeout': timeout,
+            'max_connections': max_connections,
+            'limit_per_host': limit_per_host,
+            'keepalive': keepalive,
+            'dns_ttl': dns_ttl,
+            'api_url': api_url,
+        }
+        query_list = synthetic_queries(queries)
+        if (replay_file is not None):
+            del fetch_conf['api_url']
+            fetch_conf['replay_file'] = replay_file
+            fetch_conf['replay_speed'] = replay_speed
+            query_list = replay.get_corpus(replay_file).queries()
+            queries = len(query_list)
+        transports = [fetch_conf]
+        if (compare_http2):
+            transports.append(dict(fetch_conf, http2=True))
+        results = []
+        failed = []
+        for scenario in (scenarios or SCENARIOS):
+            for scenario_conf in transports:
+                results_queue = multiprocessing.Queue()
+                process = multiprocessing.Process(
+                        target=run_scenario,
+                        args=(scenario, query_list, scenario_conf, ticks,
+                              results_queue))
+                process.start()
+                result = collect_result(process, results_queue,
+                                        scenario_timeout)
+                process.join()
+                if (result is None):
+                    name = scenario + ('-http2' if scenario_conf.get('http2')
+                                       else '')
+                    failed.append(name)
+                    click.echo('{}: failed (exit code {})'.format(
+                            name, process.exitcode), err=True)
+                    continue
+                results.append(result)
+                click.echo(format_result(result))
+    finally:
+        if (server is not None):
+            server.terminate()
+
+    with open(output, 'w') as f:
+        json.dump({'config': dict(api_conf, queries=queries, ticks=ticks,
+                                  max_connections=max_connections,
+                                  timeout=timeout,
+                                  limit_per_host=limit_per_host,
+                                  keepalive=keepalive, dns_ttl=dns_ttl,
+                                  api_url=api_url, replay=replay_file,
+                                  replay_speed=replay_speed),
+                   'results': results}, f, indent=2)
+
+    if (baseline):
+        regressions = compare(results, baseline, tolerance)
+        for regression in regressions:
+            click.echo('Regression: ' + regression, err=True)
+        if (regressions):
+            sys.exit(1)
+    if (failed):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
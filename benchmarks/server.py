@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""Local stand-in of the RATP schedules API for the benchmarks."""
+import asyncio
+import json
+import math
+import random
+
+import click
+from aiohttp import web
+
+DESTINATIONS = ['Porte d\'Auteuil', 'La Défense, Grande Arche',
+                'Gare de Lyon', 'Château de Vincennes', 'Pont de Levallois']
+
+
+class StandInAPI:
+    """Stand-in of `/v4/schedules/{type}/{line}/{station}/{way}` and
+    `/v4/stations/{type}/{line}`.
+
+    Arguments:
+        latency (str): Latency distribution: `constant`, `uniform` or
+            `lognormal`.
+        latency_mean (float): Mean latency in seconds.
+        latency_sigma (float): Spread of the latency (half-width for
+            `uniform`, sigma of the underlying normal for `lognormal`).
+        error_rate (float): Fraction of answers with a 500 status.
+        timeout_rate (float): Fraction of requests answered after
+            `timeout_delay` seconds, to trigger the client timeouts.
+        timeout_delay (float): Delay of the timed out requests.
+        schedules (int): Schedules per answer, setting the payload size.
+        stations (int): Stations of every line.
+        seed (int): Seed of the random generator.
+    """
+
+    def __init__(self, latency='lognormal', latency_mean=0.05,
+                 latency_sigma=0.5, error_rate=0.0, timeout_rate=0.0,
+                 timeout_delay=60.0, schedules=2, stations=20, seed=None):
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_delay = timeout_delay
+        self.schedules = schedules
+        self.stations = stations
+        self.random = random.Random(seed)
+
+    def delay(self):
+        """Draw the latency of a request."""
+        if (self.timeout_rate and self.random.random() < self.timeout_rate):
+            return self.timeout_delay
+        if (self.latency == 'constant'):
+            return self.latency_mean
+        if (self.latency == 'uniform'):
+            return max(0.0, self.random.uniform(
+                    self.latency_mean - self.latency_sigma,
+                    self.latency_mean + self.latency_sigma))
+        # Log-normal with the given mean
+        mu = math.log(self.latency_mean) - self.latency_sigma ** 2 / 2
+        return self.random.lognormvariate(mu, self.latency_sigma)
+
+    def body(self, match_info):
+        """Answer like the API does."""
+        call = 'GET /schedules/{type}/{line}/{station}/{way}'.format(
+                **match_info)
+        schedules = [{'message': '{} mn'.format(self.random.randint(1, 30)),
+                      'destination': self.random.choice(DESTINATIONS)}
+                     for _ in range(self.schedules)]
+        return json.dumps({
+            'result': {'schedules': schedules},
+            '_metadata': {'call': call,
+                          'date': '2020-09-01T10:00:00+02:00',
+                          'version': 4}})
+
+    async def schedules_handler(self, request):
+        """Handle a schedules request."""
+        await asyncio.sleep(self.delay())
+        if (self.error_rate and self.random.random() < self.error_rate):
+            return web.json_response({'result': {'code': 500}}, status=500)
+        return web.Response(text=self.body(request.match_info),
+                            content_type='application/json')
+
+    async def stations_handler(self, request):
+        """Handle a stations request, naming the stations by number."""
+        stations = [{'name': 'Station {}'.format(i),
+                     'slug': 'station+{}'.format(i)}
+                    for i in range(1, self.stations + 1)]
+        return web.json_response({
+            'result': {'stations': stations},
+            '_metadata': {'call': 'GET /stations/{type}/{line}'.format(
+                                  **request.match_info),
+                          'date': '2020-09-01T10:00:00+02:00',
+                          'version': 4}})
+
+    def app(self):
+        """Build the aiohttp application."""
+        app = web.Application()
+        app.router.add_get('/v4/schedules/{type}/{line}/{station}/{way}',
+                           self.schedules_handler)
+        app.router.add_get('/v4/stations/{type}/{line}',
+                           self.stations_handler)
+        return app
+
+
+def serve(host='127.0.0.1', port=8080, **api_conf):
+    """Run the stand-in API until interrupted.
+
+    Arguments:
+        host (str): Listening address.
+        port (int): Listening port.
+        **api_conf: StandInAPI arguments.
+    """
+    web.run_app(StandInAPI(**api_conf).app(), host=host, port=port,
+                print=None)
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=8080, show_default=True)
+@click.option('--latency', default='lognormal', show_default=True,
+              type=click.Choice(['constant', 'uniform', 'lognormal']))
+@click.option('--latency-mean', default=0.05, show_default=True)
+@click.option('--latency-sigma', default=0.5, show_default=True)
+@click.option('--error-rate', default=0.0, show_default=True)
+@click.option('--timeout-rate', default=0.0, show_default=True)
+@click.option('--timeout-delay', default=60.0, show_default=True)
+@click.option('--schedules', default=2, show_default=True)
+@click.option('--stations', default=20, show_default=True)
+def main(host, port, **api_conf):
+    """Run a local stand-in of the RATP schedules API."""
+    serve(host, port, **api_conf)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,15 @@
-"""Console script for ratp_poll."""
+"""Console script for ratp_poll.
+
+Only the light modules are imported at start up: the fetching modules (and
+aiohttp), the daemon and the output formats are imported by the commands
+that need them, so `--help` and `gst` start fast.
+"""
 import sys
 import click
 import click_log
-from csv import reader
-from ratp_poll.ratp_api import stop_times
-from ratp_poll.daemon import daemon
+from datetime import datetime
+from ratp_poll.ratp_api import API_URL
 import random
-import pathlib
-from filelock import FileLock
 import logging
 
 logging.basicConfig(stream=sys.stderr)
@@ -16,6 +18,38 @@ click_log.basic_config(logger)
 
 # Dictionary with configuration parameters for fetching the content
 fetch_conf = {}
+# Dictionary with configuration parameters for loading the stops files
+stops_conf = {}
+
+
+def parse_type_values(ctx, param, values):
+    """Parse TYPE=VALUE option values (e.g. of --type-rate).
+
+    Returns:
+        dict: Values by transport type.
+    """
+    rates = {}
+    for value in values:
+        transport_type, _, rate = value.partition('=')
+        try:
+            rates[transport_type] = float(rate)
+        except ValueError:
+            raise click.BadParameter('expected TYPE=' + param.metavar
+                                     .partition('=')[2] + ', got ' + value)
+    return rates
+
+
+def check_positive_values(ctx, param, values):
+    """Check that option values (e.g. of --api-weight) are positive.
+
+    Returns:
+        tuple: The values.
+    """
+    for value in values:
+        if (not value > 0):
+            raise click.BadParameter('expected a positive number, got '
+                                     + str(value))
+    return values
 
 
 @click.group(context_settings=dict(help_option_names=["-h", "--help"]))
@@ -25,17 +59,153 @@ fetch_conf = {}
                               file_okay=True,
                               dir_okay=False,
                               writable=True), default=None)
+@click.option('--log-buffer', nargs=1, help='Fetch log lines buffered '
+              'in memory before writing them in bulk.', type=click.INT,
+              default=1000, show_default=True)
 @click.option('--timeout', nargs=1, help='Fetching timeout in seconds per '
-              'session.', type=click.INT, default=40, show_default=True)
+              'request.', type=click.INT, default=40, show_default=True)
 @click.option('--max-connections', nargs=1, help='Maximum simultaneous '
               'connections per fetching process.', type=click.INT,
               default=100, show_default=True)
-def main(fetch_log, timeout, max_connections):
+@click.option('--cache-ttl', nargs=1, help='Cache the responses for the given '
+              'seconds, sharing the concurrent requests of the same query. '
+              'With 0 only the concurrent requests are shared.',
+              type=click.FLOAT, default=None)
+@click.option('--cache-size', nargs=1, help='Maximum cached responses.',
+              type=click.INT, default=4096, show_default=True)
+@click.option('--adaptive', is_flag=True, help='Adapt the simultaneous '
+              'requests to the response times, timeouts and connection '
+              'errors, up to --max-connections.')
+@click.option('--api-url', nargs=1, multiple=True, help='Base URL of the '
+              'schedules API. Can be repeated to balance the requests among '
+              'several ones (e.g. mirrors).', default=[API_URL],
+              show_default=True)
+@click.option('--api-weight', nargs=1, multiple=True, help='Weight of every '
+              '--api-url, in the same order.', type=click.FLOAT,
+              callback=check_positive_values)
+@click.option('--balance', nargs=1, help='Balancing policy of several '
+              '--api-url: least-outstanding (fewest requests in flight for '
+              'their weight) or weighted (round robin). --max-connections is '
+              'then the limit of every one.',
+              type=click.Choice(['least-outstanding', 'weighted']),
+              metavar='POLICY', default='least-outstanding',
+              show_default=True)
+@click.option('--cooldown', nargs=1, help='Seconds an --api-url failing '
+              'repeatedly is avoided.', type=click.FLOAT, default=30,
+              show_default=True)
+@click.option('--shards', nargs=1, help='Split every batch among the given '
+              'fetching processes.', type=click.INT, default=1,
+              show_default=True)
+@click.option('--retries', nargs=1, help='Retries of the requests that time '
+              'out, fail to connect or get a 429 or 5xx answer.',
+              type=click.INT, default=0, show_default=True)
+@click.option('--backoff', nargs=1, help='Base delay in seconds of the '
+              'exponential backoff (with jitter) between retries.',
+              type=click.FLOAT, default=0.1, show_default=True)
+@click.option('--connect-timeout', nargs=1, help='Connection timeout in '
+              'seconds per request.', type=click.FLOAT, default=None)
+@click.option('--read-timeout', nargs=1, help='Timeout in seconds between '
+              'reads of an answer.', type=click.FLOAT, default=None)
+@click.option('--deadline', nargs=1, help='Time budget in seconds of every '
+              'batch (capped to the daemon interval). No request or retry is '
+              'started past it.', type=click.FLOAT, default=None)
+@click.option('--rate-limit', nargs=1, help='Maximum requests per second, '
+              'shared by every fetching process.', type=click.FLOAT,
+              default=None)
+@click.option('--type-rate', nargs=1, multiple=True, help='Maximum '
+              'requests per second of a transport type (e.g. buses=20). Can '
+              'be repeated.', metavar='TYPE=RATE',
+              callback=parse_type_values)
+@click.option('--rate-burst', nargs=1, help='Requests allowed at once after '
+              'an idle period, in seconds of the rate limits.',
+              type=click.FLOAT, default=1.0, show_default=True)
+@click.option('--limit-per-host', nargs=1, help='Maximum simultaneous '
+              'connections per host (0 for no limit).', type=click.INT,
+              default=0, show_default=True)
+@click.option('--dns-ttl', nargs=1, help='Seconds the DNS answers are '
+              'cached.', type=click.INT, default=10, show_default=True)
+@click.option('--keepalive', nargs=1, help='Seconds an idle connection is '
+              'kept open.', type=click.FLOAT, default=15, show_default=True)
+@click.option('--http2', is_flag=True, help='Multiplex the requests over '
+              'HTTP/2 connections (needs httpx[http2]).')
+@click.option('--stops-cache', is_flag=True, help='Cache the validated '
+              'queries of the stops files next to them, until they change.')
+@click.option('--catalogue-ttl', nargs=1, help='Seconds the stations of '
+              'the lines are cached next to the stops files, to expand their '
+              'rows with * as station name.', type=click.FLOAT,
+              default=86400, show_default=True)
+@click.option('--merge-ways', is_flag=True, help='Request the A and R ways '
+              'of a line at a station at once (A+R).')
+@click.option('--record', nargs=1, help='Append every API answer to a '
+              'corpus file, to be replayed with --replay.',
+              type=click.Path(dir_okay=False, writable=True), default=None)
+@click.option('--replay', nargs=1, help='Serve the answers of a corpus '
+              'recorded with --record instead of requesting the API.',
+              type=click.Path(exists=True, dir_okay=False, readable=True),
+              default=None)
+@click.option('--replay-speed', nargs=1, help='Divide the recorded latencies '
+              'of --replay (0 to answer immediately).', type=click.FLOAT,
+              default=1, show_default=True)
+@click.option('--profile', is_flag=True, help='Log the time spent in every '
+              'phase (connect, request, body read, parsing, output...) of '
+              'every tick or batch.')
+@click.option('--profile-dir', nargs=1, help='With --profile, dump the '
+              'cProfile stats of every daemon tick to the given directory.',
+              type=click.Path(file_okay=False, writable=True), default=None)
+def main(fetch_log, log_buffer, timeout, max_connections, cache_ttl,
+         cache_size, adaptive, api_url, api_weight, balance, cooldown,
+         shards, retries, backoff, connect_timeout, read_timeout, deadline,
+         rate_limit,
+         type_rate, rate_burst, limit_per_host, dns_ttl, keepalive, http2,
+         stops_cache, catalogue_ttl, merge_ways, record, replay,
+         replay_speed, profile, profile_dir):
     """Console script for ratp_poll.
     """
     fetch_conf['log'] = fetch_log
+    fetch_conf['log_buffer'] = log_buffer
     fetch_conf['timeout'] = timeout
     fetch_conf['max_connections'] = max_connections
+    fetch_conf['cache_ttl'] = cache_ttl
+    fetch_conf['cache_size'] = cache_size
+    fetch_conf['adaptive_concurrency'] = adaptive
+    if (api_weight and len(api_weight) != len(api_url)):
+        raise click.UsageError('Pass an --api-weight for every --api-url.')
+    fetch_conf['api_url'] = api_url[0]
+    fetch_conf['api_urls'] = list(api_url)
+    fetch_conf['api_weights'] = list(api_weight) or None
+    fetch_conf['balance'] = balance
+    fetch_conf['cooldown'] = cooldown
+    fetch_conf['shards'] = shards
+    fetch_conf['retries'] = retries
+    fetch_conf['backoff'] = backoff
+    fetch_conf['connect_timeout'] = connect_timeout
+    fetch_conf['read_timeout'] = read_timeout
+    fetch_conf['budget'] = deadline
+    fetch_conf['rate_limit'] = rate_limit
+    fetch_conf['type_rate_limits'] = type_rate
+    fetch_conf['rate_burst'] = rate_burst
+    fetch_conf['limit_per_host'] = limit_per_host
+    fetch_conf['dns_ttl'] = dns_ttl
+    fetch_conf['keepalive'] = keepalive
+    if (http2):
+        from ratp_poll.ratp_api import transport
+        if (not transport.http2_available()):
+            raise click.UsageError('--http2 needs httpx[http2] installed.')
+    fetch_conf['http2'] = http2
+    if (replay and (record or http2)):
+        raise click.UsageError('--replay does not support --record and '
+                               '--http2.')
+    fetch_conf['record_file'] = record
+    fetch_conf['replay_file'] = replay
+    fetch_conf['replay_speed'] = replay_speed
+    fetch_conf['profile'] = profile
+    fetch_conf['profile_dir'] = profile_dir if profile else None
+    stops_conf['cache'] = stops_cache
+    stops_conf['catalogue_ttl'] = catalogue_ttl
+    stops_conf['merge_ways'] = merge_ways
+    if (rate_limit or type_rate):
+        from ratp_poll.ratp_api import ratelimit
+        fetch_conf['rate_limit_file'] = ratelimit.default_state_file()
 
 
 @click.command(name='gst',
@@ -48,6 +218,7 @@ def main(fetch_log, timeout, max_connections):
 def get_stop_times(transport_type, line_code, station_name, way):
     """Wrapper around stop_times.get_stop_times
     """
+    from ratp_poll.ratp_api import stop_times
     query = (transport_type, line_code, station_name, way)
     logger.debug("query: "+str(query))
     json, time = stop_times.get_stop_times((query), fetch_conf)
@@ -59,21 +230,41 @@ main.add_command(get_stop_times)
 
 
 def load_stops_file(stops_file):
-    """Read file with stop codes (one by line) to array.
+    """Read file with stop codes (one by line) to array, validating and
+    deduplicating the queries, and plan their requests with planner.
 
     Keyword arguments:
         stops_file (str): Path to the file containing the queries in CSV
             format. The column order is:  `transport_type, line_code,
-            station_name, way`.
+            station_name, way[, interval]`. A `*` station name asks for
+            every station of the line.
 
     Returns:
-        list: List of tuples with the queries' parameters.
+        list: List of query_index.Query with the queries' parameters.
     """
+    from ratp_poll.ratp_api import query_index
+
     logger.debug("stops_file: "+str(stops_file))
 
-    with open(stops_file) as f:
-        csv_reader = reader(f)
-        list_of_tuples = list(map(tuple, csv_reader))
+    try:
+        list_of_tuples = query_index.load_queries(
+                stops_file, cache=stops_conf.get('cache', False))
+    except query_index.StopsFileError as e:
+        raise click.ClickException('Invalid stops file:\n' + str(e))
+
+    if (stops_conf.get('merge_ways') or any(
+            query.station_name == '*' for query in list_of_tuples)):
+        from ratp_poll.ratp_api import planner
+
+        catalogue = planner.StationCatalogue(
+                stops_file + planner.CATALOGUE_EXTENSION,
+                stops_conf.get('catalogue_ttl', planner.CATALOGUE_TTL))
+        try:
+            list_of_tuples = planner.plan_queries(
+                    list_of_tuples, catalogue, fetch_conf,
+                    merge=stops_conf.get('merge_ways', False))
+        except planner.CatalogueError as e:
+            raise click.ClickException(str(e))
 
     logger.debug("queries: "+str(list_of_tuples))
     random.shuffle(list_of_tuples)
@@ -98,9 +289,17 @@ def get_stop_times_batch(stops_file):
             station_name, way`.
     """
     queries = load_stops_file(stops_file)
-    json_array, total_time = stop_times.get_stop_times_batch(queries,
-                                                             fetch_conf)
-    print('\n'.join(json_array))
+    dt_1 = datetime.now()
+    if (fetch_conf['shards'] > 1):
+        from ratp_poll.ratp_api import sharding
+        json_stream = sharding.stream_stop_times_batch_sharded(queries,
+                                                               fetch_conf)
+    else:
+        from ratp_poll.ratp_api import stop_times
+        json_stream = stop_times.stream_stop_times_batch(queries, fetch_conf)
+    for json in json_stream:
+        print(json)
+    total_time = (datetime.now() - dt_1).total_seconds()
     logger.info("Requests total time: " + str(total_time) + " s")
 
 
@@ -122,9 +321,18 @@ def get_stop_times_batch_parsed(stops_file):
     stops_file -- path to the file containing the stop codes (one by line)
     """
     cod_stops = load_stops_file(stops_file)
-    csv_array, total_time = stop_times.get_stop_times_batch_parsed(cod_stops,
-                                                                   fetch_conf)
-    print('\n'.join(csv_array))
+    dt_1 = datetime.now()
+    if (fetch_conf['shards'] > 1):
+        from ratp_poll.ratp_api import sharding
+        csv_stream = sharding.stream_stop_times_batch_parsed_sharded(
+                        cod_stops, fetch_conf)
+    else:
+        from ratp_poll.ratp_api import stop_times
+        csv_stream = stop_times.stream_stop_times_batch_parsed(cod_stops,
+                                                               fetch_conf)
+    for row in csv_stream:
+        print(row)
+    total_time = (datetime.now() - dt_1).total_seconds()
     logger.info("Requests total time: " + str(total_time) + " s")
 
 
@@ -139,10 +347,68 @@ main.add_command(get_stop_times_batch_parsed)
               '(Default: 60)', default=60, type=click.INT)
 @click.option('--processes', nargs=1, help='Maximum spawned fetching '
               'processes. (Default: 5)', default=5, type=click.INT)
+@click.option('--max-pending', nargs=1, help='Maximum running or waiting '
+              'ticks of the process pool daemon. (Default: --processes)',
+              type=click.INT, default=None)
+@click.option('--overrun', help='What to do with a tick due while '
+              '--max-pending ticks are pending: skip it, coalesce the skipped '
+              'ones into a tick run as soon as possible, or delay it.',
+              type=click.Choice(['skip', 'coalesce', 'delay']),
+              default='skip', show_default=True)
+@click.option('--persistent', is_flag=True, help='Run every tick in a single '
+              'long-lived event loop reusing the HTTP connections instead of '
+              'spawning a process per tick. --processes then limits the '
+              'simultaneously running ticks.')
 @click.option('--max-conn-test', nargs=4, help='Test different maximum '
               '(simultaneous) connections in random order. Pass 4 integer '
               'values: start, stop, step and repetition (e.g. 5 101 5 1).',
               type=click.INT)
+@click.option('--format', 'output_format', help='Output format. segments '
+              'writes the text of every tick to its own file without locking, '
+              'to be appended by the compact command. raw writes the answers '
+              'as received, without decoding them (gstb only). columnar '
+              'writes every tick as a compressed row group of typed columns '
+              '(gstbp only).',
+              type=click.Choice(['text', 'segments', 'raw', 'columnar']),
+              default='text', show_default=True)
+@click.option('--framing', help='Framing of the raw format records: a '
+              'trailing newline or a 4 bytes big-endian length prefix.',
+              type=click.Choice(['newline', 'length']), default='newline',
+              show_default=True)
+@click.option('--rotate-interval', nargs=1, help='Start a new columnar output '
+              'file every given seconds.', type=click.INT, default=None)
+@click.option('--rotate-size', nargs=1, help='Start a new columnar output '
+              'file once the current one reaches the given bytes.',
+              type=click.INT, default=None)
+@click.option('--metrics-port', nargs=1, help='Serve the request and tick '
+              'metrics in the Prometheus text format on '
+              'http://127.0.0.1:PORT/metrics (needs --persistent).',
+              type=click.INT, default=None)
+@click.option('--metrics-file', nargs=1, help='Dump the request and tick '
+              'metrics in the Prometheus text format to a file after every '
+              'tick (needs --persistent).',
+              type=click.Path(dir_okay=False, writable=True), default=None)
+@click.option('--changes-only', is_flag=True, help='Only write the stop '
+              'times of the schedules that changed since the previous tick '
+              '(gstbp, needs --persistent).')
+@click.option('--snapshot-every', nargs=1, help='With --changes-only, write '
+              'every stop time once every given ticks.', type=click.INT,
+              default=0)
+@click.option('--scheduled', is_flag=True, help='Poll every query when it '
+              'is due instead of all of them every interval (needs '
+              '--persistent). The interval is the default one, the one of '
+              'the transport type or a 5th column of the stops file.')
+@click.option('--type-interval', nargs=1, multiple=True, help='With '
+              '--scheduled, interval in seconds of a transport type (e.g. '
+              'noctiliens=300). Can be repeated.', metavar='TYPE=SECONDS',
+              callback=parse_type_values)
+@click.option('--adaptive-interval', is_flag=True, help='With --scheduled, '
+              'poll every query again shortly before its next vehicle is '
+              'due.')
+@click.option('--min-interval', nargs=1, help='Minimum adaptive interval in '
+              'seconds.', type=click.FLOAT, default=10, show_default=True)
+@click.option('--max-interval', nargs=1, help='Maximum adaptive interval in '
+              'seconds.', type=click.FLOAT, default=600, show_default=True)
 @click.argument('function', nargs=1,
                 type=click.Choice(
                             ['gstb', 'gstbp'],
@@ -157,7 +423,11 @@ main.add_command(get_stop_times_batch_parsed)
                                                dir_okay=False,
                                                writable=True))
 def start_daemon(function, stops_file, output_file, interval, processes,
-                 max_conn_test):
+                 max_pending, overrun, persistent, max_conn_test,
+                 output_format, framing, rotate_interval, rotate_size,
+                 metrics_port, metrics_file, changes_only, snapshot_every,
+                 scheduled, type_interval, adaptive_interval, min_interval,
+                 max_interval):
     """Wrapper around daemon.start_daemon
 
     Keyword arguments:
@@ -166,13 +436,76 @@ def start_daemon(function, stops_file, output_file, interval, processes,
     output_file -- path to the file were to append the results
     interval -- period of the daemon in seconds
     processes -- maximum spawned fetching processes
+    max_pending -- maximum pending ticks of the process pool daemon
+    overrun -- policy for the ticks due with max_pending pending ones
+    persistent -- run every tick in a single long-lived event loop
     max_conn_test -- Test different maximum (simultaneous) connections in
                      random order. Pass 4 integer values: start, stop, step
                      and repetition (e.g. 5 101 5 1).
+    output_format -- output format (text, segments, raw or columnar)
+    framing -- framing of the raw format records (newline or length)
+    rotate_interval -- seconds after which a new columnar file is started
+    rotate_size -- bytes after which a new columnar file is started
+    metrics_port -- port where to serve the metrics
+    metrics_file -- path to the file where to dump the metrics every tick
+    changes_only -- only write the schedules that changed
+    snapshot_every -- ticks between full snapshots with changes_only
+    scheduled -- poll every query when it is due
+    type_interval -- interval in seconds by transport type
+    adaptive_interval -- derive the intervals from the remaining minutes
+    min_interval -- minimum adaptive interval in seconds
+    max_interval -- maximum adaptive interval in seconds
     """
+    import functools
+    import pathlib
+    from filelock import FileLock
+    from ratp_poll.daemon import daemon, scheduler
+    from ratp_poll.ratp_api import sharding, stop_times
+
+    if (fetch_conf['shards'] > 1 and not persistent):
+        raise click.UsageError('--shards needs --persistent in the daemon.')
+    if (scheduled and (not persistent or fetch_conf['shards'] > 1)):
+        raise click.UsageError('--scheduled needs --persistent and does not '
+                               'support --shards.')
+    if ((metrics_port or metrics_file) and not persistent):
+        raise click.UsageError('--metrics-port and --metrics-file need '
+                               '--persistent.')
+    output_conf = {
+        'format': output_format,
+        'framing': framing,
+        'rotate_interval': rotate_interval,
+        'rotate_size': rotate_size,
+        'metrics_port': metrics_port,
+        'metrics_file': metrics_file,
+    }
+    fetch_conf['metrics'] = bool(metrics_port or metrics_file)
+    if (changes_only):
+        # The index of the last schedules must outlive the ticks
+        if (not persistent or function != 'gstbp'
+                or output_format == 'columnar' or fetch_conf['shards'] > 1):
+            raise click.UsageError('--changes-only needs gstbp, --persistent '
+                                   'and a text format without --shards.')
+        fetch_conf['changes_only'] = True
+        fetch_conf['snapshot_every'] = snapshot_every
     logger.info("Starting daemon...")
-    if (function == 'gstb'):
-        func = stop_times.get_stop_times_batch
+    if (output_format == 'columnar'):
+        if (function != 'gstbp'):
+            raise click.UsageError('The columnar format needs gstbp.')
+        if (fetch_conf['shards'] > 1):
+            raise click.UsageError('The columnar format does not support '
+                                   '--shards.')
+        fetch_conf['raw_body'] = True
+        func = stop_times.stream_query_responses
+        async_func = stop_times.iter_query_responses
+    elif (output_format == 'raw' and function != 'gstb'):
+        raise click.UsageError('The raw format needs gstb.')
+    elif (function == 'gstb'):
+        if (output_format == 'raw'):
+            fetch_conf['raw_body'] = True
+        func = stop_times.stream_stop_times_batch
+        async_func = stop_times.iter_responses
+        if (fetch_conf['shards'] > 1):
+            async_func = sharding.iter_responses_sharded
     elif (function == 'gstbp'):
         path_exists = pathlib.Path(output_file).exists()
         print(path_exists)
@@ -180,15 +513,153 @@ def start_daemon(function, stops_file, output_file, interval, processes,
             with FileLock(output_file + '.lock', timeout=60):
                 with open(output_file, 'a+') as f:
                     f.write(stop_times.gstbp_csv_columns)
-        func = stop_times.get_stop_times_batch_parsed
+        func = stop_times.stream_stop_times_batch_parsed
+        async_func = stop_times.iter_stop_times
+        if (fetch_conf['shards'] > 1):
+            async_func = sharding.iter_stop_times_sharded
 
     cod_stops = load_stops_file(stops_file)
-    daemon.start_daemon(func, (cod_stops), output_file, interval, processes,
-                        max_conn_test, fetch_conf)
+    if (scheduled):
+        queries, query_intervals = scheduler.split_query_intervals(cod_stops)
+        poll_scheduler = scheduler.PollScheduler(
+                queries, interval, type_interval, query_intervals,
+                adaptive_interval, min_interval, max_interval)
+        item = 'response'
+        if (output_format == 'columnar'):
+            item = 'query_response'
+        elif (output_format == 'raw'):
+            item = 'raw_response'
+        elif (function == 'gstbp'):
+            item = 'stop_times'
+        daemon.start_scheduled_daemon(
+                functools.partial(scheduler.iter_scheduled,
+                                  scheduler=poll_scheduler, item=item),
+                poll_scheduler, output_file, processes, fetch_conf,
+                output_conf)
+    elif (persistent):
+        daemon.start_persistent_daemon(async_func, (cod_stops), output_file,
+                                       interval, processes, max_conn_test,
+                                       fetch_conf, output_conf)
+    else:
+        daemon.start_daemon(func, (cod_stops), output_file, interval,
+                            processes, max_conn_test, fetch_conf, output_conf,
+                            max_pending, overrun)
 
 
 main.add_command(start_daemon)
 
 
+@click.command(name='dump',
+               help="Print the stop times of columnar daemon output files in "
+               "CSV format."
+               )
+@click.argument('files', nargs=-1, required=True,
+                type=click.Path(exists=True, file_okay=True, dir_okay=False,
+                                readable=True))
+def dump_columnar(files):
+    """Wrapper around columnar.read_rows
+
+    Keyword arguments:
+    files -- paths to the columnar output files
+    """
+    import csv
+    from ratp_poll.daemon import columnar
+
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    writer.writerow([name for name, column_type in columnar.COLUMNS])
+    for path in files:
+        for row in columnar.read_rows(path):
+            writer.writerow((datetime.fromtimestamp(row[0]).isoformat(),)
+                            + row[1:])
+
+
+main.add_command(dump_columnar)
+
+
+@click.command(name='compact',
+               help="Append the segments written by a daemon with --format "
+               "segments to its output file."
+               )
+@click.argument('output_file', type=click.Path(exists=False,
+                                               file_okay=True,
+                                               dir_okay=False,
+                                               writable=True))
+def compact(output_file):
+    """Wrapper around output.compact_segments
+
+    Keyword arguments:
+    output_file -- path to the output file of the daemon
+    """
+    from ratp_poll.daemon import output
+
+    segments = output.compact_segments(output_file)
+    logger.info("Compacted %d segments", segments)
+
+
+main.add_command(compact)
+
+
+@click.command(name='analyze',
+               help="Print the latency percentiles, error rates and "
+               "throughput of fetch logs by max_connections and transport "
+               "type in CSV format, and recommend a max_connections value."
+               )
+@click.option('--chunk-size', nargs=1, help='Bytes of the logs read at '
+              'once.', type=click.INT, default=16 * 1024 * 1024,
+              show_default=True)
+@click.option('--max-error-rate', nargs=1, help='Maximum share of failed '
+              'requests of a recommended value.', type=click.FLOAT,
+              default=0.01, show_default=True)
+@click.option('--tolerance', nargs=1, help='Recommend the lowest value whose '
+              'throughput is at least the given share of the best one.',
+              type=click.FLOAT, default=0.95, show_default=True)
+@click.argument('files', nargs=-1, required=True,
+                type=click.Path(exists=True, file_okay=True, dir_okay=False,
+                                readable=True))
+def analyze_fetch_logs(chunk_size, max_error_rate, tolerance, files):
+    """Wrapper around analysis.analyze
+
+    Keyword arguments:
+    chunk_size -- bytes of the logs read at once
+    max_error_rate -- maximum error rate of a recommended value
+    tolerance -- share of the best throughput that is enough
+    files -- paths to the fetch log files
+    """
+    import csv
+    from ratp_poll.ratp_api import analysis
+
+    def round_value(value):
+        return None if value is None else round(value, 4)
+
+    summary = analysis.summarize(analysis.analyze(files, chunk_size))
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    writer.writerow(['max_connections', 'transport_type', 'requests',
+                     'timeout_rate', 'connection_error_rate', 'error_rate',
+                     'p50', 'p90', 'p99', 'throughput', 'little_throughput'])
+    for max_connections, transport_type, group in summary:
+        writer.writerow([max_connections, transport_type, group.requests,
+                         round_value(group.timeouts / group.requests),
+                         round_value(group.connection_errors
+                                     / group.requests),
+                         round_value(group.error_rate)]
+                        + [round_value(group.percentile(q))
+                           for q in (50, 90, 99)]
+                        + [round_value(group.throughput),
+                           round_value(group.little_throughput)])
+    recommended = analysis.recommend(summary, max_error_rate, tolerance)
+    if (recommended is None):
+        logger.warning("No max_connections value with an error rate under "
+                       + str(max_error_rate))
+    else:
+        logger.info("Recommended max_connections: "
+                    + str(recommended.max_connections) + " ("
+                    + str(round(recommended.throughput, 2))
+                    + " answers/s, p99 "
+                    + str(round_value(recommended.percentile(99))) + " s)")
+
+
+main.add_command(analyze_fetch_logs)
+
+
 if __name__ == "__main__":
     sys.exit(main())  # pragma: no cover
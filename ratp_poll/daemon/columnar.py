@@ -0,0 +1,308 @@
+"""Append-only columnar output format for the parsed stop times.
+
+Every tick is written as a self-contained row group:
+
+    MAGIC | header length (uint32, big endian) | header (JSON) | columns
+
+The header describes the number of rows and, for every column, its name,
+type, compressed size and, for the dictionary encoded ones, the dictionary.
+Columns are zlib compressed arrays: `int64` timestamps, `int16` remaining
+minutes, and `dict` indices (`uint32`) into the dictionary of the repeated
+strings.
+"""
+from array import array
+import datetime
+from filelock import FileLock
+import glob
+import json
+import logging
+import os
+from ratp_poll.ratp_api import parser
+import re
+import struct
+import sys
+import time
+import zlib
+
+logger = logging.getLogger()
+
+MAGIC = b'RPCOL1\n'
+EXTENSION = '.rpcol'
+
+# Columns in order with their type
+COLUMNS = [
+    ('actual_date', 'int64'),
+    ('transport_type', 'dict'),
+    ('line_code', 'dict'),
+    ('station_name', 'dict'),
+    ('way', 'dict'),
+    ('remaining_minutes', 'int16'),
+    ('message', 'dict'),
+    ('destination', 'dict'),
+]
+
+ARRAY_TYPECODES = {'int64': 'q', 'int16': 'h', 'dict': 'I'}
+# Largest remaining minutes value of the int16 column
+MAX_REMAINING_MINUTES = 2 ** 15 - 1
+
+
+def remaining_minutes(message):
+    """Get the remaining minutes of a schedule message.
+
+    Arguments:
+        message (str): The message, without its ` mn` suffix.
+
+    Returns:
+        int: The minutes, capped to MAX_REMAINING_MINUTES, or -1 if the
+            message is not a number (e.g. `A l'approche`).
+    """
+    if (not isinstance(message, str) or not message.isdigit()):
+        return -1
+    return min(int(message), MAX_REMAINING_MINUTES)
+
+
+class DictionaryColumn:
+    """Dictionary encoded column of strings."""
+
+    def __init__(self):
+        self.dictionary = []
+        self.codes = array('I')
+        self._index = {}
+
+    def append(self, value):
+        """Append a value, adding it to the dictionary if new."""
+        code = self._index.get(value)
+        if (code is None):
+            code = len(self.dictionary)
+            self._index[value] = code
+            self.dictionary.append(value)
+        self.codes.append(code)
+
+
+class RowGroupBuilder:
+    """Accumulate the stop times of a tick as typed columns.
+
+    Arguments:
+        level (int): zlib compression level.
+    """
+
+    def __init__(self, level=6):
+        self.level = level
+        self.actual_date = array('q')
+        self.remaining_minutes = array('h')
+        self.dict_columns = {name: DictionaryColumn()
+                             for name, column_type in COLUMNS
+                             if column_type == 'dict'}
+        self._last_date = None
+        self._last_timestamp = None
+
+    def __len__(self):
+        return len(self.actual_date)
+
+    def timestamp(self, date):
+        """Convert an API date (ISO 8601) to epoch seconds."""
+        if (date != self._last_date):
+            self._last_date = date
+            self._last_timestamp = int(
+                    datetime.datetime.fromisoformat(date).timestamp())
+        return self._last_timestamp
+
+    def add_response(self, query, body):
+        """Add the stop times of an API answer.
+
+        Arguments:
+            query (tuple): Tuple with the query details (transport_type,
+                line_code, station_name, way).
+            body (bytes): API answer in JSON format.
+        """
+        for date, call, message, destination in parser.parse_response(body):
+            try:
+                timestamp = self.timestamp(date)
+            except (TypeError, ValueError):
+                logger.warning("Invalid date: " + str(date))
+                continue
+            self.actual_date.append(timestamp)
+            self.remaining_minutes.append(remaining_minutes(message))
+            for name, value in zip(('transport_type', 'line_code',
+                                    'station_name', 'way'), query):
+                self.dict_columns[name].append(value)
+            self.dict_columns['message'].append(message)
+            self.dict_columns['destination'].append(destination)
+
+    def encode(self):
+        """Encode the accumulated rows as a row group.
+
+        Returns:
+            bytes: The row group.
+        """
+        header = {'rows': len(self), 'codec': 'zlib', 'columns': []}
+        blobs = []
+        for name, column_type in COLUMNS:
+            column = {'name': name, 'type': column_type}
+            if (column_type == 'dict'):
+                values = self.dict_columns[name].codes
+                column['dictionary'] = self.dict_columns[name].dictionary
+            else:
+                values = getattr(self, name)
+            if (sys.byteorder != 'little'):
+                values = array(values.typecode, values)
+                values.byteswap()
+            blob = zlib.compress(values.tobytes(), self.level)
+            column['size'] = len(blob)
+            header['columns'].append(column)
+            blobs.append(blob)
+        header_bytes = json.dumps(header, separators=(',', ':')).encode()
+        return b''.join([MAGIC, struct.pack('>I', len(header_bytes)),
+                         header_bytes] + blobs)
+
+
+def segment_path(output_file, output_conf, now=None):
+    """Get the file where to append the next row group, rotating it by time
+    (`rotate_interval` seconds) and size (`rotate_size` bytes).
+
+    Time rotation names the files after the start of their interval, so
+    every process appends to the same one. Must be called holding the output
+    lock.
+
+    Arguments:
+        output_file (str): Base path of the output files.
+        output_conf (dict): Output configuration parameters.
+        now (float): Current epoch time (optional).
+
+    Returns:
+        str: Path of the file.
+    """
+    rotate_interval = output_conf.get('rotate_interval')
+    rotate_size = output_conf.get('rotate_size')
+    base = output_file
+    if (rotate_interval):
+        now = time.time() if now is None else now
+        start = int(now // rotate_interval * rotate_interval)
+        base += '.' + time.strftime('%Y%m%dT%H%M%S', time.localtime(start))
+    if (not rotate_size):
+        return base + EXTENSION
+
+    # Only `<base>.<index><EXTENSION>`, not e.g. the time rotated files
+    # sharing the base
+    pattern = re.compile(re.escape(os.path.basename(base)) + r'\.(\d+)'
+                         + re.escape(EXTENSION) + '$')
+    segments = []
+    for path in glob.glob(glob.escape(base) + '.*' + EXTENSION):
+        match = pattern.match(os.path.basename(path))
+        if (match):
+            segments.append((int(match.group(1)), path))
+    index = 0
+    if (segments):
+        index, last = max(segments)
+        if (os.path.getsize(last) >= rotate_size):
+            index += 1
+    return '{}.{:06d}{}'.format(base, index, EXTENSION)
+
+
+def write_row_group(output_file, output_conf, row_group):
+    """Append an encoded row group preventing collisions with a lock.
+
+    Arguments:
+        output_file (str): Base path of the output files.
+        output_conf (dict): Output configuration parameters.
+        row_group (bytes): The encoded row group.
+    """
+    with FileLock(output_file + '.lock', timeout=60):
+        path = segment_path(output_file, output_conf)
+        with open(path, 'ab') as f:
+            f.write(row_group)
+
+
+class ColumnarOutput:
+    """Columnar output. The stop times of a tick are accumulated as columns and
+    appended as a row group when committed.
+
+    Arguments:
+        output_file (str): Base path of the output files.
+        output_conf (dict): Output configuration parameters.
+    """
+
+    def __init__(self, output_file, output_conf=None):
+        self.output_file = output_file
+        self.output_conf = output_conf or {}
+        self.row_group = RowGroupBuilder()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, query_response):
+        """Add the stop times of an API answer.
+
+        Arguments:
+            query_response (tuple): The query and its response body.
+        """
+        self.row_group.add_response(*query_response)
+
+    def commit(self):
+        """Append the row group to the output."""
+        if (len(self.row_group) < 1):
+            logger.warning("Empty iteration output")
+            return
+        write_row_group(self.output_file, self.output_conf,
+                        self.row_group.encode())
+
+    def close(self):
+        """Discard the accumulated rows."""
+        self.row_group = RowGroupBuilder()
+
+
+def read_row_groups(path):
+    """Read the row groups of a columnar file.
+
+    A truncated row group at the end of the file (e.g. an interrupted write)
+    is skipped with a warning.
+
+    Arguments:
+        path (str): Path of the file.
+
+    Yields:
+        dict: Column values by name, with the dictionaries already decoded.
+    """
+    with open(path, 'rb') as f:
+        while True:
+            magic = f.read(len(MAGIC))
+            if (not magic):
+                return
+            try:
+                if (magic != MAGIC):
+                    raise ValueError("bad magic")
+                header_length, = struct.unpack('>I', f.read(4))
+                header = json.loads(f.read(header_length).decode())
+                columns = {}
+                for column in header['columns']:
+                    values = array(ARRAY_TYPECODES[column['type']])
+                    values.frombytes(zlib.decompress(f.read(column['size'])))
+                    if (sys.byteorder != 'little'):
+                        values.byteswap()
+                    if (column['type'] == 'dict'):
+                        dictionary = column['dictionary']
+                        values = [dictionary[code] for code in values]
+                    columns[column['name']] = values
+            except (ValueError, struct.error, zlib.error, KeyError) as e:
+                logger.warning("Corrupt row group in " + path + ": "
+                               + str(e))
+                return
+            yield columns
+
+
+def read_rows(path):
+    """Read the rows of a columnar file.
+
+    Arguments:
+        path (str): Path of the file.
+
+    Yields:
+        tuple: Row values in the order of COLUMNS.
+    """
+    names = [name for name, column_type in COLUMNS]
+    for columns in read_row_groups(path):
+        for row in zip(*[columns[name] for name in names]):
+            yield row
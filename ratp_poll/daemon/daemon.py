@@ -1,11 +1,15 @@
+import asyncio
 from datetime import datetime
-from filelock import FileLock
 import itertools
 import logging
 from multiprocessing import Pool
-import pathlib
+from ratp_poll.daemon import output
 import random
+from ratp_poll.ratp_api import metrics as fetch_metrics
+from ratp_poll.ratp_api import profiling
+from ratp_poll.ratp_api import stop_times
 import sys
+import threading
 import time
 from typing import Dict, List
 
@@ -14,10 +18,17 @@ logger = logging.getLogger()
 
 def start_daemon(func, func_args, output_file, interval: int = 60,
                  processes: int = 5, max_conn_test: List[int] = None,
-                 fetch_conf: Dict = {}):
+                 fetch_conf: Dict = {}, output_conf: Dict = None,
+                 max_pending: int = None, overrun: str = 'skip'):
     """Start a daemon that infinitely spawns a given function asynchronously
     every interval and writes the output to a file.
 
+    At most `max_pending` ticks are running or waiting for a worker process.
+    When a tick is due and there are already that many, the `overrun` policy
+    applies: `skip` drops the tick, `coalesce` drops it too but runs a single
+    catch-up tick as soon as a worker frees before the next one is due, and
+    `delay` waits for a worker before spawning it, shifting the schedule.
+
     Arguments:
         func (callable): Function to execute.
         func_args (list): Arguments to pass to the executed function.
@@ -27,10 +38,159 @@ def start_daemon(func, func_args, output_file, interval: int = 60,
             processes.
         max_conn_test (list): Test different maximum (simultaneous) connections
             in random order. Pass 4 integer values: start, stop, step and
-            repetition (e.g. `list(5, 101, 5, 1)`).
+            repetition (e.g. `list(5, 101, 5, 1)`). The ticks are then always
+            delayed, so every value is tested.
         fetch_conf (dict): Configuration parameters for fetching the content.
+        output_conf (dict): Output configuration parameters.
+        max_pending (int): Maximum pending ticks (`processes` if not set).
+        overrun (str): Overrun policy: `skip`, `coalesce` or `delay`.
     """
     pool = Pool(processes=processes)
+    max_conn_values = max_conn_test_values(max_conn_test)
+    if (max_conn_test):
+        overrun = 'delay'
+    pending = PendingTicks(max_pending or processes)
+    catch_up = False
+    next_tick = time.monotonic()
+    tick_conf = fetch_conf
+
+    def spawn():
+        logger.info("Spawned process at " + str(datetime.now()))
+        # A copy, as the arguments are pickled later by the pool
+        pending.submit(pool, exec_and_write,
+                       (func, func_args, output_file,
+                        dict(tick_fetch_conf(tick_conf, interval)),
+                        output_conf))
+
+    while True:
+        if (max_conn_test):
+            if (len(max_conn_values) > 0):
+                tick_conf = dict(fetch_conf,
+                                 max_connections=max_conn_values.pop(0))
+        if (not pending.full()):
+            spawn()
+        elif (overrun == 'delay'):
+            logger.warning("Delaying tick: " + str(len(pending))
+                           + " pending ticks")
+            pending.wait_slot()
+            spawn()
+        else:
+            logger.warning("Skipping tick: " + str(len(pending))
+                           + " pending ticks")
+            catch_up = (overrun == 'coalesce')
+        if (max_conn_test):
+            if (len(max_conn_values) < 1):
+                pending.join()
+                logger.info("Finished max_conn_test")
+                pool.close()
+                pool.join()
+                sys.exit(0)
+
+        next_tick = max(next_tick + interval, time.monotonic())
+        time_left = next_tick - time.monotonic()
+        if (catch_up and pending.wait_slot(time_left)):
+            logger.info("Running coalesced tick")
+            spawn()
+            catch_up = False
+        time.sleep(max(0, next_tick - time.monotonic()))
+
+
+class PendingTicks:
+    """Ticks submitted to the worker pool that have not finished yet.
+
+    Arguments:
+        max_pending (int): Maximum pending ticks.
+    """
+
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self._results = []
+        self._finished = threading.Event()
+
+    def __len__(self):
+        self._results = [result for result in self._results
+                         if not result.ready()]
+        return len(self._results)
+
+    def _done(self, _):
+        self._finished.set()
+
+    def full(self):
+        """Check if the maximum pending ticks are reached."""
+        return len(self) >= self.max_pending
+
+    def submit(self, pool, func, args):
+        """Submit a tick to the pool.
+
+        Arguments:
+            pool (Pool): The worker pool.
+            func (callable): Function to execute.
+            args (tuple): Arguments of the function.
+        """
+        self._results.append(pool.apply_async(func, args,
+                                              callback=self._done,
+                                              error_callback=self._done))
+
+    def wait_slot(self, timeout=None):
+        """Wait until a tick can be submitted.
+
+        Arguments:
+            timeout (float): Maximum seconds to wait (forever if not set).
+
+        Returns:
+            bool: Whether a tick can be submitted.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self._finished.clear()
+            if (not self.full()):
+                return True
+            time_left = None
+            if (deadline is not None):
+                time_left = deadline - time.monotonic()
+                if (time_left <= 0):
+                    return False
+            self._finished.wait(time_left)
+
+    def join(self):
+        """Wait for every pending tick."""
+        for result in self._results:
+            result.wait()
+
+
+def tick_fetch_conf(fetch_conf, interval):
+    """Get the fetch configuration of a tick, with a deadline so its
+    requests and retries do not overrun the next tick.
+
+    The deadline is `budget` (in fetch_conf) seconds from now if set, capped
+    to the interval if it is positive.
+
+    Arguments:
+        fetch_conf (dict): Configuration parameters for fetching the content.
+        interval (int): Number of seconds between ticks.
+
+    Returns:
+        dict: A copy of fetch_conf with the deadline.
+    """
+    budget = fetch_conf.get('budget')
+    if (interval > 0):
+        budget = min(budget, interval) if budget else interval
+    if (not budget):
+        return fetch_conf
+    return dict(fetch_conf, deadline=time.monotonic() + budget)
+
+
+def max_conn_test_values(max_conn_test: List[int] = None):
+    """Generate the maximum connections values to test.
+
+    Arguments:
+        max_conn_test (list): 4 integer values: start, stop, step and
+            repetition (e.g. `list(5, 101, 5, 1)`).
+
+    Returns:
+        list: The values to test in random order, or None if max_conn_test
+            is not set.
+    """
     max_conn_values = None
     if (max_conn_test):
         if (len(max_conn_test) == 4):
@@ -47,41 +207,317 @@ def start_daemon(func, func_args, output_file, interval: int = 60,
             logger.debug(max_conn_values)
         else:
             sys.exit(1)
-    while True:
-        if (max_conn_test):
-            if (len(max_conn_values) > 0):
-                fetch_conf['max_connections'] = max_conn_values.pop(0)
-        logger.info("Spawned process at " + str(datetime.now()))
-        pool.apply_async(exec_and_write, (func, func_args, output_file,
-                                          fetch_conf))
-        if (max_conn_test):
-            if (len(max_conn_values) < 1):
-                while pool._cache:
-                    time.sleep(1)
-                logger.info("Finished max_conn_test")
-                pool.close()
-                pool.join()
-                sys.exit(0)
-        time.sleep(interval)
+    return max_conn_values
 
 
-def exec_and_write(func, func_args, output_file, fetch_conf):
+def start_persistent_daemon(func, func_args, output_file,
+                            interval: int = 60, max_ticks: int = 5,
+                            max_conn_test: List[int] = None,
+                            fetch_conf: Dict = {}, output_conf: Dict = None):
+    """Start a daemon that runs a given coroutine function every interval in a
+    single long-lived event loop and writes the output to a file.
+
+    Unlike start_daemon, no process is spawned per tick: every tick reuses the
+    same aiohttp session, so the connections to the API are kept alive between
+    ticks.
+
+    Arguments:
+        func (callable): Coroutine function to execute. It is called with
+            `func_args`, `fetch_conf` and the shared session.
+        func_args (list): Arguments to pass to the executed function.
+        output_file (str): Path to the file were to append the results.
+        interval (int): Number of seconds between ticks.
+        max_ticks (int): Maximum number of simultaneously running ticks.
+        max_conn_test (list): Test different maximum (simultaneous) connections
+            in random order. Pass 4 integer values: start, stop, step and
+            repetition (e.g. `list(5, 101, 5, 1)`).
+        fetch_conf (dict): Configuration parameters for fetching the content.
+        output_conf (dict): Output configuration parameters.
+    """
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run_persistent_daemon(
+        func, func_args, output_file, interval, max_ticks,
+        max_conn_test_values(max_conn_test), fetch_conf, output_conf))
+    if (max_conn_test):
+        logger.info("Finished max_conn_test")
+
+
+async def run_persistent_daemon(func, func_args, output_file, interval,
+                                max_ticks, max_conn_values, fetch_conf,
+                                output_conf=None):
+    """Coroutine scheduling the ticks of start_persistent_daemon.
+
+    Ticks are scheduled at fixed times from the start of the daemon, so the
+    period does not drift with the duration of the ticks. A tick that can not
+    start because `max_ticks` ticks are still running is delayed, and the
+    missed periods are skipped.
+
+    If `metrics_port` is set in output_conf, the metrics are served in the
+    Prometheus text format on `http://{metrics_host}:{metrics_port}/metrics`.
+
+    Arguments:
+        func (callable): Coroutine function to execute.
+        func_args (list): Arguments to pass to the executed function.
+        output_file (str): Path to the file were to append the results.
+        interval (int): Number of seconds between ticks.
+        max_ticks (int): Maximum number of simultaneously running ticks.
+        max_conn_values (list): Maximum connections values to test in order,
+            or None to run forever.
+        fetch_conf (dict): Configuration parameters for fetching the content.
+        output_conf (dict): Output configuration parameters.
+    """
+    loop = asyncio.get_event_loop()
+    running_ticks = asyncio.Semaphore(max_ticks)
+    tasks = set()
+    # One session per max_connections value, as the limit belongs to the
+    # connector. Without max_conn_test there is only one.
+    sessions = {}
+    metrics_runner = await start_metrics_server(output_conf)
+    next_tick = loop.time()
+    try:
+        while (max_conn_values is None or len(max_conn_values) > 0):
+            tick_conf = fetch_conf
+            if (max_conn_values is not None):
+                tick_conf = dict(fetch_conf,
+                                 max_connections=max_conn_values.pop(0))
+            tick_conf = tick_fetch_conf(tick_conf, interval)
+            max_connections = tick_conf['max_connections']
+            if (max_connections not in sessions):
+                sessions[max_connections] = stop_times.create_session(
+                                                tick_conf)
+
+            await running_ticks.acquire()
+            logger.info("Started tick at " + str(datetime.now()))
+            task = asyncio.ensure_future(exec_and_write_async(
+                    func, func_args, output_file, tick_conf,
+                    sessions[max_connections], output_conf))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda _: running_ticks.release())
+
+            next_tick += interval
+            now = loop.time()
+            if (interval > 0 and next_tick < now):
+                missed = int((now - next_tick) // interval) + 1
+                logger.warning("Skipping " + str(missed) + " delayed ticks")
+                next_tick += missed * interval
+            await asyncio.sleep(next_tick - now)
+        if (tasks):
+            await asyncio.wait(tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        for session in sessions.values():
+            await session.close()
+        if (metrics_runner is not None):
+            await metrics_runner.cleanup()
+
+
+def start_scheduled_daemon(func, scheduler, output_file, max_ticks: int = 5,
+                           fetch_conf: Dict = {}, output_conf: Dict = None):
+    """Start a daemon that polls every query when it is due according to a
+    PollScheduler, in a single long-lived event loop, and writes the output
+    to a file.
+
+    Arguments:
+        func (callable): Coroutine function to execute with the due queries
+            (e.g. scheduler.iter_scheduled bound to the scheduler).
+        scheduler (PollScheduler): The scheduler of the queries.
+        output_file (str): Path to the file were to append the results.
+        max_ticks (int): Maximum number of simultaneously running ticks.
+        fetch_conf (dict): Configuration parameters for fetching the content.
+        output_conf (dict): Output configuration parameters.
+    """
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run_scheduled_daemon(
+        func, scheduler, output_file, max_ticks, fetch_conf, output_conf))
+
+
+async def run_scheduled_daemon(func, scheduler, output_file, max_ticks,
+                               fetch_conf, output_conf=None, ticks=None):
+    """Coroutine running the ticks of start_scheduled_daemon. Every tick
+    fetches the queries due at its start.
+
+    Arguments:
+        func (callable): Coroutine function to execute with the due queries.
+        scheduler (PollScheduler): The scheduler of the queries.
+        output_file (str): Path to the file were to append the results.
+        max_ticks (int): Maximum number of simultaneously running ticks.
+        fetch_conf (dict): Configuration parameters for fetching the content.
+        output_conf (dict): Output configuration parameters.
+        ticks (int): Number of ticks to run, or None to run forever.
+    """
+    running_ticks = asyncio.Semaphore(max_ticks)
+    tasks = set()
+    session = stop_times.create_session(fetch_conf)
+    metrics_runner = await start_metrics_server(output_conf)
+    try:
+        while (ticks is None or ticks > 0):
+            next_due = scheduler.next_due()
+            if (next_due is None):
+                break
+            await asyncio.sleep(max(0, next_due - time.monotonic()))
+            await running_ticks.acquire()
+            due_queries = scheduler.pop_due()
+            logger.info("Started tick at " + str(datetime.now()) + " with "
+                        + str(len(due_queries)) + " due queries")
+            task = asyncio.ensure_future(exec_and_write_async(
+                    func, due_queries, output_file,
+                    tick_fetch_conf(fetch_conf, 0), session, output_conf))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda _: running_ticks.release())
+            if (ticks is not None):
+                ticks -= 1
+        if (tasks):
+            await asyncio.wait(tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await session.close()
+        if (metrics_runner is not None):
+            await metrics_runner.cleanup()
+
+
+async def start_metrics_server(output_conf=None):
+    """Serve the metrics of the process if `metrics_port` is set in
+    output_conf.
+
+    Arguments:
+        output_conf (dict): Output configuration parameters.
+
+    Returns:
+        AppRunner: The runner of the server to clean up, or None.
+    """
+    output_conf = output_conf or {}
+    if (not output_conf.get('metrics_port')):
+        return None
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=fetch_metrics.get_registry().exposition(),
+                            content_type='text/plain')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    host = output_conf.get('metrics_host', '127.0.0.1')
+    await web.TCPSite(runner, host, output_conf['metrics_port']).start()
+    logger.info("Serving metrics on http://" + host + ":"
+                + str(output_conf['metrics_port']) + "/metrics")
+    return runner
+
+
+def record_tick(fetch_conf, output_conf, total_time, outcome):
+    """Record a finished tick in the metrics and dump them to
+    `metrics_file` (in output_conf) if set.
+
+    Arguments:
+        fetch_conf (dict): Configuration parameters for fetching the content.
+        output_conf (dict): Output configuration parameters.
+        total_time (float): Duration of the tick in seconds.
+        outcome (str): `ok` or `failed`.
+    """
+    registry = fetch_metrics.get_metrics(fetch_conf)
+    if (registry is None):
+        return
+    registry.ticks.inc((outcome,))
+    registry.tick_duration.observe((), total_time)
+    metrics_file = (output_conf or {}).get('metrics_file')
+    if (metrics_file):
+        registry.write(metrics_file)
+
+
+def record_lock_wait(fetch_conf, tick_output):
+    """Record the time the commit of a tick output waited for the output
+    lock in the profile of the tick, if profiled.
+
+    Keyword arguments:
+    fetch_conf -- dictionary with configuration parameters for fetching the \
+                  content
+    tick_output -- committed output
+    """
+    profile = fetch_conf.get('tick_profile')
+    lock_wait = getattr(tick_output, 'lock_wait', None)
+    if (profile is not None and lock_wait is not None):
+        profile.add('output_lock_wait', lock_wait)
+
+
+async def exec_and_write_async(func, func_args, output_file, fetch_conf,
+                               session, output_conf=None):
+    """Coroutine version of exec_and_write that reuses a session.
+
+    The output is committed in a thread so the event loop is not blocked by
+    the lock. If the profiling is enabled (`profile` in fetch_conf), the
+    tick is profiled as in exec_and_write.
+
+    Keyword arguments:
+    func -- async generator function to execute
+    func_args -- list of arguments to pass to the executed function
+    output_file -- path to the file were to append the results
+    fetch_conf -- dictionary with configuration parameters for fetching the \
+                  content
+    session -- aiohttp ClientSession to reuse
+    output_conf -- dictionary with output configuration parameters
+    """
+    loop = asyncio.get_event_loop()
+    dt_1 = datetime.now()
+    outcome = 'failed'
+    fetch_conf, profile = profiling.start_profile(fetch_conf)
+    try:
+        with profiling.tick_profiler(fetch_conf), \
+                output.open_output(output_file, output_conf) as tick_output:
+            async for item in func(func_args, fetch_conf, session):
+                with profiling.span(fetch_conf, 'output_add'):
+                    tick_output.add(item)
+            total_time = (datetime.now() - dt_1).total_seconds()
+            logger.info("Total iteration time: " + str(total_time) + "s")
+            with profiling.span(fetch_conf, 'output_commit'):
+                await loop.run_in_executor(None, tick_output.commit)
+            record_lock_wait(fetch_conf, tick_output)
+        logger.info("Finished tick at " + str(datetime.now()))
+        outcome = 'ok'
+    except Exception:
+        logger.exception("Tick failed")
+    finally:
+        total_time = (datetime.now() - dt_1).total_seconds()
+        record_tick(fetch_conf, output_conf, total_time, outcome)
+        profiling.log_report(profile)
+
+
+def exec_and_write(func, func_args, output_file, fetch_conf,
+                   output_conf=None):
     """Execute a given function with the given args and write the output to the
     given file preventing collisions with a lock.
 
+    The output is streamed to the tick output while the function runs (e.g. a
+    temporary spool file), so the lock is only held while committing it.
+
+    If the profiling is enabled (`profile` in fetch_conf), the tick is timed
+    by phase with a profiling.TickProfile, including the output and its lock
+    wait, and its report is logged. With `profile_dir` set too, the tick runs
+    under cProfile (see profiling.tick_profiler).
+
     Keyword arguments:
-    func -- callable function to execute
+    func -- generator function to execute
     func_args -- list of arguments to pass to the executed function
     output_file -- path to the file were to append the results
     fetch_conf -- dictionary with configuration parameters for fetching the \
                   content
+    output_conf -- dictionary with output configuration parameters
     """
-    result, time = func(func_args, fetch_conf)
-    logger.info("Total iteration time: " + str(time) + "s")
-    with FileLock(output_file + '.lock', timeout=60):
-        path_exists = pathlib.Path(output_file).exists()
-        with open(output_file, 'a+') as f:
-            if (path_exists):
-                f.write('\n')
-            f.write('\n'.join(result))
+    dt_1 = datetime.now()
+    fetch_conf, profile = profiling.start_profile(fetch_conf)
+    with profiling.tick_profiler(fetch_conf), \
+            output.open_output(output_file, output_conf) as tick_output:
+        for item in func(func_args, fetch_conf):
+            with profiling.span(fetch_conf, 'output_add'):
+                tick_output.add(item)
+        total_time = (datetime.now() - dt_1).total_seconds()
+        logger.info("Total iteration time: " + str(total_time) + "s")
+        with profiling.span(fetch_conf, 'output_commit'):
+            tick_output.commit()
+        record_lock_wait(fetch_conf, tick_output)
+    profiling.log_report(profile)
     logger.info("Finished process at " + str(datetime.now()))
@@ -0,0 +1,322 @@
+"""Outputs where the daemon writes the result of every tick."""
+from filelock import FileLock, Timeout
+import itertools
+import logging
+import os
+import pathlib
+from ratp_poll.daemon import columnar
+import shutil
+import struct
+import tempfile
+import time
+
+logger = logging.getLogger()
+
+SEGMENTS_SUFFIX = '.segments'
+# Extensions of the segments of text lines and framed raw records
+SEGMENT_EXTENSION = '.seg'
+RAW_SEGMENT_EXTENSION = '.raw'
+
+
+class SpoolOutput:
+    """Text output. The lines of a tick are streamed to a temporary spool file
+    and appended to the output file at once when committed, so the lock is
+    only held while appending them. If the lock can not be taken, the lines
+    are written to a segment instead (see SegmentOutput).
+
+    Arguments:
+        output_file (str): Path to the file were to append the results.
+        output_conf (dict): Output configuration parameters.
+    """
+
+    # Mode of the spool and the output file, text or binary ('b')
+    binary = ''
+    # Seconds the last commit waited for the lock
+    lock_wait = None
+    segment_extension = SEGMENT_EXTENSION
+
+    def __init__(self, output_file, output_conf=None):
+        self.output_file = output_file
+        self.output_conf = output_conf or {}
+        self.lines = 0
+        self._spool = tempfile.TemporaryFile('w+' + self.binary)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, line):
+        """Add a line, separating it from the previous ones.
+
+        Arguments:
+            line (str): Line to write.
+        """
+        if (self.lines > 0):
+            self._spool.write('\n')
+        self._spool.write(line)
+        self.lines += 1
+
+    def commit(self):
+        """Append the spooled lines to the output file preventing collisions
+        with a lock.
+        """
+        if (self.lines < 1):
+            logger.warning("Empty iteration output")
+            return
+        self._spool.seek(0)
+        started = time.perf_counter()
+        try:
+            with FileLock(self.output_file + '.lock', timeout=60):
+                self.lock_wait = time.perf_counter() - started
+                path_exists = pathlib.Path(self.output_file).exists()
+                with open(self.output_file, 'a+' + self.binary) as f:
+                    if (path_exists):
+                        self.separate(f)
+                    shutil.copyfileobj(self._spool, f)
+        except Timeout:
+            logger.warning("Timeout locking the output file, writing the "
+                           "tick to a segment")
+            self._spool.seek(0)
+            with tempfile.NamedTemporaryFile(
+                    'w' + self.binary,
+                    dir=make_segments_dir(self.output_file), prefix='.tmp-',
+                    delete=False) as f:
+                shutil.copyfileobj(self._spool, f)
+            publish_segment(f.name, self.output_file, self.segment_extension)
+
+    def separate(self, f):
+        """Separate the tick from the previous content of the output file.
+
+        Arguments:
+            f (file): The output file, open for appending.
+        """
+        f.write('\n')
+
+    def close(self):
+        """Discard the spool."""
+        self._spool.close()
+
+
+# Framings of the raw output records
+FRAMINGS = ('newline', 'length')
+# Record length prefix of the length framing
+LENGTH_PREFIX = struct.Struct('>I')
+
+
+class RawOutput(SpoolOutput):
+    """Binary output of the API answer bodies, written as received without
+    decoding them. Every body is a record framed by a trailing newline (the
+    answers of the API are single line JSON) or a 4 bytes big-endian length
+    prefix (`framing` in output_conf).
+
+    Arguments:
+        output_file (str): Path to the file were to append the results.
+        output_conf (dict): Output configuration parameters.
+    """
+
+    binary = 'b'
+    segment_extension = RAW_SEGMENT_EXTENSION
+
+    def __init__(self, output_file, output_conf=None):
+        super().__init__(output_file, output_conf)
+        self.framing = self.output_conf.get('framing') or 'newline'
+
+    def add(self, body):
+        """Add a record.
+
+        Arguments:
+            body (bytes): API answer body.
+        """
+        if (self.framing == 'length'):
+            self._spool.writelines((LENGTH_PREFIX.pack(len(body)), body))
+        else:
+            self._spool.writelines((body, b'\n'))
+        self.lines += 1
+
+    def separate(self, f):
+        """Terminate the last line of a newline framed output file if needed,
+        the records are already framed.
+
+        Arguments:
+            f (file): The output file, open for appending.
+        """
+        if (self.framing == 'newline' and f.tell() > 0):
+            f.seek(-1, os.SEEK_END)
+            if (f.read(1) != b'\n'):
+                f.write(b'\n')
+
+
+def read_records(path):
+    """Read the records of a length framed raw output file.
+
+    Arguments:
+        path (str): Path to the file.
+
+    Yields:
+        bytes: The API answer bodies. A truncated last record is skipped.
+    """
+    with open(path, 'rb') as f:
+        while True:
+            prefix = f.read(LENGTH_PREFIX.size)
+            if (len(prefix) < LENGTH_PREFIX.size):
+                return
+            length, = LENGTH_PREFIX.unpack(prefix)
+            body = f.read(length)
+            if (len(body) < length):
+                logger.warning("Truncated record in %s", path)
+                return
+            yield body
+
+
+# Segments written by the current process
+_segment_counter = itertools.count()
+
+
+def segments_dir(output_file):
+    """Get the directory of the segments of an output file."""
+    return output_file + SEGMENTS_SUFFIX
+
+
+def make_segments_dir(output_file):
+    """Create the directory of the segments of an output file if needed.
+
+    Returns:
+        str: The path of the directory.
+    """
+    directory = segments_dir(output_file)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def publish_segment(path, output_file, extension=SEGMENT_EXTENSION):
+    """Rename a written file of the segments directory to a segment. The name
+    starts with the current time, so the segments sort chronologically.
+
+    Arguments:
+        path (str): Path of the written file.
+        output_file (str): Path to the output file.
+        extension (str): SEGMENT_EXTENSION for text lines or
+            RAW_SEGMENT_EXTENSION for framed raw records.
+    """
+    name = '{:020d}-{}-{}{}'.format(time.time_ns(), os.getpid(),
+                                    next(_segment_counter), extension)
+    os.rename(path, os.path.join(segments_dir(output_file), name))
+
+
+class SegmentOutput(SpoolOutput):
+    """Text output without locks. The lines of a tick are streamed to a
+    temporary file in the segments directory, renamed to a segment when
+    committed. The segments are named after their commit time, so they sort
+    chronologically, and appended to the output file by compact_segments.
+
+    Arguments:
+        output_file (str): Path to the file were to append the results.
+        output_conf (dict): Output configuration parameters.
+    """
+
+    def __init__(self, output_file, output_conf=None):
+        self.output_file = output_file
+        self.output_conf = output_conf or {}
+        self.lines = 0
+        self._spool = tempfile.NamedTemporaryFile(
+                'w+', dir=make_segments_dir(output_file), prefix='.tmp-',
+                delete=False)
+
+    def commit(self):
+        """Publish the spooled lines as a segment with an atomic rename."""
+        if (self.lines < 1):
+            logger.warning("Empty iteration output")
+            return
+        self._spool.flush()
+        publish_segment(self._spool.name, self.output_file)
+
+    def close(self):
+        """Discard the spool if not committed."""
+        self._spool.close()
+        if (os.path.exists(self._spool.name)):
+            os.remove(self._spool.name)
+
+
+def list_segments(output_file):
+    """Get the committed segments of an output file in chronological order.
+
+    Arguments:
+        output_file (str): Path to the output file.
+
+    Returns:
+        list: Paths of the segments.
+    """
+    directory = segments_dir(output_file)
+    if (not os.path.isdir(directory)):
+        return []
+    return [os.path.join(directory, name)
+            for name in sorted(os.listdir(directory))
+            if name.endswith((SEGMENT_EXTENSION, RAW_SEGMENT_EXTENSION))]
+
+
+def compact_segments(output_file):
+    """Append the committed segments to the output file, in chronological
+    order, and remove them.
+
+    Only the compaction takes the lock of the output file, and lists the
+    segments once it holds it, so overlapping compactions do not append the
+    same segments. A segment is removed right after being appended, so an
+    interrupted compaction can only duplicate the last segment.
+
+    Arguments:
+        output_file (str): Path to the output file.
+
+    Returns:
+        int: Number of compacted segments.
+    """
+    if (not list_segments(output_file)):
+        return 0
+    compacted = 0
+    with FileLock(output_file + '.lock', timeout=60):
+        with open(output_file, 'ab') as f:
+            path_exists = f.tell() > 0
+            for segment in list_segments(output_file):
+                try:
+                    segment_file = open(segment, 'rb')
+                except FileNotFoundError:
+                    # Compacted by another process
+                    continue
+                with segment_file:
+                    # The raw records are already framed
+                    if (path_exists and segment.endswith(SEGMENT_EXTENSION)):
+                        f.write(b'\n')
+                    shutil.copyfileobj(segment_file, f)
+                f.flush()
+                try:
+                    os.remove(segment)
+                except FileNotFoundError:
+                    pass
+                path_exists = True
+                compacted += 1
+    return compacted
+
+
+def open_output(output_file, output_conf=None):
+    """Open the output of a tick according to its format.
+
+    Arguments:
+        output_file (str): Path to the file were to append the results.
+        output_conf (dict): Output configuration parameters. `format` is
+            `text` (default), `segments` (text written without locks to
+            segments), `raw` (framed answer bodies, see RawOutput) or
+            `columnar`.
+
+    Returns:
+        object: Output with `add`, `commit` and `close` methods, usable as a
+            context manager.
+    """
+    output_conf = output_conf or {}
+    if (output_conf.get('format') == 'columnar'):
+        return columnar.ColumnarOutput(output_file, output_conf)
+    if (output_conf.get('format') == 'segments'):
+        return SegmentOutput(output_file, output_conf)
+    if (output_conf.get('format') == 'raw'):
+        return RawOutput(output_file, output_conf)
+    return SpoolOutput(output_file, output_conf)
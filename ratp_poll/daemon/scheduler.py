@@ -0,0 +1,215 @@
+"""Polling scheduler with an interval per query.
+
+The queries are kept in a priority queue ordered by the time they are due, so
+every tick only fetches the due ones. The interval of a query is, by order of
+preference, its own one (5th column of the stops file), the one of its
+transport type or the default one. With the adaptive intervals, a query is
+polled again shortly before its next vehicle is due according to the last
+answer, within `min_interval` and `max_interval`.
+"""
+import heapq
+import itertools
+import logging
+from ratp_poll.ratp_api import changes, parser, query_index, stop_times
+import time
+
+logger = logging.getLogger()
+
+# Minutes before the next vehicle when an adaptive poll is scheduled
+LEAD_MINUTES = 1
+
+
+def split_query_intervals(rows):
+    """Split the optional interval column of the rows of a stops file.
+
+    Arguments:
+        rows (list): Tuples (transport_type, line_code, station_name, way
+            [, interval]) or query_index.Query.
+
+    Returns:
+        list: Tuples with the query details (or the given Query).
+        dict: Interval in seconds by query, for the rows with one.
+    """
+    queries = []
+    intervals = {}
+    for row in rows:
+        if (isinstance(row, query_index.Query)):
+            query = row
+            if (row.interval is not None):
+                intervals[query] = row.interval
+        else:
+            query = tuple(row[:4])
+            if (len(row) > 4 and row[4].strip()):
+                intervals[query] = float(row[4])
+        queries.append(query)
+    return queries, intervals
+
+
+def remaining_minutes(rows):
+    """Get the minutes until the next vehicle of an API answer.
+
+    Arguments:
+        rows (list): Tuples as returned by parser.parse_response.
+
+    Returns:
+        int: The minutes (0 if a vehicle is approaching or at the stop), or
+            None if the answer has no stop times.
+    """
+    if (not rows):
+        return None
+    minutes = [int(row[2]) for row in rows if row[2].isdigit()]
+    return min(minutes) if minutes else 0
+
+
+class PollScheduler:
+    """Priority queue of the queries by due time.
+
+    Arguments:
+        queries (list): List of tuples with the query details (transport_type,
+            line_code, station_name, way).
+        interval (float): Default interval in seconds.
+        type_intervals (dict): Interval in seconds by transport type.
+        query_intervals (dict): Interval in seconds by query.
+        adaptive (bool): Derive the intervals from the remaining minutes.
+        min_interval (float): Minimum adaptive interval in seconds.
+        max_interval (float): Maximum adaptive interval in seconds.
+        window (float): Queries due within the given seconds are fetched in
+            the same tick.
+    """
+
+    def __init__(self, queries, interval=60, type_intervals=None,
+                 query_intervals=None, adaptive=False, min_interval=10,
+                 max_interval=600, window=1.0):
+        self.interval = interval
+        self.type_intervals = type_intervals or {}
+        self.query_intervals = query_intervals or {}
+        self.adaptive = adaptive
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.window = window
+        self._counter = itertools.count()
+        self._heap = []
+        # Current due time by query, older heap entries are stale
+        self._due = {}
+        now = time.monotonic()
+        for query in dict.fromkeys(queries):
+            self.schedule(query, now)
+
+    def __len__(self):
+        return len(self._due)
+
+    def base_interval(self, query):
+        """Get the configured interval of a query in seconds."""
+        interval = self.query_intervals.get(query)
+        if (interval is None):
+            interval = self.type_intervals.get(query[0], self.interval)
+        return interval
+
+    def schedule(self, query, due):
+        """Set the time when a query is due.
+
+        Arguments:
+            query (tuple): Tuple with the query details.
+            due (float): time.monotonic() value.
+        """
+        self._due[query] = due
+        heapq.heappush(self._heap, (due, next(self._counter), query))
+
+    def next_due(self):
+        """Get the time when the next query is due.
+
+        Returns:
+            float: time.monotonic() value, or None without queries.
+        """
+        while (self._heap):
+            due, _, query = self._heap[0]
+            if (self._due.get(query) == due):
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now=None):
+        """Take the queries due now (or within the window), scheduling them
+        again after their base interval, in case they fail.
+
+        Arguments:
+            now (float): Current time.monotonic() (optional).
+
+        Returns:
+            list: Tuples with the due query details.
+        """
+        now = time.monotonic() if now is None else now
+        due_queries = []
+        while (self._heap and self._heap[0][0] <= now + self.window):
+            due, _, query = heapq.heappop(self._heap)
+            if (self._due.get(query) != due):
+                continue
+            due_queries.append(query)
+        for query in due_queries:
+            self.schedule(query, now + self.base_interval(query))
+        return due_queries
+
+    def answered(self, query, rows, now=None):
+        """Schedule the next poll of a query from its answer, if the adaptive
+        intervals are enabled.
+
+        Arguments:
+            query (tuple): Tuple with the query details.
+            rows (list): Tuples as returned by parser.parse_response.
+            now (float): Current time.monotonic() (optional).
+        """
+        if (not self.adaptive):
+            return
+        minutes = remaining_minutes(rows)
+        if (minutes is None):
+            return
+        now = time.monotonic() if now is None else now
+        interval = min(self.max_interval,
+                       max(self.min_interval,
+                           (minutes - LEAD_MINUTES) * 60))
+        self.schedule(query, now + interval)
+
+
+async def iter_scheduled(queries, fetch_conf, session=None, scheduler=None,
+                         item='response'):
+    """Async generator fetching the due queries of a PollScheduler, yielding
+    the output items of every answer and scheduling its next poll.
+
+    Arguments:
+        queries (list): List of tuples with the due query details.
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+        session (ClientSession): Session to reuse (optional).
+        scheduler (PollScheduler): The scheduler of the queries.
+        item (str): Output items: `response` (API answer text),
+            `raw_response` (API answer bytes), `stop_times` (parsed rows in
+            CSV format) or `query_response` (query and API answer bytes).
+
+    Yields:
+        object: The output items.
+    """
+    csv_formatter = parser.CSVFormatter()
+    index = None
+    snapshot = True
+    if (item == 'stop_times'):
+        index = changes.get_schedule_index(fetch_conf)
+        if (index is not None):
+            snapshot = index.start_tick()
+    parse = scheduler.adaptive or item == 'stop_times'
+    fetch_conf = dict(fetch_conf, raw_body=True)
+    async for query, body in stop_times.iter_query_responses(queries,
+                                                             fetch_conf,
+                                                             session):
+        rows = parser.parse_response(body) if parse else None
+        scheduler.answered(query, rows)
+        if (item == 'query_response'):
+            yield query, body
+        elif (item == 'raw_response'):
+            yield body
+        elif (item == 'stop_times'):
+            if (index is not None and not index.update(rows, snapshot)):
+                continue
+            for row in csv_formatter.format_rows(rows):
+                yield row
+        else:
+            yield body.decode('utf-8', errors='replace')
@@ -0,0 +1,4 @@
+"""Clients of the RATP API."""
+
+# Base URL of the schedules API
+API_URL = 'https://api-ratp.pierre-grimaud.fr/v4/schedules/'
@@ -0,0 +1,536 @@
+"""Analysis of the fetch logs, e.g. the ones of a `--max-conn-test` sweep.
+
+The logs are streamed in chunks of lines, so the memory used does not depend
+on their size: every group of requests (max_connections, transport_type) only
+keeps counters, a latency histogram with logarithmic buckets, from which the
+percentiles are estimated, and the seconds when it made requests. If NumPy
+is installed, the columns of every chunk are split and aggregated with it,
+without a Python loop over the rows.
+"""
+import bisect
+import logging
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger()
+
+# Bytes read at once from the logs
+CHUNK_SIZE = 16 * 1024 * 1024
+# Upper bounds of the latency histogram buckets in seconds: 20 per decade
+# from 1 ms to 100 s, the last bucket holds the slower responses
+BUCKETS_PER_DECADE = 20
+LATENCY_BOUNDS = [10 ** (exponent / BUCKETS_PER_DECADE)
+                  for exponent in range(-3 * BUCKETS_PER_DECADE,
+                                        2 * BUCKETS_PER_DECADE + 1)]
+# Key of the groups of every transport type
+ALL_TYPES = 'all'
+NEWLINE = ord('\n')
+COMMA = ord(',')
+# Longest column of a row split with NumPy, longer ones are malformed rows
+MAX_FIELD_WIDTH = 64
+DATE_WIDTH = len('YYYY-MM-DD HH:MM:SS')
+# Positions of the digits and separators of `YYYY-MM-DD HH:MM:SS`
+DATE_DIGITS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+DATE_SEPARATORS = [4, 7, 10, 13, 16]
+SEPARATOR_BYTES = list(b'-- ::')
+# Seconds as YYYYMMDDhhmmss integers are below
+SECONDS_SPAN = 10 ** 14
+
+
+class GroupStats:
+    """Aggregated requests of a group.
+
+    Arguments:
+        max_connections (int): Maximum connections of the requests.
+    """
+
+    def __init__(self, max_connections):
+        self.max_connections = max_connections
+        self.requests = 0
+        self.timeouts = 0
+        self.connection_errors = 0
+        # Answers with a status other than 200 or 304
+        self.error_statuses = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * (len(LATENCY_BOUNDS) + 1)
+        self.seconds = set()
+
+    @property
+    def answers(self):
+        """Number of successful answers."""
+        return (self.requests - self.timeouts - self.connection_errors
+                - self.error_statuses)
+
+    @property
+    def error_rate(self):
+        """Share of the requests that failed."""
+        if (self.requests < 1):
+            return 0.0
+        return 1 - self.answers / self.requests
+
+    @property
+    def throughput(self):
+        """Successful answers per second the group was making requests."""
+        if (not self.seconds):
+            return 0.0
+        return self.answers / len(self.seconds)
+
+    @property
+    def mean_latency(self):
+        """Mean response time of the answers in seconds."""
+        answered = sum(self.latency_buckets)
+        return self.latency_sum / answered if answered else None
+
+    @property
+    def little_throughput(self):
+        """Answers per second with every connection busy, by Little's law:
+        max_connections / mean latency.
+        """
+        mean_latency = self.mean_latency
+        if (not mean_latency or self.max_connections is None):
+            return None
+        return self.max_connections / mean_latency
+
+    def percentile(self, q):
+        """Estimate a latency percentile of the answers from the histogram.
+
+        Arguments:
+            q (float): The percentile, between 0 and 100.
+
+        Returns:
+            float: The geometric center of the bucket holding the percentile
+                in seconds (the last bound for the slowest bucket), or None
+                without answers.
+        """
+        answered = sum(self.latency_buckets)
+        if (answered < 1):
+            return None
+        rank = q / 100 * answered
+        cumulated = 0
+        for i, count in enumerate(self.latency_buckets):
+            cumulated += count
+            if (count and cumulated >= rank):
+                break
+        if (i == 0):
+            return LATENCY_BOUNDS[0]
+        if (i >= len(LATENCY_BOUNDS)):
+            return LATENCY_BOUNDS[-1]
+        return math.sqrt(LATENCY_BOUNDS[i - 1] * LATENCY_BOUNDS[i])
+
+    def merge(self, other):
+        """Add the requests of another group.
+
+        Arguments:
+            other (GroupStats): The group.
+        """
+        self.requests += other.requests
+        self.timeouts += other.timeouts
+        self.connection_errors += other.connection_errors
+        self.error_statuses += other.error_statuses
+        self.latency_sum += other.latency_sum
+        self.latency_buckets = [a + b for a, b in zip(self.latency_buckets,
+                                                      other.latency_buckets)]
+        self.seconds.update(other.seconds)
+
+
+def parse_max_connections(value):
+    """Parse the max_connections column, None if not logged."""
+    return int(value) if value.isdigit() else None
+
+
+def split_row(line):
+    """Split a fetch log row into the columns used by the analysis. The
+    station names are not quoted in the logs, so the columns are taken from
+    both ends of the row.
+
+    Arguments:
+        line (str): CSV row of the fetch log.
+
+    Returns:
+        tuple: The second of the request (`YYYY-MM-DD HH:MM:SS`),
+            transport_type, resp_time, resp_status, timeout, connection_error
+            and max_connections columns, or None for a header or malformed
+            row.
+    """
+    head, sep, tail = line.partition(',')
+    columns = tail.rsplit(',', 7)
+    if (not sep or len(columns) < 8 or head == 'actual_date'):
+        return None
+    (query, resp_time, resp_status, resp_length, timeout, connection_error,
+     max_connections, timeout_time) = columns
+    return (head[:19], query.partition(',')[0], resp_time, resp_status,
+            timeout, connection_error, max_connections)
+
+
+def iter_byte_chunks(path, chunk_size=CHUNK_SIZE):
+    """Read a file in chunks of whole lines.
+
+    Arguments:
+        path (str): Path to the file.
+        chunk_size (int): Bytes read at once.
+
+    Yields:
+        bytes: Every chunk, ending with a newline except the last one.
+    """
+    with open(path, 'rb') as f:
+        rest = b''
+        while True:
+            data = f.read(chunk_size)
+            if (not data):
+                break
+            data = rest + data
+            end = data.rfind(b'\n') + 1
+            rest = data[end:]
+            if (end):
+                yield data[:end]
+        if (rest.strip()):
+            yield rest
+
+
+def iter_chunks(path, chunk_size=CHUNK_SIZE):
+    """Read a file in chunks of whole lines.
+
+    Arguments:
+        path (str): Path to the file.
+        chunk_size (int): Bytes read at once.
+
+    Yields:
+        list: The lines of every chunk.
+    """
+    for data in iter_byte_chunks(path, chunk_size):
+        yield data.decode('utf-8', errors='replace').split('\n')
+
+
+def aggregate_rows(groups, rows):
+    """Add parsed rows to the groups one by one. The answered rows whose
+    resp_time is not a number are skipped.
+
+    Arguments:
+        groups (dict): GroupStats by (max_connections, transport_type).
+        rows (list): Tuples as returned by split_row.
+    """
+    for (second, transport_type, resp_time, resp_status, timeout,
+         connection_error, max_connections) in rows:
+        latency = None
+        if (timeout != 'True' and connection_error != 'True'
+                and resp_status in ('200', '304')):
+            try:
+                latency = float(resp_time)
+            except ValueError:
+                continue
+        key = (max_connections, transport_type)
+        group = groups.get(key)
+        if (group is None):
+            group = groups[key] = GroupStats(
+                    parse_max_connections(max_connections))
+        group.requests += 1
+        group.seconds.add(second)
+        if (timeout == 'True'):
+            group.timeouts += 1
+        elif (connection_error == 'True'):
+            group.connection_errors += 1
+        elif (latency is None):
+            group.error_statuses += 1
+        else:
+            group.latency_sum += latency
+            group.latency_buckets[
+                    bisect.bisect_left(LATENCY_BOUNDS, latency)] += 1
+
+
+def gather_fields(buffer, starts, ends):
+    """Gather the fields of a chunk at once.
+
+    Arguments:
+        buffer (ndarray): The chunk as uint8.
+        starts (ndarray): Start offset of every field.
+        ends (ndarray): End offset (exclusive) of every field.
+
+    Returns:
+        ndarray: The fields as a bytes array, padded to the longest one.
+    """
+    lengths = ends - starts
+    width = max(1, int(lengths.max())) if len(lengths) else 1
+    offsets = numpy.arange(width)
+    fields = buffer[numpy.minimum(starts[:, None] + offsets,
+                                  len(buffer) - 1)]
+    fields[offsets >= lengths[:, None]] = 0
+    return fields.view('S{}'.format(width)).ravel()
+
+
+def field_equals(buffer, starts, ends, value):
+    """Compare the fields of a chunk with a value.
+
+    Arguments:
+        buffer (ndarray): The chunk as uint8.
+        starts (ndarray): Start offset of every field.
+        ends (ndarray): End offset (exclusive) of every field.
+        value (bytes): The value.
+
+    Returns:
+        ndarray: Whether every field is the value.
+    """
+    equal = ends - starts == len(value)
+    for i, byte in enumerate(value):
+        equal &= buffer[numpy.minimum(starts + i, len(buffer) - 1)] == byte
+    return equal
+
+
+def parse_seconds(buffer, starts):
+    """Parse the `YYYY-MM-DD HH:MM:SS` dates starting at some offsets of a
+    chunk as YYYYMMDDhhmmss integers.
+
+    Returns:
+        ndarray: The integers, -1 for the malformed dates.
+    """
+    if (len(buffer) < DATE_WIDTH):
+        return numpy.full(len(starts), -1, dtype=numpy.int64)
+    # The rows too short for a date are skipped by the caller
+    starts = numpy.minimum(starts, len(buffer) - DATE_WIDTH)
+    valid = numpy.ones(len(starts), dtype=bool)
+    for position, separator in zip(DATE_SEPARATORS, SEPARATOR_BYTES):
+        valid &= buffer[starts + position] == separator
+    seconds = numpy.zeros(len(starts), dtype=numpy.int64)
+    for position in DATE_DIGITS:
+        digits = buffer[starts + position] - ord('0')
+        valid &= digits <= 9
+        seconds = seconds * 10 + digits
+    return numpy.where(valid, seconds, -1)
+
+
+def format_second(second):
+    """Format a YYYYMMDDhhmmss integer as the `YYYY-MM-DD HH:MM:SS` second
+    of split_row.
+    """
+    digits = '{:014d}'.format(second)
+    return '{}-{}-{} {}:{}:{}'.format(digits[:4], digits[4:6], digits[6:8],
+                                      digits[8:10], digits[10:12],
+                                      digits[12:])
+
+
+def parse_latencies(values):
+    """Convert a bytes array of response times to floats, NaN for the ones
+    that are not numbers.
+    """
+    try:
+        return values.astype(float)
+    except ValueError:
+        latencies = numpy.empty(len(values))
+        for i, value in enumerate(values):
+            try:
+                latencies[i] = float(value)
+            except ValueError:
+                latencies[i] = numpy.nan
+        return latencies
+
+
+def split_chunk(data):
+    """NumPy version of split_row for a whole chunk, locating the columns
+    from the positions of its newlines and commas. Only the response times
+    of the answers are copied out of the chunk: the flags and statuses are
+    compared in place and the dates parsed to integers.
+
+    Arguments:
+        data (bytes): Chunk of whole rows of fetch logs.
+
+    Returns:
+        tuple: Arrays with the second (YYYYMMDDhhmmss integer),
+            transport_type and max_connections (bytes), timeout,
+            connection_error and error status flags and the latency (NaN if
+            not answered) of every row. The header and malformed rows are
+            skipped, including the ones without a `YYYY-MM-DD HH:MM:SS`
+            date, a numeric latency or with a column longer than
+            MAX_FIELD_WIDTH.
+    """
+    buffer = numpy.frombuffer(data, dtype=numpy.uint8)
+    ends = numpy.flatnonzero(buffer == NEWLINE)
+    if (not len(ends) or ends[-1] != len(buffer) - 1):
+        ends = numpy.append(ends, len(buffer))
+    starts = numpy.concatenate(([0], ends[:-1] + 1))
+    commas = numpy.flatnonzero(buffer == COMMA)
+    first = numpy.searchsorted(commas, starts)
+    # Index of the first comma of the next row
+    last = numpy.searchsorted(commas, ends)
+    valid = last - first >= 8
+    starts, first, last = starts[valid], first[valid], last[valid]
+    seconds = parse_seconds(buffer, starts)
+    valid = (seconds >= 0) & (commas[first] - starts >= DATE_WIDTH)
+    seconds, first, last = seconds[valid], first[valid], last[valid]
+
+    def column(left, right):
+        return commas[left] + 1, commas[right]
+
+    transport_type = column(first, first + 1)
+    resp_time = column(last - 7, last - 6)
+    resp_status = column(last - 6, last - 5)
+    max_connections = column(last - 2, last - 1)
+    valid = numpy.ones(len(seconds), dtype=bool)
+    for field_starts, field_ends in (transport_type, resp_time,
+                                     max_connections):
+        valid &= field_ends - field_starts <= MAX_FIELD_WIDTH
+    timeout = field_equals(buffer, *column(last - 4, last - 3), b'True')
+    connection_error = field_equals(buffer, *column(last - 3, last - 2),
+                                    b'True') & ~timeout
+    error_status = (~timeout & ~connection_error
+                    & ~field_equals(buffer, *resp_status, b'200')
+                    & ~field_equals(buffer, *resp_status, b'304'))
+    answered = numpy.flatnonzero(valid & ~(timeout | connection_error
+                                           | error_status))
+    latencies = numpy.full(len(seconds), numpy.nan)
+    latencies[answered] = parse_latencies(gather_fields(
+            buffer, resp_time[0][answered], resp_time[1][answered]))
+    valid[answered[numpy.isnan(latencies[answered])]] = False
+    return (seconds[valid],
+            gather_fields(buffer, transport_type[0][valid],
+                          transport_type[1][valid]),
+            gather_fields(buffer, max_connections[0][valid],
+                          max_connections[1][valid]),
+            timeout[valid], connection_error[valid], error_status[valid],
+            latencies[valid])
+
+
+def aggregate_columns(groups, columns):
+    """NumPy version of aggregate_rows, counting every column of a chunk at
+    once.
+
+    Arguments:
+        groups (dict): GroupStats by (max_connections, transport_type).
+        columns (tuple): Arrays as returned by split_chunk.
+    """
+    (seconds, transport_types, max_connections, timeout, connection_error,
+     error_status, latencies) = columns
+    if (not len(seconds)):
+        return
+    connection_values, connection_codes = numpy.unique(max_connections,
+                                                       return_inverse=True)
+    type_values, type_codes = numpy.unique(transport_types,
+                                           return_inverse=True)
+    group_codes, inverse = numpy.unique(
+            connection_codes.ravel() * len(type_values) + type_codes.ravel(),
+            return_inverse=True)
+    inverse = inverse.ravel()
+    n_groups = len(group_codes)
+    answered = ~numpy.isnan(latencies)
+    answered_groups = inverse[answered]
+    latencies = latencies[answered]
+    buckets = numpy.searchsorted(LATENCY_BOUNDS, latencies, side='left')
+    n_buckets = len(LATENCY_BOUNDS) + 1
+    histograms = numpy.bincount(answered_groups * n_buckets + buckets,
+                                minlength=n_groups * n_buckets)
+    histograms = histograms.reshape(n_groups, n_buckets)
+    requests = numpy.bincount(inverse, minlength=n_groups)
+    counts = [numpy.bincount(inverse, weights=flags, minlength=n_groups)
+              for flags in (timeout, connection_error, error_status)]
+    latency_sums = numpy.bincount(answered_groups, weights=latencies,
+                                  minlength=n_groups)
+    group_seconds = {}
+    for group_index, second in zip(*divmod(numpy.unique(
+            inverse * SECONDS_SPAN + seconds), SECONDS_SPAN)):
+        group_seconds.setdefault(int(group_index), set()).add(
+                format_second(int(second)))
+    for i, code in enumerate(group_codes.tolist()):
+        connection_index, type_index = divmod(code, len(type_values))
+        key = (connection_values[connection_index].decode('utf-8',
+                                                          'replace'),
+               type_values[type_index].decode('utf-8', 'replace'))
+        group = groups.get(key)
+        if (group is None):
+            group = groups[key] = GroupStats(parse_max_connections(key[0]))
+        group.requests += int(requests[i])
+        group.timeouts += int(counts[0][i])
+        group.connection_errors += int(counts[1][i])
+        group.error_statuses += int(counts[2][i])
+        group.latency_sum += float(latency_sums[i])
+        group.latency_buckets = [
+                a + b for a, b in zip(group.latency_buckets,
+                                      histograms[i].tolist())]
+        group.seconds.update(group_seconds.get(i, ()))
+
+
+def analyze(paths, chunk_size=CHUNK_SIZE, vectorized=None):
+    """Aggregate the requests of fetch logs by max_connections and transport
+    type.
+
+    Arguments:
+        paths (list): Paths to the fetch log files.
+        chunk_size (int): Bytes read at once.
+        vectorized (bool): Split and aggregate the chunks with NumPy, by
+            default if installed.
+
+    Returns:
+        dict: GroupStats by (max_connections, transport_type), as logged.
+    """
+    if (vectorized is None):
+        vectorized = numpy is not None
+    groups = {}
+    for path in paths:
+        if (vectorized):
+            for data in iter_byte_chunks(path, chunk_size):
+                aggregate_columns(groups, split_chunk(data))
+            continue
+        for lines in iter_chunks(path, chunk_size):
+            rows = [row for row in map(split_row, lines) if row is not None]
+            if (rows):
+                aggregate_rows(groups, rows)
+    return groups
+
+
+def summarize(groups):
+    """Add the groups of every transport type (ALL_TYPES) of every
+    max_connections value.
+
+    Arguments:
+        groups (dict): GroupStats by (max_connections, transport_type).
+
+    Returns:
+        list: Tuples (max_connections, transport_type, GroupStats), sorted by
+            max_connections, with the group of every transport type first.
+    """
+    totals = {}
+    for (max_connections, transport_type), group in groups.items():
+        total = totals.get(max_connections)
+        if (total is None):
+            total = totals[max_connections] = GroupStats(
+                    group.max_connections)
+        total.merge(group)
+    summary = [(max_connections, ALL_TYPES, group)
+               for max_connections, group in totals.items()]
+    summary.extend((max_connections, transport_type, group)
+                   for (max_connections, transport_type), group
+                   in groups.items())
+
+    def sort_key(item):
+        max_connections, transport_type, group = item
+        return (group.max_connections is None, group.max_connections or 0,
+                max_connections, transport_type != ALL_TYPES, transport_type)
+
+    return sorted(summary, key=sort_key)
+
+
+def recommend(summary, max_error_rate=0.01, tolerance=0.95):
+    """Recommend a max_connections value: the lowest one whose throughput is
+    within the tolerance of the best one, among the ones whose error rate is
+    acceptable. More connections than needed only load the API.
+
+    Arguments:
+        summary (list): Tuples as returned by summarize.
+        max_error_rate (float): Maximum acceptable error rate.
+        tolerance (float): Share of the best throughput that is enough.
+
+    Returns:
+        GroupStats: The group of every transport type of the recommended
+            value, or None if no value is acceptable.
+    """
+    candidates = [group for max_connections, transport_type, group in summary
+                  if transport_type == ALL_TYPES
+                  and group.max_connections is not None
+                  and group.error_rate <= max_error_rate]
+    if (not candidates):
+        return None
+    best = max(group.throughput for group in candidates)
+    return min((group for group in candidates
+                if group.throughput >= tolerance * best),
+               key=lambda group: group.max_connections)
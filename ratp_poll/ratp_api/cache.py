@@ -0,0 +1,177 @@
+"""In-process cache of the API responses."""
+import asyncio
+from collections import OrderedDict
+import logging
+import os
+import time
+
+logger = logging.getLogger()
+
+# Caches of the current process by configuration. Keyed by PID too, so a
+# forked worker does not share the in-flight requests of its parent.
+_caches = {}
+
+
+class CacheEntry:
+    """Cached response body with its expiration time and validators.
+
+    Arguments:
+        body (bytes): Response body.
+        expires (float): Monotonic time when the entry stops being fresh.
+        etag (str): ETag header of the response, if any.
+        last_modified (str): Last-Modified header of the response, if any.
+    """
+
+    __slots__ = ('body', 'expires', 'etag', 'last_modified')
+
+    def __init__(self, body, expires, etag=None, last_modified=None):
+        self.body = body
+        self.expires = expires
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class ResponseCache:
+    """LRU cache of responses keyed by URL, with a time to live.
+
+    Concurrent requests of the same URL are collapsed into one, and expired
+    entries are kept (until evicted) to revalidate them with conditional
+    requests when the API sent an ETag or Last-Modified header.
+
+    Arguments:
+        ttl (float): Seconds a response is fresh. With 0 only the in-flight
+            requests are shared.
+        max_size (int): Maximum number of cached responses.
+    """
+
+    def __init__(self, ttl, max_size=4096):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+
+    def get(self, url):
+        """Get the fresh cached response of an URL.
+
+        Arguments:
+            url (str): The requested URL.
+
+        Returns:
+            bytes: Response body, or None if not cached or expired.
+        """
+        entry = self._entries.get(url)
+        if (entry is None or entry.expires <= time.monotonic()):
+            return None
+        self._entries.move_to_end(url)
+        return entry.body
+
+    def validators(self, url):
+        """Get the conditional request headers to revalidate an URL.
+
+        Arguments:
+            url (str): The requested URL.
+
+        Returns:
+            dict: If-None-Match and If-Modified-Since headers, or None if the
+                URL has no cached entry with validators.
+        """
+        entry = self._entries.get(url)
+        if (entry is None):
+            return None
+        headers = {}
+        if (entry.etag):
+            headers['If-None-Match'] = entry.etag
+        if (entry.last_modified):
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers or None
+
+    def store(self, url, body, headers):
+        """Cache a response.
+
+        Arguments:
+            url (str): The requested URL.
+            body (bytes): Response body.
+            headers (Mapping): Response headers.
+        """
+        self._entries[url] = CacheEntry(body, time.monotonic() + self.ttl,
+                                        headers.get('ETag'),
+                                        headers.get('Last-Modified'))
+        self._entries.move_to_end(url)
+        while (len(self._entries) > self.max_size):
+            self._entries.popitem(last=False)
+
+    def revalidated(self, url):
+        """Renew the cached response of an URL after a 304 answer.
+
+        Arguments:
+            url (str): The requested URL.
+
+        Returns:
+            bytes: Cached response body, or None if evicted meanwhile.
+        """
+        entry = self._entries.get(url)
+        if (entry is None):
+            return None
+        entry.expires = time.monotonic() + self.ttl
+        self._entries.move_to_end(url)
+        return entry.body
+
+    async def get_or_fetch(self, url, fetcher):
+        """Get the response of an URL from the cache, from an in-flight
+        request of the same URL or, otherwise, fetching it.
+
+        Arguments:
+            url (str): The requested URL.
+            fetcher (callable): Coroutine function without arguments fetching
+                the URL. Its result is shared with the concurrent callers.
+
+        Returns:
+            bytes: Response body (None if failed).
+        """
+        body = self.get(url)
+        if (body is not None):
+            self.hits += 1
+            logger.debug("Cache hit: " + url)
+            return body
+
+        in_flight = self._in_flight.get(url)
+        if (in_flight is not None):
+            self.hits += 1
+            logger.debug("Joined in-flight request: " + url)
+            return await asyncio.shield(in_flight)
+
+        self.misses += 1
+        future = asyncio.get_event_loop().create_future()
+        self._in_flight[url] = future
+        body = None
+        try:
+            body = await fetcher()
+            return body
+        finally:
+            del self._in_flight[url]
+            future.set_result(body)
+
+
+def get_response_cache(fetch_conf):
+    """Get the ResponseCache of the current process configured by fetch_conf,
+    creating it if needed.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content. The cache is enabled by `cache_ttl`.
+
+    Returns:
+        ResponseCache: The cache, or None if disabled.
+    """
+    ttl = fetch_conf.get('cache_ttl')
+    if (ttl is None):
+        return None
+    max_size = fetch_conf.get('cache_size', 4096)
+    key = (os.getpid(), ttl, max_size)
+    cache = _caches.get(key)
+    if (cache is None):
+        cache = ResponseCache(ttl, max_size)
+        _caches[key] = cache
+    return cache
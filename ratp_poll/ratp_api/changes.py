@@ -0,0 +1,86 @@
+"""Change detection of the stop times between ticks.
+
+The index keeps, for every `_metadata.call`, a hash of the last schedule
+seen (the remaining times and destinations, not the answer date), so it only
+costs a few dozen bytes per query.
+"""
+import os
+
+# Indexes of the current process by snapshot period
+_indexes = {}
+_indexes_pid = None
+
+
+class ScheduleIndex:
+    """Last seen schedule of every query.
+
+    Arguments:
+        snapshot_every (int): Emit every schedule, changed or not, once every
+            given ticks (0 to never do it after the first tick).
+    """
+
+    def __init__(self, snapshot_every=0):
+        self.snapshot_every = snapshot_every
+        self.ticks = 0
+        self._hashes = {}
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def start_tick(self):
+        """Start a tick, deciding if it is a full snapshot.
+
+        Returns:
+            bool: Whether every schedule is emitted in this tick.
+        """
+        snapshot = (self.ticks == 0 or (
+                self.snapshot_every > 0
+                and self.ticks % self.snapshot_every == 0))
+        self.ticks += 1
+        return snapshot
+
+    def update(self, rows, snapshot=False):
+        """Record the schedule of an API answer.
+
+        Arguments:
+            rows (list): Tuples (actual_date, query, remaining_minutes,
+                destination_stop) of the answer, as returned by
+                parser.parse_response.
+            snapshot (bool): Whether the tick is a full snapshot.
+
+        Returns:
+            bool: Whether the rows have to be emitted: the schedule is new or
+                changed, or the tick is a snapshot.
+        """
+        if (not rows):
+            return False
+        call = rows[0][1]
+        schedule_hash = hash(tuple((row[2], row[3]) for row in rows))
+        changed = self._hashes.get(call) != schedule_hash
+        self._hashes[call] = schedule_hash
+        return changed or snapshot
+
+
+def get_schedule_index(fetch_conf):
+    """Get the schedule index of the current process if the change detection
+    is enabled (`changes_only` in fetch_conf), creating it if needed.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content. `snapshot_every` sets the period of the
+            full snapshots in ticks.
+
+    Returns:
+        ScheduleIndex: The index, or None if disabled.
+    """
+    global _indexes, _indexes_pid
+    if (not fetch_conf.get('changes_only')):
+        return None
+    if (_indexes_pid != os.getpid()):
+        _indexes = {}
+        _indexes_pid = os.getpid()
+    snapshot_every = fetch_conf.get('snapshot_every', 0)
+    index = _indexes.get(snapshot_every)
+    if (index is None):
+        index = _indexes[snapshot_every] = ScheduleIndex(snapshot_every)
+    return index
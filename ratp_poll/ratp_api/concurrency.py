@@ -0,0 +1,122 @@
+"""Adaptive limit of the simultaneous requests."""
+import asyncio
+from collections import deque
+import logging
+import os
+
+logger = logging.getLogger()
+
+# Answers of an overloaded API, congestion signals like the timeouts
+CONGESTION_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+# Limiters of the current process by configuration, so the learnt limit is
+# kept between batches.
+_limiters = {}
+
+
+class AIMDLimiter:
+    """Additive increase, multiplicative decrease limit of the requests in
+    flight.
+
+    Every successful response increases the limit by `increase / limit`
+    (about `increase` per round trip with the limit saturated). A timeout, a
+    connection error, a CONGESTION_STATUSES answer or a response slower than
+    `latency_tolerance` times the fastest one seen multiplies the limit by
+    `decrease`, at most once per round trip so a burst of failures does not
+    collapse it.
+
+    Arguments:
+        initial (int): Initial limit.
+        max_limit (int): Maximum limit.
+        min_limit (int): Minimum limit.
+        increase (float): Additive increase per round trip.
+        decrease (float): Multiplicative decrease factor.
+        latency_tolerance (float): Response time, relative to the fastest
+            response, considered a congestion signal.
+    """
+
+    def __init__(self, initial, max_limit, min_limit=1, increase=1.0,
+                 decrease=0.7, latency_tolerance=4.0):
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.min_resp_time = None
+        self._last_decrease = None
+        self._waiters = deque()
+
+    async def acquire(self):
+        """Wait until a request can be sent within the limit."""
+        while (self.in_flight >= int(self.limit)):
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if (waiter in self._waiters):
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self, resp_time=None, failed=False):
+        """Release a request, adapting the limit to its outcome.
+
+        Arguments:
+            resp_time (float): Response time in seconds.
+            failed (bool): Whether the request timed out, could not connect
+                or got a CONGESTION_STATUSES answer.
+        """
+        self.in_flight -= 1
+        loop_time = asyncio.get_event_loop().time()
+        congested = failed
+        if (resp_time is not None and not failed):
+            if (self.min_resp_time is None or
+                    resp_time < self.min_resp_time):
+                self.min_resp_time = resp_time
+            congested = resp_time > self.latency_tolerance * \
+                self.min_resp_time
+        if (congested):
+            # Only one decrease per round trip.
+            if (self._last_decrease is None or resp_time is None or
+                    loop_time - self._last_decrease > resp_time):
+                self._last_decrease = loop_time
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                logger.debug("Concurrency limit decreased to "
+                             + str(int(self.limit)))
+        else:
+            self.limit = min(self.max_limit,
+                             self.limit + self.increase / self.limit)
+        self._wake_up()
+
+    def _wake_up(self):
+        available = int(self.limit) - self.in_flight
+        while (available > 0 and self._waiters):
+            waiter = self._waiters.popleft()
+            if (not waiter.done()):
+                waiter.set_result(None)
+                available -= 1
+
+
+def get_concurrency_limiter(fetch_conf):
+    """Get the AIMDLimiter of the current process configured by fetch_conf,
+    creating it if needed.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content. The limiter is enabled by
+            `adaptive_concurrency`, and `max_connections` is its maximum.
+
+    Returns:
+        AIMDLimiter: The limiter, or None if disabled.
+    """
+    if (not fetch_conf.get('adaptive_concurrency')):
+        return None
+    max_limit = fetch_conf['max_connections']
+    key = (os.getpid(), max_limit)
+    limiter = _limiters.get(key)
+    if (limiter is None):
+        limiter = AIMDLimiter(min(10, max_limit), max_limit)
+        _limiters[key] = limiter
+    return limiter
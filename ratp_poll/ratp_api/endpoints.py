@@ -0,0 +1,190 @@
+"""Client side load balancing of the requests among several base URLs of the
+API (e.g. mirrors of the public instance).
+
+Every attempt of a request picks an endpoint with the balancing policy:
+`least-outstanding` (the one with the fewest requests in flight for its
+weight, so a slow endpoint gets less of them) or `weighted` (smooth weighted
+round robin). An endpoint failing `FAILURE_THRESHOLD` attempts in a row is
+avoided for `cooldown` seconds, unless every endpoint is. The health of the
+endpoints is tracked by every process on its own.
+"""
+import logging
+import os
+import time
+
+logger = logging.getLogger()
+
+POLICIES = ('least-outstanding', 'weighted')
+# Consecutive failed attempts after which an endpoint is avoided
+FAILURE_THRESHOLD = 3
+# Default seconds a failing endpoint is avoided
+COOLDOWN = 30.0
+# Weight of the last latency in its moving average
+LATENCY_SMOOTHING = 0.2
+
+# Pools of the current process by configuration
+_pools = {}
+_pools_pid = None
+
+
+class Endpoint:
+    """Base URL of the API and its health.
+
+    Arguments:
+        url (str): The base URL.
+        weight (float): Share of the requests relative to the other ones,
+            positive.
+
+    Raises:
+        ValueError: If the weight is not positive.
+    """
+
+    def __init__(self, url, weight=1.0):
+        if (not weight > 0):
+            raise ValueError('The weight of {} must be positive, got {}'
+                             .format(url, weight))
+        self.url = url
+        self.weight = weight
+        self.outstanding = 0
+        self.failures = 0
+        self.latency = None
+        # time.monotonic() until which the endpoint is avoided
+        self.down_until = 0.0
+        # Smooth weighted round robin state
+        self.current_weight = 0.0
+
+    def __repr__(self):
+        return 'Endpoint({!r}, {!r})'.format(self.url, self.weight)
+
+    def healthy(self, now):
+        """Check if the endpoint is not avoided at a given time.monotonic()."""
+        return self.down_until <= now
+
+
+class EndpointPool:
+    """Balancer of the requests among several endpoints.
+
+    Arguments:
+        urls (list): Base URLs of the API.
+        weights (list): Weight of every URL (1 for all if not set).
+        policy (str): Balancing policy, one of POLICIES.
+        cooldown (float): Seconds a failing endpoint is avoided.
+    """
+
+    def __init__(self, urls, weights=None, policy='least-outstanding',
+                 cooldown=COOLDOWN):
+        weights = weights or [1.0] * len(urls)
+        self.endpoints = [Endpoint(url, float(weight))
+                          for url, weight in zip(urls, weights)]
+        self.policy = policy
+        self.cooldown = cooldown
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def choose(self, exclude=(), now=None):
+        """Pick the endpoint of an attempt.
+
+        Arguments:
+            exclude (list): Endpoints already tried by the request, only
+                picked again if there is no other one.
+            now (float): Current time.monotonic() (optional).
+
+        Returns:
+            Endpoint: The endpoint.
+        """
+        now = time.monotonic() if now is None else now
+        candidates = [endpoint for endpoint in self.endpoints
+                      if endpoint not in exclude]
+        if (not candidates):
+            candidates = self.endpoints
+        healthy = [endpoint for endpoint in candidates
+                   if endpoint.healthy(now)]
+        if (healthy):
+            candidates = healthy
+        if (self.policy == 'weighted'):
+            total = sum(endpoint.weight for endpoint in candidates)
+            for endpoint in candidates:
+                endpoint.current_weight += endpoint.weight
+            chosen = max(candidates,
+                         key=lambda endpoint: endpoint.current_weight)
+            chosen.current_weight -= total
+            return chosen
+        return min(candidates, key=lambda endpoint: (
+                (endpoint.outstanding + 1) / endpoint.weight,
+                endpoint.latency or 0.0))
+
+    def untried(self, tried, now=None):
+        """Check if a request can fail over to a healthy endpoint it has not
+        tried yet.
+
+        Arguments:
+            tried (list): Endpoints already tried by the request.
+            now (float): Current time.monotonic() (optional).
+
+        Returns:
+            bool: Whether there is such an endpoint.
+        """
+        now = time.monotonic() if now is None else now
+        return any(endpoint not in tried and endpoint.healthy(now)
+                   for endpoint in self.endpoints)
+
+    def start(self, endpoint):
+        """Count an attempt in flight to an endpoint."""
+        endpoint.outstanding += 1
+
+    def finish(self, endpoint, ok, latency, now=None):
+        """Record the outcome of an attempt to an endpoint.
+
+        Arguments:
+            endpoint (Endpoint): The endpoint.
+            ok (bool): Whether the attempt got an answer to keep.
+            latency (float): Seconds the attempt took.
+            now (float): Current time.monotonic() (optional).
+        """
+        endpoint.outstanding -= 1
+        if (ok):
+            endpoint.failures = 0
+            if (endpoint.latency is None):
+                endpoint.latency = latency
+            else:
+                endpoint.latency += LATENCY_SMOOTHING * (latency
+                                                         - endpoint.latency)
+            return
+        endpoint.failures += 1
+        if (endpoint.failures >= FAILURE_THRESHOLD):
+            now = time.monotonic() if now is None else now
+            if (endpoint.healthy(now)):
+                logger.warning("Avoiding %s for %s s after %s failures",
+                               endpoint.url, self.cooldown,
+                               endpoint.failures)
+            endpoint.down_until = now + self.cooldown
+
+
+def get_endpoint_pool(fetch_conf):
+    """Get the endpoint pool of the current process if there are several
+    base URLs (`api_urls` in fetch_conf), creating it if needed.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content. `api_weights`, `balance` (one of POLICIES)
+            and `cooldown` configure the pool.
+
+    Returns:
+        EndpointPool: The pool, or None if disabled.
+    """
+    global _pools, _pools_pid
+    urls = fetch_conf.get('api_urls')
+    if (not urls or len(urls) < 2):
+        return None
+    if (_pools_pid != os.getpid()):
+        _pools = {}
+        _pools_pid = os.getpid()
+    weights = fetch_conf.get('api_weights')
+    policy = fetch_conf.get('balance') or 'least-outstanding'
+    cooldown = fetch_conf.get('cooldown', COOLDOWN)
+    key = (tuple(urls), tuple(weights or ()), policy, cooldown)
+    pool = _pools.get(key)
+    if (pool is None):
+        pool = _pools[key] = EndpointPool(urls, weights, policy, cooldown)
+    return pool
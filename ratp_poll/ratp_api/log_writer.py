@@ -0,0 +1,141 @@
+"""Buffered CSV writer for the fetch logs."""
+import atexit
+import logging
+import os
+import pathlib
+import threading
+
+logger = logging.getLogger()
+
+fetch_log_csv_columns = 'actual_date,transport_type,line_code,stop_code,' \
+                        'way,resp_time,resp_status,' \
+                        'resp_length,timeout,connection_error,' \
+                        'max_connections,timeout_time'
+
+# Writers of the current process by log path. Keyed by PID too, as the
+# flushing thread of a writer does not survive a fork.
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def append_csv_rows(path, csv_columns, rows):
+    """Append CSV rows to a file preventing collisions with a lock, writing
+    the columns header if the file does not exist yet.
+
+    Rows are separated by new lines, without a trailing one.
+
+    Arguments:
+        path (str): Path to the CSV file.
+        csv_columns (str): Header line.
+        rows (list): CSV lines to append.
+    """
+    # Imported here, as it is only needed when the fetch log is enabled
+    from filelock import FileLock
+
+    with FileLock(path + '.lock', timeout=10):
+        path_exists = pathlib.Path(path).exists()
+        with open(path, 'a+') as f:
+            if (path_exists):
+                f.write('\n')
+            else:
+                f.write(csv_columns + '\n')
+            f.write('\n'.join(rows))
+
+
+class FetchLogWriter:
+    """Fetch log sink that buffers the CSV rows in memory and appends them to
+    the file in bulk from a background thread.
+
+    Writing a row only takes a thread lock, so it can be called from a
+    coroutine without blocking the event loop. The file lock is taken once per
+    flush, keeping the log safe to share among processes.
+
+    Arguments:
+        path (str): Path to the fetch log file.
+        max_rows (int): Number of buffered rows that triggers a flush.
+        flush_interval (float): Maximum seconds a row stays buffered.
+    """
+
+    def __init__(self, path, max_rows=1000, flush_interval=1.0):
+        self.path = path
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._rows_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, *args):
+        """Buffer a CSV row.
+
+        Arguments:
+            *args (object): CSV line column values.
+        """
+        log_csv = ",".join([str(arg) for arg in args])
+        with self._rows_lock:
+            self._rows.append(log_csv)
+            full = len(self._rows) >= self.max_rows
+        if (full):
+            self._wakeup.set()
+
+    def flush(self):
+        """Append the buffered rows to the log file."""
+        with self._flush_lock:
+            with self._rows_lock:
+                rows, self._rows = self._rows, []
+            if (rows):
+                logger.debug("Flushing " + str(len(rows))
+                             + " fetch log lines")
+                append_csv_rows(self.path, fetch_log_csv_columns, rows)
+
+    def close(self):
+        """Stop the background thread and flush the remaining rows."""
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while (not self._closed):
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Fetch log flush error: " + str(e))
+
+
+def get_fetch_log_writer(path, max_rows=1000, flush_interval=1.0):
+    """Get the FetchLogWriter of the current process for a log file, creating
+    it if needed.
+
+    Arguments:
+        path (str): Path to the fetch log file.
+        max_rows (int): Number of buffered rows that triggers a flush.
+        flush_interval (float): Maximum seconds a row stays buffered.
+
+    Returns:
+        FetchLogWriter: The writer.
+    """
+    key = (os.getpid(), str(path))
+    with _writers_lock:
+        writer = _writers.get(key)
+        if (writer is None):
+            writer = FetchLogWriter(str(path), max_rows, flush_interval)
+            _writers[key] = writer
+        return writer
+
+
+def flush_fetch_logs():
+    """Flush every FetchLogWriter of the current process."""
+    pid = os.getpid()
+    with _writers_lock:
+        writers = [w for (w_pid, _), w in _writers.items() if w_pid == pid]
+    for writer in writers:
+        writer.flush()
+
+
+atexit.register(flush_fetch_logs)
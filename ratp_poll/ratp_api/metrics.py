@@ -0,0 +1,288 @@
+"""In-process metrics of the fetching, exposed in the Prometheus text format.
+
+The metrics are plain dictionaries keyed by the label values, so recording a
+sample in the hot path costs a dictionary lookup and an addition. They are
+only recorded when enabled (`metrics` in fetch_conf).
+"""
+from bisect import bisect_left
+import os
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Upper bounds in seconds of the tick duration histogram buckets
+TICK_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Registry of the current process
+_registry = None
+_registry_pid = None
+
+
+def escape_label(value):
+    """Escape a label value."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+                     .replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=''):
+    """Format a label set, e.g. `{transport_type="buses",line="187"}`."""
+    labels = ['{}="{}"'.format(name, escape_label(value))
+              for name, value in zip(names, values)]
+    if (extra):
+        labels.append(extra)
+    if (not labels):
+        return ''
+    return '{' + ','.join(labels) + '}'
+
+
+def format_value(value):
+    """Format a sample value."""
+    if (value == float('inf')):
+        return '+Inf'
+    if (isinstance(value, float) and value.is_integer()):
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    """Monotonically increasing value by label values.
+
+    Arguments:
+        name (str): Metric name.
+        documentation (str): Help text.
+        labels (tuple): Label names.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        """Increase the value of a label set."""
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        """Generate the exposition lines of the samples."""
+        for labels, value in sorted(self.values.items()):
+            yield '{}{} {}'.format(self.name,
+                                   format_labels(self.labels, labels),
+                                   format_value(value))
+
+    def snapshot(self):
+        """Get the values, to be merged in another registry."""
+        return dict(self.values)
+
+    def merge(self, values):
+        """Add the values of a snapshot."""
+        for labels, value in values.items():
+            self.inc(labels, value)
+
+    def reset(self):
+        """Remove all the values."""
+        self.values = {}
+
+
+class Gauge(Counter):
+    """Value that can go up and down by label values."""
+
+    kind = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        """Decrease the value of a label set."""
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def set(self, labels=(), value=0):
+        """Set the value of a label set."""
+        self.values[labels] = value
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets by label values.
+
+    Arguments:
+        name (str): Metric name.
+        documentation (str): Help text.
+        labels (tuple): Label names.
+        buckets (tuple): Sorted bucket upper bounds.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # Label values -> [bucket counts..., +Inf count, sum]
+        self.values = {}
+
+    def observe(self, labels=(), value=0.0):
+        """Record an observation for a label set."""
+        counts = self.values.get(labels)
+        if (counts is None):
+            counts = self.values[labels] = [0] * (len(self.buckets) + 1) \
+                                           + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self):
+        """Generate the exposition lines of the samples."""
+        bounds = self.buckets + (float('inf'),)
+        for labels, counts in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield '{}_bucket{} {}'.format(
+                        self.name,
+                        format_labels(self.labels, labels,
+                                      'le="' + format_value(float(bound))
+                                      + '"'),
+                        cumulative)
+            label_set = format_labels(self.labels, labels)
+            yield '{}_sum{} {}'.format(self.name, label_set,
+                                       format_value(counts[-1]))
+            yield '{}_count{} {}'.format(self.name, label_set, cumulative)
+
+    def snapshot(self):
+        """Get the values, to be merged in another registry."""
+        return {labels: list(counts) for labels, counts in self.values.items()}
+
+    def merge(self, values):
+        """Add the values of a snapshot."""
+        for labels, counts in values.items():
+            own = self.values.get(labels)
+            if (own is None):
+                self.values[labels] = list(counts)
+            else:
+                for i, count in enumerate(counts):
+                    own[i] += count
+
+    def reset(self):
+        """Remove all the values."""
+        self.values = {}
+
+
+class Metrics:
+    """Registry of the fetching and daemon metrics."""
+
+    def __init__(self):
+        query_labels = ('transport_type', 'line')
+        self.requests = Counter(
+                'ratp_poll_requests_total',
+                'API answers by status code.',
+                query_labels + ('status',))
+        self.timeouts = Counter(
+                'ratp_poll_request_timeouts_total',
+                'API requests that timed out.',
+                query_labels)
+        self.connection_errors = Counter(
+                'ratp_poll_request_connection_errors_total',
+                'API requests that failed to connect.',
+                query_labels)
+        self.failed_queries = Counter(
+                'ratp_poll_failed_queries_total',
+                'Queries without answer after all the attempts.',
+                query_labels)
+        self.latency = Histogram(
+                'ratp_poll_request_duration_seconds',
+                'Duration of the API requests.',
+                query_labels)
+        self.in_flight = Gauge(
+                'ratp_poll_requests_in_flight',
+                'API requests waiting for an answer.',
+                ('transport_type',))
+        self.ticks = Counter(
+                'ratp_poll_ticks_total',
+                'Finished daemon ticks by outcome.',
+                ('outcome',))
+        self.tick_duration = Histogram(
+                'ratp_poll_tick_duration_seconds',
+                'Duration of the daemon ticks.',
+                buckets=TICK_BUCKETS)
+
+    def metrics(self):
+        """Get the registered metrics."""
+        return [self.requests, self.timeouts, self.connection_errors,
+                self.failed_queries, self.latency, self.in_flight,
+                self.ticks, self.tick_duration]
+
+    def exposition(self):
+        """Render the metrics in the Prometheus text format.
+
+        Returns:
+            str: The exposition.
+        """
+        lines = []
+        for metric in self.metrics():
+            lines.append('# HELP {} {}'.format(metric.name,
+                                               metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    def drain(self):
+        """Get the values recorded since the last drain and reset them, to
+        send them to the registry of another process.
+
+        The in-flight gauges are not drained, as they only make sense in the
+        process doing the requests.
+
+        Returns:
+            dict: Values by metric name.
+        """
+        snapshot = {}
+        for metric in self.metrics():
+            if (metric is self.in_flight):
+                continue
+            snapshot[metric.name] = metric.snapshot()
+            metric.reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add the values drained from another registry."""
+        for metric in self.metrics():
+            if (metric.name in snapshot):
+                metric.merge(snapshot[metric.name])
+
+    def write(self, path):
+        """Write the exposition to a file, replacing it atomically.
+
+        Arguments:
+            path (str): Path of the file.
+        """
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(self.exposition())
+        os.replace(tmp_path, path)
+
+
+def get_registry():
+    """Get the metrics registry of the current process, creating it if needed.
+
+    Returns:
+        Metrics: The registry.
+    """
+    global _registry, _registry_pid
+    if (_registry_pid != os.getpid()):
+        _registry = Metrics()
+        _registry_pid = os.getpid()
+    return _registry
+
+
+def get_metrics(fetch_conf):
+    """Get the metrics registry if enabled (`metrics` in fetch_conf).
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+
+    Returns:
+        Metrics: The registry, or None if the metrics are disabled.
+    """
+    if (not fetch_conf.get('metrics')):
+        return None
+    return get_registry()
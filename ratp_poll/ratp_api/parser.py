@@ -0,0 +1,124 @@
+"""Parser of the API answers to stop times rows."""
+import csv
+import io
+import logging
+
+try:
+    import orjson as _json
+    json_backend = 'orjson'
+except ImportError:
+    try:
+        import ujson as _json
+        json_backend = 'ujson'
+    except ImportError:
+        import json as _json
+        json_backend = 'json'
+
+logger = logging.getLogger()
+
+
+def loads(body):
+    """Decode a JSON document with the fastest available backend (orjson,
+    ujson or the standard json module).
+
+    Arguments:
+        body (bytes): JSON document (str is accepted too).
+
+    Returns:
+        object: The decoded document.
+    """
+    return _json.loads(body)
+
+
+def parse_response(body):
+    """Extract the stop times of an API answer.
+
+    Only `_metadata.date`, `_metadata.call` and the `message` and
+    `destination` of every schedule are read. Anything before the first `{`
+    is skipped, and so are the schedules whose fields are not strings.
+
+    Arguments:
+        body (bytes): API answer in JSON format (str is accepted too).
+
+    Returns:
+        list: Tuples (actual_date, query, remaining_minutes,
+            destination_stop), empty if the answer has no times.
+    """
+    if (not body):
+        logger.warning("Empty answer")
+        return []
+
+    if (body[:1] not in (b'{', '{')):
+        start = body.find(b'{' if isinstance(body, bytes) else '{')
+        if (start > 0):
+            body = body[start:]
+
+    try:
+        stop_json = loads(body)
+    except ValueError:
+        logger.warning("json error")
+        return []
+
+    try:
+        metadata = stop_json['_metadata']
+        date = metadata['date']
+        call = metadata['call']
+        schedules = stop_json['result']['schedules']
+    except (KeyError, TypeError):
+        logger.warning("Answer without times")
+        return []
+    if (not isinstance(schedules, list)):
+        logger.warning("Answer without times")
+        return []
+    if (not isinstance(date, str) or not isinstance(call, str)):
+        logger.warning("Answer with invalid metadata")
+        return []
+
+    rows = []
+    for schedule in schedules:
+        try:
+            message = schedule['message']
+            destination = schedule['destination']
+        except (KeyError, TypeError):
+            message = destination = None
+        if (not isinstance(message, str)
+                or not isinstance(destination, str)):
+            logger.warning("Skipped invalid schedule in " + call)
+            continue
+        rows.append((date, call, message.replace(' mn', ''), destination))
+    return rows
+
+
+class CSVFormatter:
+    """Format rows as CSV lines (without line terminator), quoting the fields
+    that need it with csv.writer.
+
+    Rows without special characters are joined directly, as csv.writer would
+    not quote any of their fields, and only the others go through it.
+    """
+
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator='\n')
+
+    def format_rows(self, rows):
+        """Format rows as CSV lines.
+
+        Arguments:
+            rows (list): Rows as tuples of str fields.
+
+        Returns:
+            list: CSV lines.
+        """
+        lines = []
+        for row in rows:
+            line = ','.join(row)
+            if (line.count(',') == len(row) - 1 and '"' not in line and
+                    '\n' not in line and '\r' not in line):
+                lines.append(line)
+                continue
+            self._buffer.seek(0)
+            self._buffer.truncate()
+            self._writer.writerow(row)
+            lines.append(self._buffer.getvalue()[:-1])
+        return lines
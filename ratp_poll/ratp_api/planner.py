@@ -0,0 +1,298 @@
+"""Planning of the requests of a stops file.
+
+A row of a stops file can ask for every station of a line with `*` as its
+station name (e.g. `buses,187,*,A+R`). Those rows are expanded from a
+catalogue of the stations of every line, requested once to the stations
+endpoint of the API and cached in a JSON file until its time to live
+expires. The stations are named by their slug, the station segment of the
+schedules endpoint. The planned queries are deduplicated again after the
+expansion and, if asked to, the `A` and `R` queries of a line at a station
+are merged into a single `A+R` one, whose answer has the schedules of both
+ways, so a tick makes as few requests as possible.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import urllib.parse
+
+from ratp_poll.ratp_api import API_URL
+from ratp_poll.ratp_api import parser
+from ratp_poll.ratp_api import query_index
+
+logger = logging.getLogger()
+
+# Station name of the rows asking for every station of the line
+ALL_STATIONS = '*'
+# Way of the queries of both ways of a line
+MERGED_WAY = 'A+R'
+CATALOGUE_EXTENSION = '.stations.json'
+CATALOGUE_VERSION = 2
+# Default seconds the stations of a line are cached
+CATALOGUE_TTL = 24 * 3600
+
+
+class CatalogueError(ValueError):
+    """Stations of a line neither cached nor available from the API."""
+
+
+def stations_url(api_url, transport_type, line_code):
+    """Get the URL of the stations of a line from the base URL of the
+    schedules API.
+
+    Arguments:
+        api_url (str): Base URL of the schedules API (ending in
+            `schedules/`).
+        transport_type (str): The transport type.
+        line_code (str): The line code.
+
+    Returns:
+        str: The quoted URL.
+    """
+    base = api_url.rstrip('/').rpartition('/')[0]
+    return '{}/stations/{}'.format(base, urllib.parse.quote(
+            '{}/{}'.format(transport_type, line_code)))
+
+
+def parse_stations(body):
+    """Extract the station names of an answer of the stations endpoint.
+
+    Arguments:
+        body (bytes): API answer in JSON format.
+
+    Returns:
+        list: The slugs of the stations (their name if they have none), or
+            None if the answer has no stations.
+    """
+    try:
+        stations = parser.loads(body)['result']['stations']
+        return [station.get('slug') or station['name']
+                for station in stations]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+class StationCatalogue:
+    """Stations of the lines, cached in a JSON file.
+
+    Arguments:
+        path (str): Path of the catalogue file, created if needed.
+        ttl (float): Seconds the stations of a line are fresh.
+    """
+
+    def __init__(self, path, ttl=CATALOGUE_TTL):
+        self.path = path
+        self.ttl = ttl
+        # Station names and time.time() of their request by line key
+        self.lines = {}
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+            if (cached['version'] == CATALOGUE_VERSION):
+                self.lines = cached['lines']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    @staticmethod
+    def key(transport_type, line_code):
+        """Get the key of a line in the catalogue."""
+        return transport_type + '/' + line_code
+
+    def stations(self, transport_type, line_code):
+        """Get the cached stations of a line, even if stale.
+
+        Returns:
+            list: The station names, or None if not cached.
+        """
+        entry = self.lines.get(self.key(transport_type, line_code))
+        return None if entry is None else entry['stations']
+
+    def stale(self, lines, now=None):
+        """Get the lines whose stations are not cached or expired.
+
+        Arguments:
+            lines (iterable): Tuples (transport_type, line_code).
+            now (float): Current time.time() (optional).
+
+        Returns:
+            list: The stale lines.
+        """
+        now = time.time() if now is None else now
+        stale = []
+        for line in lines:
+            entry = self.lines.get(self.key(*line))
+            if (entry is None or entry['fetched'] + self.ttl <= now):
+                stale.append(line)
+        return stale
+
+    def update(self, transport_type, line_code, stations, now=None):
+        """Cache the stations of a line."""
+        self.lines[self.key(transport_type, line_code)] = {
+            'fetched': time.time() if now is None else now,
+            'stations': stations,
+        }
+
+    def save(self):
+        """Write the catalogue, replacing the file atomically.
+
+        Failing to write it (e.g. a read-only directory) is only logged.
+        """
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': CATALOGUE_VERSION,
+                           'lines': self.lines}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Can not save the station catalogue: " + str(e))
+
+
+async def fetch_stations(lines, fetch_conf):
+    """Request the stations of several lines at once.
+
+    Arguments:
+        lines (list): Tuples (transport_type, line_code).
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+
+    Returns:
+        list: The station names of every line, None for the failed ones.
+    """
+    from aiohttp import ClientError
+    from ratp_poll.ratp_api import stop_times
+
+    api_url = fetch_conf.get('api_url', API_URL)
+
+    async def fetch_line(session, transport_type, line_code):
+        url = stations_url(api_url, transport_type, line_code)
+        try:
+            async with session.get(url) as response:
+                body = await response.read()
+                if (response.status != 200):
+                    logger.warning("Stations of %s answered %s", url,
+                                   response.status)
+                    return None
+        except (asyncio.TimeoutError, ClientError, OSError) as e:
+            logger.warning("Can not get the stations of %s: %r", url, e)
+            return None
+        stations = parse_stations(body)
+        if (stations is None):
+            logger.warning("Answer without stations from " + url)
+        return stations
+
+    async with stop_times.create_session(fetch_conf) as session:
+        return await asyncio.gather(*(fetch_line(session, *line)
+                                      for line in lines))
+
+
+def refresh_catalogue(catalogue, lines, fetch_conf):
+    """Request the stale stations of some lines and save the catalogue.
+
+    A line that can not be requested keeps its stale stations, if any.
+
+    Arguments:
+        catalogue (StationCatalogue): The catalogue.
+        lines (iterable): Tuples (transport_type, line_code) needed.
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+
+    Raises:
+        CatalogueError: If some lines have no stations at all.
+    """
+    stale = catalogue.stale(lines)
+    if (not stale):
+        return
+    logger.info("Requesting the stations of " + str(len(stale)) + " lines")
+    # Own loop, so the one of the batch is left as it was
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(fetch_stations(stale, fetch_conf))
+    finally:
+        loop.close()
+    missing = []
+    for line, stations in zip(stale, results):
+        if (stations is not None):
+            catalogue.update(*line, stations)
+        elif (catalogue.stations(*line) is None):
+            missing.append(catalogue.key(*line))
+        else:
+            logger.warning("Using the stale stations of " + catalogue.key(
+                    *line))
+    catalogue.save()
+    if (missing):
+        raise CatalogueError('No stations for the lines: '
+                             + ', '.join(missing))
+
+
+def merge_ways(queries):
+    """Merge the `A` and `R` queries of a line at a station into an `A+R`
+    one, dropping the ones an `A+R` query already covers.
+
+    The merged query takes the place of the first one, with the shortest
+    interval of the merged ones.
+
+    Arguments:
+        queries (list): Deduplicated query_index.Query.
+
+    Returns:
+        list: The queries.
+    """
+    groups = {}
+    for query in queries:
+        groups.setdefault(query[:3], []).append(query)
+    planned = []
+    for query in queries:
+        group = groups.pop(query[:3], None)
+        if (group is None):
+            continue
+        if (len(group) == 1):
+            planned.append(query)
+            continue
+        intervals = [query.interval for query in group
+                     if query.interval is not None]
+        planned.append(query_index.Query(
+                *query[:3], MERGED_WAY,
+                interval=min(intervals) if intervals else None))
+    return planned
+
+
+def plan_queries(queries, catalogue=None, fetch_conf=None, merge=False):
+    """Expand, deduplicate and optionally merge the queries of a stops file.
+
+    Arguments:
+        queries (list): query_index.Query loaded from the stops file, some
+            with ALL_STATIONS as their station name.
+        catalogue (StationCatalogue): Catalogue of the stations, refreshed
+            as needed (only needed with ALL_STATIONS queries).
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the stations.
+        merge (bool): Merge the ways of a line at a station (see
+            merge_ways).
+
+    Returns:
+        list: The planned queries.
+
+    Raises:
+        CatalogueError: If the stations of some lines are not available.
+    """
+    lines = {query[:2]: None for query in queries
+             if query.station_name == ALL_STATIONS}
+    if (lines):
+        refresh_catalogue(catalogue, lines, fetch_conf)
+    planned = {}
+    for query in queries:
+        if (query.station_name != ALL_STATIONS):
+            planned.setdefault(query, query)
+            continue
+        for station_name in catalogue.stations(*query[:2]):
+            expanded = query_index.Query(
+                    query.transport_type, query.line_code, station_name,
+                    query.way, interval=query.interval)
+            planned.setdefault(expanded, expanded)
+    planned = list(planned)
+    if (merge):
+        planned = merge_ways(planned)
+    logger.info("Planned " + str(len(planned)) + " requests from "
+                + str(len(queries)) + " queries")
+    return planned
@@ -0,0 +1,201 @@
+"""Timing breakdown of the ticks and batches.
+
+With `profile` set in fetch_conf, the phases of a tick (or of a batch run
+outside the daemon) are timed with time.perf_counter spans: waiting for the
+rate and concurrency limiters, the requests until the answer headers
+(broken down into connection queue, DNS, connect and request by an aiohttp
+TraceConfig), the body reads, the retry backoffs, the fetch log, the parsing
+and the output. The TickProfile of the tick travels in its fetch_conf
+(`tick_profile`), and its report is logged when the tick ends.
+
+With `profile_dir` set too, every tick runs under cProfile and its stats are
+dumped there (see tick_profiler).
+"""
+import contextlib
+import cProfile
+import datetime
+import logging
+import os
+import time
+
+logger = logging.getLogger()
+
+# Phases timed by the aiohttp TraceConfig, with their start and end signals
+TRACE_PHASES = (
+    ('connection_queue', 'on_connection_queued_start',
+     'on_connection_queued_end'),
+    ('dns', 'on_dns_resolvehost_start', 'on_dns_resolvehost_end'),
+    ('connect', 'on_connection_create_start', 'on_connection_create_end'),
+    ('request', 'on_request_start', 'on_request_end'),
+)
+
+_null_span = contextlib.nullcontext()
+# cProfile profiler of the current tick, there can only be one per thread
+_active_profiler = None
+
+
+class TickProfile:
+    """Spans of the phases of a tick."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # Count, total and maximum seconds by phase
+        self.phases = {}
+
+    def add(self, phase, seconds):
+        """Record a span.
+
+        Arguments:
+            phase (str): The phase.
+            seconds (float): Duration of the span.
+        """
+        stats = self.phases.get(phase)
+        if (stats is None):
+            self.phases[phase] = [1, seconds, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            if (seconds > stats[2]):
+                stats[2] = seconds
+
+    @contextlib.contextmanager
+    def span(self, phase):
+        """Context manager recording a span of its body."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - started)
+
+    def report(self):
+        """Summarize the phases by decreasing total time. The spans of the
+        concurrent requests overlap, so their totals can exceed the elapsed
+        time.
+
+        Returns:
+            str: One line per phase, with the count of spans and their total,
+                mean and maximum time.
+        """
+        elapsed = time.perf_counter() - self.started
+        lines = ['elapsed: {:.3f} s'.format(elapsed)]
+        for phase, (count, total, maximum) in sorted(
+                self.phases.items(), key=lambda item: -item[1][1]):
+            lines.append('{}: {} spans, total {:.3f} s, mean {:.2f} ms, max '
+                         '{:.2f} ms'.format(phase, count, total,
+                                            total / count * 1000,
+                                            maximum * 1000))
+        return '\n'.join(lines)
+
+
+def start_profile(fetch_conf):
+    """Start the profile of a tick or batch if the profiling is enabled
+    (`profile` in fetch_conf) and it is not part of a profiled tick.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+
+    Returns:
+        dict: fetch_conf, or a copy of it with the new profile.
+        TickProfile: The new profile, to be reported by the caller, or None.
+    """
+    if (not fetch_conf.get('profile')
+            or fetch_conf.get('tick_profile') is not None):
+        return fetch_conf, None
+    profile = TickProfile()
+    return dict(fetch_conf, tick_profile=profile), profile
+
+
+def log_report(profile, name='tick'):
+    """Log the report of a profile started with start_profile, if any.
+
+    Arguments:
+        profile (TickProfile): The profile, or None.
+        name (str): What was profiled.
+    """
+    if (profile is not None):
+        logger.info("Profile of the " + name + ":\n" + profile.report())
+
+
+def span(fetch_conf, phase):
+    """Get a context manager recording a span of its body in the profile of
+    the tick, doing nothing if it is not profiled.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+        phase (str): The phase.
+
+    Returns:
+        object: The context manager.
+    """
+    profile = fetch_conf.get('tick_profile')
+    if (profile is None):
+        return _null_span
+    return profile.span(phase)
+
+
+def trace_config():
+    """Create an aiohttp TraceConfig recording the TRACE_PHASES spans of the
+    requests in the TickProfile passed as their `trace_request_ctx`.
+
+    Returns:
+        TraceConfig: The trace configuration of a ClientSession.
+    """
+    from aiohttp import TraceConfig
+
+    config = TraceConfig()
+    for phase, start_signal, end_signal in TRACE_PHASES:
+        add_trace_phase(config, phase, start_signal, end_signal)
+    return config
+
+
+def add_trace_phase(config, phase, start_signal, end_signal):
+    """Time a phase of the requests between two signals of a TraceConfig."""
+
+    async def on_start(session, context, params):
+        setattr(context, phase, time.perf_counter())
+
+    async def on_end(session, context, params):
+        profile = context.trace_request_ctx
+        started = getattr(context, phase, None)
+        if (profile is not None and started is not None):
+            profile.add(phase, time.perf_counter() - started)
+
+    getattr(config, start_signal).append(on_start)
+    getattr(config, end_signal).append(on_end)
+
+
+@contextlib.contextmanager
+def tick_profiler(fetch_conf):
+    """Context manager running its body under cProfile if `profile_dir` is
+    set in fetch_conf, dumping the stats to `tick-<time>-<pid>.prof` in that
+    directory. They can be read with pstats or converted to a flame graph
+    (e.g. with flameprof).
+
+    The profiler of a tick of the persistent daemon also sees the other
+    ticks running in the event loop meanwhile, and a tick starting while
+    another one is profiled is not.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+    """
+    global _active_profiler
+    profile_dir = fetch_conf.get('profile_dir')
+    if (not profile_dir or _active_profiler is not None):
+        yield
+        return
+    profiler = _active_profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _active_profiler = None
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, 'tick-{}-{}.prof'.format(
+                datetime.datetime.now().strftime('%Y%m%dT%H%M%S.%f'),
+                os.getpid()))
+        profiler.dump_stats(path)
+        logger.info("Dumped the tick profile to " + path)
@@ -0,0 +1,235 @@
+"""Validated queries of a stops file, with their encoded URL path.
+
+The stops file is validated and deduplicated once, when loaded, and the URL
+path of every query is quoted then, instead of at every fetch. The loaded
+queries can be cached in a JSON file next to the stops file, keyed by its
+modification time and size.
+"""
+import csv
+import json
+import logging
+import os
+import sys
+import urllib.parse
+
+logger = logging.getLogger()
+
+TRANSPORT_TYPES = frozenset(('metros', 'rers', 'tramways', 'buses',
+                             'noctiliens'))
+WAYS = frozenset(('A', 'R', 'A+R'))
+CACHE_EXTENSION = '.queries.json'
+CACHE_VERSION = 1
+
+
+class StopsFileError(ValueError):
+    """Invalid rows in a stops file."""
+
+
+def quote_path(transport_type, line_code, station_name, way):
+    """Get the quoted URL path of a query, relative to the API URL."""
+    return urllib.parse.quote('{}/{}/{}/{}'.format(transport_type, line_code,
+                                                   station_name, way))
+
+
+class Query:
+    """Query of the stop times of a line at a station in a way.
+
+    It behaves as the tuple (transport_type, line_code, station_name, way):
+    it can be unpacked, indexed, sliced and compared with or used in place
+    of it as a dictionary key.
+
+    Arguments:
+        transport_type (str): The transport type (metros, rers, tramways,
+            buses or noctiliens).
+        line_code (str): The line code (e.g. '187').
+        station_name (str): The name of the station.
+        way (str): Way of the line ('A', 'R' or 'A+R').
+        interval (float): Polling interval in seconds (optional).
+        path (str): Quoted URL path, computed if not given.
+    """
+
+    __slots__ = ('transport_type', 'line_code', 'station_name', 'way',
+                 'interval', 'path')
+
+    def __init__(self, transport_type, line_code, station_name, way,
+                 interval=None, path=None):
+        self.transport_type = sys.intern(transport_type)
+        self.line_code = sys.intern(line_code)
+        self.station_name = station_name
+        self.way = sys.intern(way)
+        self.interval = interval
+        if (path is None):
+            path = quote_path(transport_type, line_code, station_name, way)
+        self.path = path
+
+    def as_tuple(self):
+        """Get the query as a tuple."""
+        return (self.transport_type, self.line_code, self.station_name,
+                self.way)
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __len__(self):
+        return 4
+
+    def __getitem__(self, index):
+        return self.as_tuple()[index]
+
+    def __eq__(self, other):
+        if (isinstance(other, (Query, tuple))):
+            return self.as_tuple() == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.as_tuple())
+
+    def __lt__(self, other):
+        return self.as_tuple() < tuple(other)
+
+    def __repr__(self):
+        return repr(self.as_tuple())
+
+    def __getstate__(self):
+        return (self.as_tuple(), self.interval, self.path)
+
+    def __setstate__(self, state):
+        fields, interval, path = state
+        self.__init__(*fields, interval=interval, path=path)
+
+
+def validate_row(row):
+    """Check a row of a stops file.
+
+    Arguments:
+        row (list): Fields of the row: transport_type, line_code,
+            station_name, way and optionally the interval.
+
+    Returns:
+        str: The problem, or None if valid.
+    """
+    if (len(row) not in (4, 5)):
+        return 'expected 4 or 5 fields, got ' + str(len(row))
+    transport_type, line_code, station_name, way = row[:4]
+    if (transport_type not in TRANSPORT_TYPES):
+        return 'unknown transport type ' + repr(transport_type)
+    if (not line_code or not station_name):
+        return 'empty line code or station name'
+    if (way not in WAYS):
+        return 'unknown way ' + repr(way)
+    if (len(row) == 5 and row[4].strip()):
+        try:
+            if (float(row[4]) <= 0):
+                return 'interval must be positive'
+        except ValueError:
+            return 'invalid interval ' + repr(row[4])
+    return None
+
+
+def parse_rows(rows, source='stops file'):
+    """Validate and deduplicate the rows of a stops file.
+
+    Empty lines are skipped. Duplicated queries keep their first row.
+
+    Arguments:
+        rows (iterable): Lists of fields.
+        source (str): Name of the file, for the messages.
+
+    Returns:
+        list: The queries.
+
+    Raises:
+        StopsFileError: If some rows are invalid.
+    """
+    queries = {}
+    errors = []
+    duplicates = 0
+    for line, row in enumerate(rows, 1):
+        if (not row):
+            continue
+        problem = validate_row(row)
+        if (problem):
+            errors.append('{}:{}: {}'.format(source, line, problem))
+            continue
+        interval = float(row[4]) if len(row) == 5 and row[4].strip() \
+            else None
+        query = Query(*row[:4], interval=interval)
+        if (query in queries):
+            duplicates += 1
+            continue
+        queries[query] = query
+    if (errors):
+        raise StopsFileError('\n'.join(errors))
+    if (duplicates):
+        logger.warning("Skipped " + str(duplicates) + " duplicated queries in "
+                       + source)
+    return list(queries)
+
+
+def cache_key(stops_file):
+    """Get the modification time and size of a stops file."""
+    stat = os.stat(stops_file)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def read_cache(stops_file):
+    """Read the cached queries of a stops file, if still valid.
+
+    Returns:
+        list: The queries, or None.
+    """
+    try:
+        with open(stops_file + CACHE_EXTENSION) as f:
+            cached = json.load(f)
+        if (cached['version'] != CACHE_VERSION
+                or cached['key'] != cache_key(stops_file)):
+            return None
+        return [Query(*fields) for fields in cached['queries']]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def write_cache(stops_file, queries):
+    """Cache the queries of a stops file, replacing the file atomically.
+
+    Failing to write it (e.g. a read-only directory) is only logged.
+    """
+    path = stops_file + CACHE_EXTENSION
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': CACHE_VERSION,
+                       'key': cache_key(stops_file),
+                       'queries': [query.as_tuple()
+                                   + (query.interval, query.path)
+                                   for query in queries]}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Can not cache the queries: " + str(e))
+
+
+def load_queries(stops_file, cache=False):
+    """Load the validated and deduplicated queries of a stops file.
+
+    Arguments:
+        stops_file (str): Path to the file containing the queries in CSV
+            format. The column order is: `transport_type, line_code,
+            station_name, way[, interval]`.
+        cache (bool): Use (and update) the cached queries next to the file.
+
+    Returns:
+        list: The queries, in file order.
+
+    Raises:
+        StopsFileError: If some rows are invalid.
+    """
+    if (cache):
+        queries = read_cache(stops_file)
+        if (queries is not None):
+            logger.debug("Loaded cached queries of " + stops_file)
+            return queries
+    with open(stops_file, newline='') as f:
+        queries = parse_rows(csv.reader(f), stops_file)
+    if (cache):
+        write_cache(stops_file, queries)
+    return queries
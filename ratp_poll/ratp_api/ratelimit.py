@@ -0,0 +1,188 @@
+"""Requests per second limit of the API requests, shared by every process of
+the daemon.
+
+The limit is a token bucket per key (`global` and every limited transport
+type) whose state lives in a small file, so the worker processes of the
+daemon draw from the same buckets. Every request reserves a token of its
+buckets in a single locked read-modify-write of the file, letting the balance
+go negative, and then sleeps until the reserved token is due. The requests
+are so spread evenly instead of bursting when the tokens are refilled. A
+reservation due after the deadline of its batch is refused without taking
+the tokens, so the debt of the buckets is bounded by their rate times the
+time budget and does not carry over to the next batches.
+"""
+import asyncio
+import atexit
+import logging
+import os
+import struct
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+    from filelock import FileLock
+
+logger = logging.getLogger()
+
+GLOBAL_KEY = 'global'
+# Bucket state: tokens and time of the last update (time.monotonic)
+SLOT = struct.Struct('<dd')
+
+# Limiters of the current process by state file
+_limiters = {}
+_limiters_pid = None
+
+
+class SharedTokenBucket:
+    """Token buckets stored in a file shared by several processes.
+
+    Arguments:
+        path (str): Path of the state file, created if needed.
+        rates (dict): Requests per second by key.
+        burst (float): Capacity of the buckets in seconds of their rate
+            (at least one token).
+    """
+
+    def __init__(self, path, rates, burst=1.0):
+        self.path = path
+        self.keys = sorted(rates)
+        self.slots = {key: i for i, key in enumerate(self.keys)}
+        self.rates = [float(rates[key]) for key in self.keys]
+        self.capacities = [max(1.0, rate * burst) for rate in self.rates]
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT
+                           | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+        if (fcntl is None):
+            self._file_lock = FileLock(path + '.lock')
+
+    def _lock(self):
+        if (fcntl is None):
+            self._file_lock.acquire()
+        else:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        if (fcntl is None):
+            self._file_lock.release()
+        else:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def reserve(self, keys, now=None, max_wait=None):
+        """Reserve a token of every given bucket.
+
+        Arguments:
+            keys (list): Keys of the buckets. Unknown ones are ignored.
+            now (float): Current time.monotonic() (optional).
+            max_wait (float): Refuse the reservation, leaving the buckets as
+                they were, if its tokens are due later (optional).
+
+        Returns:
+            float: Seconds to wait until the reserved tokens are due, or None
+                if refused.
+        """
+        slots = [self.slots[key] for key in keys if key in self.slots]
+        if (not slots):
+            return 0.0
+        size = SLOT.size * len(self.keys)
+        self._lock()
+        try:
+            now = time.monotonic() if now is None else now
+            data = os.pread(self._fd, size, 0)
+            if (len(data) < size):
+                # New (or reconfigured) file: full buckets
+                data = b''.join(SLOT.pack(capacity, now)
+                                for capacity in self.capacities)
+            state = bytearray(data)
+            wait = 0.0
+            for slot in slots:
+                tokens, last = SLOT.unpack_from(state, slot * SLOT.size)
+                rate = self.rates[slot]
+                tokens = min(self.capacities[slot],
+                             tokens + max(0.0, now - last) * rate) - 1
+                SLOT.pack_into(state, slot * SLOT.size, tokens, now)
+                if (tokens < 0):
+                    wait = max(wait, -tokens / rate)
+            if (max_wait is not None and wait > max_wait):
+                return None
+            os.pwrite(self._fd, bytes(state), 0)
+        finally:
+            self._unlock()
+        return wait
+
+    async def acquire(self, transport_type, max_wait=None):
+        """Wait for a token of the global bucket and the one of the transport
+        type.
+
+        Arguments:
+            transport_type (str): Transport type of the request.
+            max_wait (float): Maximum seconds to wait (optional).
+
+        Returns:
+            bool: Whether the tokens were taken, False if they are due after
+                max_wait.
+        """
+        wait = self.reserve((GLOBAL_KEY, transport_type), max_wait=max_wait)
+        if (wait is None):
+            return False
+        if (wait > 0):
+            logger.debug("Rate limited for %.3f s", wait)
+            await asyncio.sleep(wait)
+        return True
+
+    def close(self):
+        """Close the state file."""
+        os.close(self._fd)
+
+
+def default_state_file():
+    """Get a state file for the processes started by the current one, in a
+    private temporary directory removed at exit.
+
+    Returns:
+        str: The path.
+    """
+    directory = tempfile.mkdtemp(prefix='ratp_poll_')
+    path = os.path.join(directory, 'rate_limit')
+    pid = os.getpid()
+
+    def remove():
+        if (os.getpid() == pid):
+            if (os.path.exists(path)):
+                os.remove(path)
+            os.rmdir(directory)
+
+    atexit.register(remove)
+    return path
+
+
+def get_rate_limiter(fetch_conf):
+    """Get the rate limiter of the current process if enabled (`rate_limit` or
+    `type_rate_limits` in fetch_conf), creating it if needed.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content. `rate_limit_file` is the shared state file
+            (one for the current process if not set) and `rate_burst` the
+            capacity of the buckets in seconds.
+
+    Returns:
+        SharedTokenBucket: The limiter, or None if disabled.
+    """
+    global _limiters, _limiters_pid
+    rates = dict(fetch_conf.get('type_rate_limits') or {})
+    if (fetch_conf.get('rate_limit')):
+        rates[GLOBAL_KEY] = fetch_conf['rate_limit']
+    if (not rates):
+        return None
+    if (_limiters_pid != os.getpid()):
+        _limiters = {}
+        _limiters_pid = os.getpid()
+    key = fetch_conf.get('rate_limit_file')
+    limiter = _limiters.get(key)
+    if (limiter is None):
+        limiter = SharedTokenBucket(key or default_state_file(), rates,
+                                    fetch_conf.get('rate_burst', 1.0))
+        _limiters[key] = limiter
+    return limiter
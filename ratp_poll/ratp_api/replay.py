@@ -0,0 +1,309 @@
+"""Record and replay of the API answers, to run the fetching code offline.
+
+With `record_file` set in fetch_conf, every request is appended to a corpus
+file: its query, URL path, start time, latency and status (or whether it
+timed out or failed to connect) and its zlib compressed body. Every record is
+written with a single append, so the processes of the daemon can record to
+the same corpus without a lock.
+
+With `replay_file` set, the session is a ReplaySession serving the corpus
+instead of the API: every request of a URL path gets its next record, in
+recording order and starting over at the end, after its recorded latency
+divided by `replay_speed`. The corpus is indexed once per process when it is
+opened, reading only the headers of the records.
+"""
+import asyncio
+import logging
+import os
+import struct
+import urllib.parse
+import zlib
+
+logger = logging.getLogger()
+
+# Record header: start time (time.time), latency in seconds, status, and the
+# lengths of the query, the URL path and the compressed body
+HEADER = struct.Struct('<ddHHHI')
+# Statuses of the requests without answer
+TIMEOUT_STATUS = 0
+CONNECTION_ERROR_STATUS = 1
+# Separator of the query fields
+QUERY_SEPARATOR = '\x1f'
+
+# Recorders and corpora of the current process by path
+_recorders = {}
+_recorders_pid = None
+_corpora = {}
+_corpora_pid = None
+
+
+def url_path(url):
+    """Get the path of a URL, the key of its records."""
+    return urllib.parse.urlsplit(url).path
+
+
+class Recorder:
+    """Appender of records to a corpus file.
+
+    Arguments:
+        path (str): Path of the corpus file, created if needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                           0o644)
+
+    def record(self, url, query, started, latency, status, body=b''):
+        """Append a record.
+
+        Arguments:
+            url (str): The requested URL.
+            query (tuple): Tuple with the query details (transport_type,
+                line_code, station_name, way).
+            started (float): time.time() when the request started.
+            latency (float): Seconds until the answer or the error.
+            status (int): Answer status, TIMEOUT_STATUS or
+                CONNECTION_ERROR_STATUS.
+            body (bytes): Answer body.
+        """
+        query_bytes = QUERY_SEPARATOR.join(query).encode('utf-8')
+        path_bytes = url_path(url).encode('utf-8')
+        compressed = zlib.compress(body)
+        os.write(self._fd, b''.join((
+                HEADER.pack(started, latency, status, len(query_bytes),
+                            len(path_bytes), len(compressed)),
+                query_bytes, path_bytes, compressed)))
+
+    def close(self):
+        """Close the corpus file."""
+        os.close(self._fd)
+
+
+def get_recorder(fetch_conf):
+    """Get the recorder of the current process if the record is enabled
+    (`record_file` in fetch_conf), creating it if needed.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+
+    Returns:
+        Recorder: The recorder, or None if disabled.
+    """
+    global _recorders, _recorders_pid
+    path = fetch_conf.get('record_file')
+    if (not path):
+        return None
+    if (_recorders_pid != os.getpid()):
+        _recorders = {}
+        _recorders_pid = os.getpid()
+    recorder = _recorders.get(path)
+    if (recorder is None):
+        recorder = _recorders[path] = Recorder(path)
+    return recorder
+
+
+class ReplayRecord:
+    """Record of a corpus, without its body."""
+
+    __slots__ = ('query', 'started', 'latency', 'status', 'offset', 'length')
+
+    def __init__(self, query, started, latency, status, offset, length):
+        self.query = query
+        self.started = started
+        self.latency = latency
+        self.status = status
+        # Position and length of the compressed body in the corpus file
+        self.offset = offset
+        self.length = length
+
+
+class Corpus:
+    """Index of the records of a corpus file by URL path.
+
+    Arguments:
+        path (str): Path of the corpus file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self._fd = os.open(path, os.O_RDONLY)
+        size = os.fstat(self._fd).st_size
+        offset = 0
+        while (offset + HEADER.size <= size):
+            (started, latency, status, query_length, path_length,
+             body_length) = HEADER.unpack(os.pread(self._fd, HEADER.size,
+                                                   offset))
+            offset += HEADER.size
+            end = offset + query_length + path_length + body_length
+            if (end > size):
+                logger.warning("Truncated record in %s", path)
+                break
+            keys = os.pread(self._fd, query_length + path_length, offset)
+            query = tuple(keys[:query_length].decode('utf-8').split(
+                    QUERY_SEPARATOR))
+            self.records.setdefault(
+                    keys[query_length:].decode('utf-8'), []).append(
+                    ReplayRecord(query, started, latency, status,
+                                 end - body_length, body_length))
+            offset = end
+
+    def __len__(self):
+        return sum(len(records) for records in self.records.values())
+
+    def queries(self):
+        """Get the recorded queries.
+
+        Returns:
+            list: Tuples with the query details, in URL path order.
+        """
+        return [records[0].query for url_path, records
+                in sorted(self.records.items())]
+
+    def body(self, record):
+        """Read the body of a record.
+
+        Arguments:
+            record (ReplayRecord): The record.
+
+        Returns:
+            bytes: The answer body.
+        """
+        return zlib.decompress(os.pread(self._fd, record.length,
+                                        record.offset))
+
+    def close(self):
+        """Close the corpus file."""
+        os.close(self._fd)
+
+
+def get_corpus(path):
+    """Get the corpus of the current process read from a file, indexing it if
+    needed.
+
+    Arguments:
+        path (str): Path of the corpus file.
+
+    Returns:
+        Corpus: The corpus.
+    """
+    global _corpora, _corpora_pid
+    if (_corpora_pid != os.getpid()):
+        _corpora = {}
+        _corpora_pid = os.getpid()
+    corpus = _corpora.get(path)
+    if (corpus is None):
+        corpus = _corpora[path] = Corpus(path)
+    return corpus
+
+
+class ReplayResponse:
+    """Recorded answer with the part of the aiohttp ClientResponse interface
+    used by stop_times.
+    """
+
+    def __init__(self, status, body):
+        self.status = status
+        self.headers = {}
+        self._body = body
+
+    async def read(self):
+        """Get the body."""
+        return self._body
+
+
+class ReplayRequest:
+    """Asynchronous context manager replaying the next record of a URL path
+    after its scaled latency. A recorded timeout raises asyncio.TimeoutError
+    and a recorded connection error ConnectionError, like a URL path without
+    records.
+    """
+
+    def __init__(self, session, url, timeout):
+        self._session = session
+        self._url = url
+        self._timeout = timeout
+
+    async def __aenter__(self):
+        session = self._session
+        record = session.next_record(url_path(self._url))
+        if (record is None):
+            raise ConnectionError('No record of ' + self._url)
+        delay = record.latency / session.speed if session.speed else 0
+        if (self._timeout is not None and delay > self._timeout):
+            await asyncio.sleep(self._timeout)
+            raise asyncio.TimeoutError()
+        if (delay > 0):
+            await asyncio.sleep(delay)
+        if (record.status == TIMEOUT_STATUS):
+            raise asyncio.TimeoutError()
+        if (record.status == CONNECTION_ERROR_STATUS):
+            raise ConnectionError('Recorded connection error')
+        return ReplayResponse(record.status, session.corpus.body(record))
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class ReplaySession:
+    """Session serving a recorded corpus, with the part of the aiohttp
+    ClientSession interface used by stop_times.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content. `replay_file` is the corpus and
+            `replay_speed` divides the recorded latencies (0 to answer
+            immediately).
+    """
+
+    def __init__(self, fetch_conf):
+        self.corpus = get_corpus(fetch_conf['replay_file'])
+        self.speed = fetch_conf.get('replay_speed', 1.0)
+        self.total_timeout = fetch_conf['timeout']
+        # Index of the next record by URL path
+        self._positions = {}
+
+    def next_record(self, path):
+        """Take the next record of a URL path, starting over at the end.
+
+        Arguments:
+            path (str): The URL path.
+
+        Returns:
+            ReplayRecord: The record, or None if the path has no records.
+        """
+        records = self.corpus.records.get(path)
+        if (not records):
+            return None
+        position = self._positions.get(path, 0)
+        self._positions[path] = (position + 1) % len(records)
+        return records[position]
+
+    def get(self, url, headers=None, timeout=None, trace_request_ctx=None):
+        """Send a GET request.
+
+        Arguments:
+            url (str): The URL.
+            headers (dict): Ignored, the records are not conditional.
+            timeout (ClientTimeout): Total timeout of the request, the one of
+                the session if not set.
+            trace_request_ctx (object): Ignored, the requests are not traced.
+
+        Returns:
+            ReplayRequest: Asynchronous context manager of the response.
+        """
+        total = self.total_timeout
+        if (timeout is not None and timeout.total is not None):
+            total = timeout.total
+        return ReplayRequest(self, url, total)
+
+    async def close(self):
+        """Nothing to close, the corpus is shared by the process."""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,89 @@
+"""Retry policy of the API requests: exponential backoff with full jitter,
+bounded by the deadline of the batch.
+
+The deadline is an absolute `time.monotonic()` value (`deadline` in
+fetch_conf), so it can be computed by the daemon and shared with the fetching
+processes. It is set from a budget in seconds (`budget` in fetch_conf) when a
+batch starts.
+"""
+import logging
+import random
+import time
+
+logger = logging.getLogger()
+
+# Answer statuses worth retrying
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+# Minimum time in seconds left before the deadline to start an attempt
+MIN_ATTEMPT_TIME = 0.5
+
+
+def start_deadline(fetch_conf):
+    """Set the deadline of a batch from its budget, if not set yet.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+
+    Returns:
+        dict: fetch_conf, or a copy of it with the deadline.
+    """
+    if (fetch_conf.get('deadline') is None and fetch_conf.get('budget')):
+        return dict(fetch_conf,
+                    deadline=time.monotonic() + fetch_conf['budget'])
+    return fetch_conf
+
+
+def remaining(fetch_conf):
+    """Get the seconds left before the deadline.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+
+    Returns:
+        float: The seconds left, or None without deadline.
+    """
+    deadline = fetch_conf.get('deadline')
+    if (deadline is None):
+        return None
+    return deadline - time.monotonic()
+
+
+def backoff_delay(attempt, fetch_conf):
+    """Draw the delay before a retry, with full jitter: a uniform value
+    between 0 and `backoff` * 2 ** attempt seconds, capped to `backoff_max`.
+
+    Arguments:
+        attempt (int): Number of the failed attempt, starting at 0.
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    ceiling = min(fetch_conf.get('backoff_max', 10.0),
+                  fetch_conf.get('backoff', 0.1) * 2 ** attempt)
+    return random.uniform(0, ceiling)
+
+
+def retry_delay(attempt, fetch_conf):
+    """Decide whether a failed attempt is retried.
+
+    Arguments:
+        attempt (int): Number of the failed attempt, starting at 0.
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+
+    Returns:
+        float: The delay before the retry in seconds, or None to give up
+            (no retries left or the deadline is too close).
+    """
+    if (attempt >= fetch_conf.get('retries', 0)):
+        return None
+    delay = backoff_delay(attempt, fetch_conf)
+    time_left = remaining(fetch_conf)
+    if (time_left is not None and time_left - delay < MIN_ATTEMPT_TIME):
+        logger.debug("No time left to retry")
+        return None
+    return delay
@@ -0,0 +1,220 @@
+"""Fetching of a batch of queries split among several processes."""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import logging
+import os
+
+from ratp_poll.ratp_api import metrics as fetch_metrics
+from ratp_poll.ratp_api import stop_times
+
+logger = logging.getLogger()
+
+# Executor of the current process, reused between batches.
+_executor = None
+_executor_key = None
+# Event loop of a worker process and its sessions by max_connections, kept
+# open between the shards it fetches.
+_worker_loop = None
+_worker_loop_pid = None
+_worker_sessions = {}
+
+
+def get_executor(shards):
+    """Get the process pool fetching the shards, creating it if needed.
+
+    Arguments:
+        shards (int): Number of worker processes.
+
+    Returns:
+        ProcessPoolExecutor: The executor.
+    """
+    global _executor, _executor_key
+    key = (os.getpid(), shards)
+    if (_executor_key != key):
+        _executor = ProcessPoolExecutor(max_workers=shards)
+        _executor_key = key
+    return _executor
+
+
+def shutdown_executor():
+    """Stop the worker processes of the current process, if any."""
+    global _executor, _executor_key
+    if (_executor is not None and _executor_key[0] == os.getpid()):
+        _executor.shutdown()
+    _executor = None
+    _executor_key = None
+
+
+def get_worker_loop():
+    """Get the event loop of a worker process, creating it if needed.
+
+    A forked worker inherits the event loop of its parent, which can be
+    running (e.g. in the persistent daemon), so it always gets its own.
+
+    Returns:
+        AbstractEventLoop: The event loop.
+    """
+    global _worker_loop, _worker_loop_pid, _worker_sessions
+    if (_worker_loop_pid != os.getpid()):
+        _worker_loop = asyncio.new_event_loop()
+        _worker_loop_pid = os.getpid()
+        _worker_sessions = {}
+        asyncio.set_event_loop(_worker_loop)
+    return _worker_loop
+
+
+def shard_queries(queries, shards):
+    """Partition the queries in round-robin.
+
+    Arguments:
+        queries (list): List of tuples with the query details (transport_type,
+            line_code, station_name, way).
+        shards (int): Number of partitions.
+
+    Returns:
+        list: The non-empty partitions.
+    """
+    return [queries[i::shards] for i in range(shards) if queries[i::shards]]
+
+
+def fetch_shard(shard, queries, fetch_conf, parsed=False):
+    """Fetch a shard of queries in a worker process, with its own event loop
+    and a session kept open between shards.
+
+    Arguments:
+        shard (int): Index of the shard.
+        queries (list): List of tuples with the query details (transport_type,
+            line_code, station_name, way).
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+        parsed (bool): Parse the answers to CSV rows.
+
+    Returns:
+        int: Index of the shard.
+        list: API answers in JSON format, or parsed rows in CSV format.
+        float: Spent time in seconds.
+        dict: Metrics recorded while fetching the shard (see
+            Metrics.drain), or None if the metrics are disabled.
+    """
+    loop = get_worker_loop()
+    session = _worker_sessions.get(fetch_conf['max_connections'])
+    if (session is None):
+        session = stop_times.create_session(fetch_conf)
+        _worker_sessions[fetch_conf['max_connections']] = session
+    if (parsed):
+        batch = stop_times.get_stop_times_batch_parsed_async
+    else:
+        batch = stop_times.get_stop_times_batch_async
+    result, total_time = loop.run_until_complete(batch(queries, fetch_conf,
+                                                       session))
+    registry = fetch_metrics.get_metrics(fetch_conf)
+    snapshot = registry.drain() if registry is not None else None
+    return shard, result, total_time, snapshot
+
+
+def finish_shard(shards, fetched, fetch_conf):
+    """Log the timing of a fetched shard and merge its metrics in the
+    registry of the current process.
+
+    Arguments:
+        shards (list): The partitions of the queries.
+        fetched (tuple): Value returned by fetch_shard.
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+
+    Returns:
+        list: API answers in JSON format, or parsed rows in CSV format.
+    """
+    shard, result, total_time, snapshot = fetched
+    logger.info("Shard " + str(shard) + ": " + str(len(shards[shard]))
+                + " queries, " + str(len(result)) + " results in "
+                + str(total_time) + " s")
+    registry = fetch_metrics.get_metrics(fetch_conf)
+    if (registry is not None and snapshot):
+        registry.merge(snapshot)
+    return result
+
+
+def stream_stop_times_batch_sharded(queries, fetch_conf, parsed=False):
+    """Sharded version of stream_stop_times_batch (or
+    stream_stop_times_batch_parsed), fetching the queries split among
+    `shards` (in fetch_conf) processes and yielding the results of every
+    shard as soon as it finishes.
+
+    Arguments:
+        queries (list): List of tuples with the query details (transport_type,
+            line_code, station_name, way).
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+        parsed (bool): Parse the answers to CSV rows.
+
+    Yields:
+        str: API answer in JSON format, or parsed row in CSV format.
+    """
+    shards = shard_queries(queries, fetch_conf['shards'])
+    executor = get_executor(fetch_conf['shards'])
+    futures = [executor.submit(fetch_shard, i, shard, fetch_conf, parsed)
+               for i, shard in enumerate(shards)]
+    for future in as_completed(futures):
+        for item in finish_shard(shards, future.result(), fetch_conf):
+            yield item
+
+
+def stream_stop_times_batch_parsed_sharded(queries, fetch_conf):
+    """Parsed version of stream_stop_times_batch_sharded.
+
+    Arguments:
+        queries (list): List of tuples with the query details (transport_type,
+            line_code, station_name, way).
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+
+    Yields:
+        str: Parsed API answer row in CSV format.
+    """
+    return stream_stop_times_batch_sharded(queries, fetch_conf, parsed=True)
+
+
+async def iter_responses_sharded(queries, fetch_conf, session=None,
+                                 parsed=False):
+    """Async generator version of stream_stop_times_batch_sharded, for the
+    persistent daemon.
+
+    Arguments:
+        queries (list): List of tuples with the query details (transport_type,
+            line_code, station_name, way).
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+        session (ClientSession): Ignored, every worker process has its own.
+        parsed (bool): Parse the answers to CSV rows.
+
+    Yields:
+        str: API answer in JSON format, or parsed row in CSV format.
+    """
+    loop = asyncio.get_event_loop()
+    shards = shard_queries(queries, fetch_conf['shards'])
+    executor = get_executor(fetch_conf['shards'])
+    futures = [loop.run_in_executor(executor, fetch_shard, i, shard,
+                                    fetch_conf, parsed)
+               for i, shard in enumerate(shards)]
+    for future in asyncio.as_completed(futures):
+        for item in finish_shard(shards, await future, fetch_conf):
+            yield item
+
+
+async def iter_stop_times_sharded(queries, fetch_conf, session=None):
+    """Parsed version of iter_responses_sharded.
+
+    Arguments:
+        queries (list): List of tuples with the query details (transport_type,
+            line_code, station_name, way).
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+        session (ClientSession): Ignored, every worker process has its own.
+
+    Yields:
+        str: Parsed API answer row in CSV format.
+    """
+    async for row in iter_responses_sharded(queries, fetch_conf, session,
+                                            parsed=True):
+        yield row
@@ -7,11 +7,22 @@ from aiohttp import (
         client_exceptions
 )
 import datetime
-import json
-from filelock import FileLock
-import pathlib
-import urllib.parse
+from ratp_poll.ratp_api import API_URL
+from ratp_poll.ratp_api import cache as response_cache
+from ratp_poll.ratp_api import changes
+from ratp_poll.ratp_api import concurrency
+from ratp_poll.ratp_api import endpoints
+from ratp_poll.ratp_api import log_writer
+from ratp_poll.ratp_api import metrics as fetch_metrics
+from ratp_poll.ratp_api import parser
+from ratp_poll.ratp_api import profiling
+from ratp_poll.ratp_api import query_index
+from ratp_poll.ratp_api import ratelimit
+from ratp_poll.ratp_api import replay
+from ratp_poll.ratp_api import retry
+from ratp_poll.ratp_api import transport
 import logging
+import time
 
 logger = logging.getLogger()
 
@@ -24,20 +35,30 @@ def fetch_log(fetch_log=None, *args):
         *args (object): CSV line column values.
     """
     if (fetch_log):
-        csv_columns = 'actual_date,transport_type,line_code,stop_code,way,' \
-                      'resp_time,resp_status,' \
-                      'resp_length,timeout,connection_error,' \
-                      'max_connections,timeout_time'
         log_csv = ",".join([str(arg) for arg in args])
         logger.debug("CSV fetch log line: " + log_csv)
-        with FileLock(fetch_log + '.lock', timeout=10):
-            path_exists = pathlib.Path(fetch_log).exists()
-            with open(fetch_log, 'a+') as f:
-                if (path_exists):
-                    f.write('\n')
-                else:
-                    f.write(csv_columns + '\n')
-                f.write(log_csv)
+        log_writer.append_csv_rows(str(fetch_log),
+                                   log_writer.fetch_log_csv_columns,
+                                   [log_csv])
+
+
+def buffered_fetch_log(fetch_conf, *args):
+    """Buffer the passed arguments as a CSV line of the fetch log if set.
+
+    Unlike fetch_log, the line is written later in bulk by a background
+    thread, so it can be called from the fetching coroutines.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+        *args (object): CSV line column values.
+    """
+    if (fetch_conf['log']):
+        with profiling.span(fetch_conf, 'fetch_log'):
+            writer = log_writer.get_fetch_log_writer(
+                        fetch_conf['log'],
+                        fetch_conf.get('log_buffer', 1000))
+            writer.write(*args)
 
 
 async def fetch(transport_type,
@@ -45,12 +66,20 @@ async def fetch(transport_type,
                 station_name,
                 way,
                 session,
-                fetch_conf):
+                fetch_conf,
+                path=None):
     """Fetch the remaining time for a line to a given stop with a defined way
     reusing a session.
 
-    Passes some additional data to the fetch_log function. The  CSV column
-    names are:
+    If the response cache is enabled (`cache_ttl` in fetch_conf), fresh
+    responses are served from it and concurrent requests of the same URL are
+    collapsed into one. If the adaptive concurrency is enabled
+    (`adaptive_concurrency` in fetch_conf), the request waits for the
+    AIMDLimiter and max_connections is logged as its current limit. Failed
+    requests are retried according to fetch_with_retries.
+
+    Passes some additional data to the buffered_fetch_log function. The CSV
+    column names are:
     'actual_date,transport_type,line_code,stop_code,way,' \
     'resp_time,resp_status,resp_length,timeout, \
     'connection_error,max_connections,timeout_time'
@@ -65,12 +94,167 @@ async def fetch(transport_type,
         session (ClientSession): The aiohttp ClientSession.
         fetch_conf (dict): Dictionary with configuration parameters for
             fetching the content.
+        path (str): Quoted URL path of the query, computed if not given
+            (see query_index.Query).
 
     Returns:
-        str: Response text.
+        str: Response text (bytes if `raw_body` is set in fetch_conf).
     """
     global counter
 
+    api_url = fetch_conf.get('api_url', API_URL)
+    if (path is None):
+        path = query_index.quote_path(transport_type, line_code,
+                                      station_name, way)
+    url = api_url + path
+    query = (transport_type, line_code, station_name, way)
+
+    cache = response_cache.get_response_cache(fetch_conf)
+    if (cache is None):
+        body = await fetch_with_retries(url, query, session, fetch_conf,
+                                        path=path)
+    else:
+        body = await cache.get_or_fetch(
+                url, lambda: fetch_with_retries(url, query, session,
+                                                fetch_conf, cache, path))
+    if (body is None or fetch_conf.get('raw_body')):
+        return body
+    return body.decode('utf-8', errors='replace')
+
+
+async def fetch_with_retries(url, query, session, fetch_conf, cache=None,
+                             path=None):
+    """Fetch an URL of the API with fetch_url, retrying the timeouts,
+    connection errors and RETRY_STATUSES answers up to `retries` (in
+    fetch_conf) times with exponential backoff and jitter.
+
+    No attempt is started once the deadline of the batch (`deadline` in
+    fetch_conf) is too close, and every attempt is bounded by it. If the rate
+    limit is enabled, every attempt first waits for its token, unless it is
+    due too close to the deadline.
+
+    If there are several base URLs (`api_urls` in fetch_conf), every attempt
+    requests the path from the endpoint chosen by endpoints.EndpointPool. A
+    failed attempt fails over at once to a healthy endpoint the request has
+    not tried yet, and the retries start over with every endpoint.
+
+    Arguments:
+        url (str): The quoted URL.
+        query (tuple): Tuple with the query details (transport_type,
+            line_code, station_name, way).
+        session (ClientSession): The aiohttp ClientSession.
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+        cache (ResponseCache): Cache passed to fetch_url (optional).
+        path (str): Quoted URL path of the query, relative to the base URLs
+            (needed to balance the attempts among them).
+
+    Returns:
+        bytes: Response body, or None if every attempt failed.
+    """
+    rate_limiter = ratelimit.get_rate_limiter(fetch_conf)
+    pool = None
+    if (path is not None):
+        pool = endpoints.get_endpoint_pool(fetch_conf)
+    tried = []
+    attempt = 0
+    while True:
+        time_left = retry.remaining(fetch_conf)
+        if (time_left is not None and time_left < retry.MIN_ATTEMPT_TIME):
+            logger.warning("Deadline reached before fetching %s", url)
+            return None
+        if (rate_limiter is not None):
+            max_wait = None
+            if (time_left is not None):
+                max_wait = time_left - retry.MIN_ATTEMPT_TIME
+            with profiling.span(fetch_conf, 'rate_limit_wait'):
+                acquired = await rate_limiter.acquire(query[0], max_wait)
+            if (not acquired):
+                logger.warning("Rate limited past the deadline, not "
+                               "fetching %s", url)
+                return None
+        attempt_url = url
+        endpoint = None
+        failover = False
+        if (pool is not None):
+            endpoint = pool.choose(tried)
+            attempt_url = endpoint.url + path
+            failover = pool.untried(tried + [endpoint])
+            pool.start(endpoint)
+            started = time.monotonic()
+        last = attempt >= fetch_conf.get('retries', 0) and not failover
+        body = None
+        try:
+            body = await fetch_url(attempt_url, query, session, fetch_conf,
+                                   cache, retry_status=not last,
+                                   cache_url=url)
+        finally:
+            if (endpoint is not None):
+                pool.finish(endpoint, body is not None,
+                            time.monotonic() - started)
+        if (body is not None):
+            return body
+        if (failover):
+            tried.append(endpoint)
+            logger.info("Failing over %s from %s", path, endpoint.url)
+            continue
+        delay = retry.retry_delay(attempt, fetch_conf)
+        if (delay is None):
+            return None
+        attempt += 1
+        tried = []
+        logger.info("Retry %s of %s in %.3f s", attempt, url, delay)
+        with profiling.span(fetch_conf, 'retry_backoff'):
+            await asyncio.sleep(delay)
+
+
+def request_timeout(fetch_conf):
+    """Get the timeout of a request bounded by the deadline of the batch.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+
+    Returns:
+        ClientTimeout: The timeout, or None to use the one of the session.
+    """
+    time_left = retry.remaining(fetch_conf)
+    if (time_left is None or time_left >= fetch_conf['timeout']):
+        return None
+    return ClientTimeout(total=time_left,
+                         connect=fetch_conf.get('connect_timeout'),
+                         sock_read=fetch_conf.get('read_timeout'))
+
+
+async def fetch_url(url, query, session, fetch_conf, cache=None,
+                    retry_status=False, cache_url=None):
+    """Fetch an URL of the API reusing a session, logging the request with
+    buffered_fetch_log.
+
+    If the metrics are enabled (`metrics` in fetch_conf), the request is
+    recorded in the registry of the process labelled by its transport type
+    and line. If the record is enabled (`record_file` in fetch_conf), the
+    answer or error is appended to the corpus with replay.Recorder. If the
+    tick is profiled, the waits, the request until the answer headers (traced
+    by the TraceConfig of the session) and the body read are timed.
+
+    Arguments:
+        url (str): The quoted URL.
+        query (tuple): Tuple with the query details (transport_type,
+            line_code, station_name, way).
+        session (ClientSession): The aiohttp ClientSession.
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+        cache (ResponseCache): Cache where to store the response and whose
+            validators are used to make a conditional request (optional).
+        retry_status (bool): Return None for the RETRY_STATUSES answers, so
+            they are retried.
+        cache_url (str): URL of the cached response, `url` if not set (they
+            differ when the request goes to another endpoint).
+
+    Returns:
+        bytes: Response body.
+    """
     actual_time = None
     resp_time = None
     resp_status = None
@@ -78,82 +262,411 @@ async def fetch(transport_type,
     timeout = None
     connection_error = None
 
-    api_url = 'https://api-ratp.pierre-grimaud.fr/v4/schedules/'
-    params = '{transport_type}/' \
-             '{line_code}/' \
-             '{station_name}/' \
-             '{way}'.format(**locals())
-    url = api_url+urllib.parse.quote(params)
+    headers = None
+    cache_url = cache_url or url
+    if (cache is not None):
+        headers = cache.validators(cache_url)
+    max_connections = fetch_conf['max_connections']
+    limiter = concurrency.get_concurrency_limiter(fetch_conf)
+    if (limiter is not None):
+        with profiling.span(fetch_conf, 'concurrency_wait'):
+            await limiter.acquire()
+        max_connections = int(limiter.limit)
+    registry = fetch_metrics.get_metrics(fetch_conf)
+    if (registry is not None):
+        labels = query[:2]
+        registry.in_flight.inc(query[:1])
+    recorder = replay.get_recorder(fetch_conf)
+    request_options = {}
+    deadline_timeout = request_timeout(fetch_conf)
+    if (deadline_timeout is not None):
+        # Otherwise the timeout of the session applies
+        request_options['timeout'] = deadline_timeout
+    profile = fetch_conf.get('tick_profile')
+    if (profile is not None):
+        request_options['trace_request_ctx'] = profile
+        request_started = time.perf_counter()
     actual_time = datetime.datetime.now()
     try:
-        async with session.get(url) as response:
+        async with session.get(url, headers=headers,
+                               **request_options) as response:
             dt_2 = datetime.datetime.now()
             resp_time = (dt_2 - actual_time).total_seconds()
             resp_status = response.status
-            resp_text = await response.text()
-            resp_length = len(resp_text)
+            if (profile is not None):
+                profile.add('response', time.perf_counter() - request_started)
+            with profiling.span(fetch_conf, 'body_read'):
+                resp_body = await response.read()
+            resp_length = len(resp_body)
             timeout = False
             connection_error = False
-            logger.info("Response time: " + str(resp_time)
-                        + " code: " + str(resp_status)
-                        + " length: " + str(resp_length))
-            fetch_log(fetch_conf['log'], actual_time,
-                      transport_type, line_code, station_name, way,
-                      resp_time, resp_status,
-                      resp_length, timeout, connection_error,
-                      fetch_conf['max_connections'], fetch_conf['timeout'])
-            return resp_text
+            logger.info("Response time: %s code: %s length: %s",
+                        resp_time, resp_status, resp_length)
+            if (registry is not None):
+                registry.requests.inc(labels + (resp_status,))
+                registry.latency.observe(labels, resp_time)
+            if (recorder is not None):
+                recorder.record(url, query, actual_time.timestamp(),
+                                resp_time, resp_status, resp_body)
+            if (cache is not None):
+                if (resp_status == 304):
+                    resp_body = cache.revalidated(cache_url)
+                elif (resp_status == 200):
+                    cache.store(cache_url, resp_body, response.headers)
+            buffered_fetch_log(fetch_conf, actual_time, *query,
+                               resp_time, resp_status,
+                               resp_length, timeout, connection_error,
+                               max_connections, fetch_conf['timeout'])
+            if (retry_status and resp_status in retry.RETRY_STATUSES):
+                return None
+            return resp_body
     except asyncio.TimeoutError:
         dt_2 = datetime.datetime.now()
         resp_time = (dt_2 - actual_time).total_seconds()
         timeout = True
         connection_error = False
         logger.warning("Timeout")
-        fetch_log(fetch_conf['log'], actual_time,
-                  transport_type, line_code, station_name, way,
-                  resp_time, resp_status,
-                  resp_length, timeout, connection_error,
-                  fetch_conf['max_connections'], fetch_conf['timeout'])
-    except client_exceptions.ClientConnectorError:
+        if (registry is not None):
+            registry.timeouts.inc(labels)
+        if (recorder is not None):
+            recorder.record(url, query, actual_time.timestamp(), resp_time,
+                            replay.TIMEOUT_STATUS)
+        buffered_fetch_log(fetch_conf, actual_time, *query,
+                           resp_time, resp_status,
+                           resp_length, timeout, connection_error,
+                           max_connections, fetch_conf['timeout'])
+    except (client_exceptions.ClientConnectionError,
+            client_exceptions.ClientPayloadError, ConnectionError):
         dt_2 = datetime.datetime.now()
         resp_time = (dt_2 - actual_time).total_seconds()
         timeout = False
         connection_error = True
         logger.warning("Connection error")
-        fetch_log(fetch_conf['log'], actual_time,
-                  transport_type, line_code, station_name, way,
-                  resp_time, resp_status,
-                  resp_length, timeout, connection_error,
-                  fetch_conf['max_connections'], fetch_conf['timeout'])
+        if (registry is not None):
+            registry.connection_errors.inc(labels)
+        if (recorder is not None):
+            recorder.record(url, query, actual_time.timestamp(), resp_time,
+                            replay.CONNECTION_ERROR_STATUS)
+        buffered_fetch_log(fetch_conf, actual_time, *query,
+                           resp_time, resp_status,
+                           resp_length, timeout, connection_error,
+                           max_connections, fetch_conf['timeout'])
+    finally:
+        if (registry is not None):
+            registry.in_flight.dec(query[:1])
+        if (limiter is not None):
+            limiter.release(resp_time, bool(
+                    timeout is not False or connection_error
+                    or resp_status in concurrency.CONGESTION_STATUSES))
+
+
+def create_session(fetch_conf):
+    """Create an aiohttp ClientSession configured from fetch_conf.
+
+    The session can be reused across several batches, keeping the
+    connections and DNS entries alive between them, so the TLS handshakes
+    are not repeated while a connection is kept alive.
+    Its connector is tuned with transport.connector_options. If `http2` is
+    set in fetch_conf, a transport.HTTPXSession is created instead, and if
+    `replay_file` is set, a replay.ReplaySession serving the recorded answers.
+    If `profile` is set, the requests of an aiohttp session are traced with
+    profiling.trace_config.
 
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
 
-async def run(queries, fetch_conf):
-    """Async function that generates a aiohttp ClientSession and fetches the
-    given queries.
+    Returns:
+        ClientSession: The aiohttp ClientSession. Must be closed by the caller.
+    """
+    if (fetch_conf.get('replay_file')):
+        return replay.ReplaySession(fetch_conf)
+    if (fetch_conf.get('http2')):
+        return transport.HTTPXSession(fetch_conf)
+    connector = TCPConnector(**transport.connector_options(fetch_conf))
+    timeout = ClientTimeout(total=fetch_conf['timeout'],
+                            connect=fetch_conf.get('connect_timeout'),
+                            sock_read=fetch_conf.get('read_timeout'))
+    trace_configs = None
+    if (fetch_conf.get('profile')):
+        trace_configs = [profiling.trace_config()]
+    return ClientSession(connector=connector, timeout=timeout,
+                         trace_configs=trace_configs)
+
+
+async def run(queries, fetch_conf, session=None):
+    """Async function that fetches the given queries, generating an aiohttp
+    ClientSession if none is given.
 
     Arguments:
         queries (list): List of tuples with the query details (transport_type,
             line_code, station_name, way).
         fetch_conf (dict): Dictionary with configuration parameters for
             fetching the content.
+        session (ClientSession): Session to reuse. If not set, a new one is
+            created and closed once all the queries have been fetched.
 
     Returns:
         list: The responses.
     """
+    if (session is None):
+        # Fetch all responses within one Client session,
+        # keep connection alive for all requests.
+        async with create_session(fetch_conf) as session:
+            return await run(queries, fetch_conf, session)
+
+    fetch_conf = retry.start_deadline(fetch_conf)
+    fetch_conf, profile = profiling.start_profile(fetch_conf)
     tasks = []
+    for query in queries:
+        task = asyncio.ensure_future(fetch(*query, session, fetch_conf,
+                                           getattr(query, 'path', None)))
+        tasks.append(task)
+
+    responses = await asyncio.gather(*tasks)
+    # you now have all response bodies in this variable
+    failed = [query for query, response in zip(queries, responses)
+              if response is None]
+    report_failed_queries(failed, len(queries), fetch_conf)
+    if (fetch_conf['log']):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, log_writer.flush_fetch_logs)
+    profiling.log_report(profile, 'batch')
+    return responses
+
+
+def report_failed_queries(failed, total, fetch_conf):
+    """Report the queries of a batch without answer, logging them and
+    counting them in the metrics if enabled.
+
+    Arguments:
+        failed (list): List of tuples with the failed query details
+            (transport_type, line_code, station_name, way).
+        total (int): Number of queries of the batch.
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+    """
+    if (not failed):
+        return
+    logger.warning("%s of %s queries failed", len(failed), total)
+    logger.info("Failed queries: %s", failed)
+    registry = fetch_metrics.get_metrics(fetch_conf)
+    if (registry is not None):
+        for query in failed:
+            registry.failed_queries.inc(query[:2])
+
+
+async def get_stop_times_batch_async(queries, fetch_conf, session=None):
+    """Coroutine version of get_stop_times_batch that can reuse a session.
+
+    Arguments:
+        queries (list): List of tuples with the query details (transport_type,
+            line_code, station_name, way).
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+        session (ClientSession): Session to reuse (optional).
+
+    Returns:
+        (list): List containing the API answers in JSON format.
+        (float): Total spent time in seconds.
+    """
+    dt_1 = datetime.datetime.now()
+    responses = await run(queries, fetch_conf, session)
+    dt_2 = datetime.datetime.now()
+
+    json_array = list(filter(None, responses))
+    total_time = (dt_2 - dt_1).total_seconds()
+
+    return json_array, total_time
+
+
+async def fetch_query(query, session, fetch_conf):
+    """Fetch a query, returning it along with its response.
+
+    Arguments:
+        query (tuple): Tuple with the query details (transport_type,
+            line_code, station_name, way).
+        session (ClientSession): The aiohttp ClientSession.
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+
+    Returns:
+        tuple: The query and its response text (None if failed).
+    """
+    return query, await fetch(*query, session, fetch_conf,
+                              getattr(query, 'path', None))
+
+
+async def iter_query_responses(queries, fetch_conf, session=None):
+    """Async generator that fetches the given queries, yielding every query
+    along with its response as soon as the response is received.
+
+    Failed queries are not yielded but reported with report_failed_queries.
+
+    Arguments:
+        queries (list): List of tuples with the query details (transport_type,
+            line_code, station_name, way).
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+        session (ClientSession): Session to reuse. If not set, a new one is
+            created and closed once all the queries have been fetched.
+
+    Yields:
+        tuple: The query and its response text.
+    """
+    if (session is None):
+        async with create_session(fetch_conf) as session:
+            async for query_response in iter_query_responses(queries,
+                                                             fetch_conf,
+                                                             session):
+                yield query_response
+        return
+
+    fetch_conf = retry.start_deadline(fetch_conf)
+    fetch_conf, profile = profiling.start_profile(fetch_conf)
+    tasks = [asyncio.ensure_future(fetch_query(query, session, fetch_conf))
+             for query in queries]
+    failed = []
+    try:
+        for task in asyncio.as_completed(tasks):
+            query, response = await task
+            if (response):
+                yield query, response
+            else:
+                failed.append(query)
+        report_failed_queries(failed, len(queries), fetch_conf)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if (fetch_conf['log']):
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, log_writer.flush_fetch_logs)
+        profiling.log_report(profile, 'batch')
+
+
+async def iter_responses(queries, fetch_conf, session=None):
+    """Async generator version of get_stop_times_batch, yielding every
+    response as soon as it is received.
+
+    Arguments:
+        queries (list): List of tuples with the query details (transport_type,
+            line_code, station_name, way).
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+        session (ClientSession): Session to reuse (optional).
+
+    Yields:
+        str: API answer in JSON format.
+    """
+    async for query, response in iter_query_responses(queries, fetch_conf,
+                                                      session):
+        yield response
+
+
+async def iter_stop_times(queries, fetch_conf, session=None):
+    """Async generator version of get_stop_times_batch_parsed, yielding the
+    parsed rows of every response as soon as it is received.
+
+    If the change detection is enabled (`changes_only` in fetch_conf), only
+    the rows of the schedules that changed since the previous call are
+    yielded, except in the periodic full snapshots.
+
+    Arguments:
+        queries (list): List of tuples with the query details (transport_type,
+            line_code, station_name, way).
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+        session (ClientSession): Session to reuse (optional).
+
+    Yields:
+        str: Parsed API answer row in CSV format.
+    """
+    csv_formatter = parser.CSVFormatter()
+    fetch_conf, profile = profiling.start_profile(dict(fetch_conf,
+                                                       raw_body=True))
+    index = changes.get_schedule_index(fetch_conf)
+    snapshot = index.start_tick() if index is not None else True
+    async for query, response in iter_query_responses(queries, fetch_conf,
+                                                      session):
+        with profiling.span(fetch_conf, 'parse'):
+            rows = parser.parse_response(response)
+            if (index is not None and not index.update(rows, snapshot)):
+                continue
+            csv_rows = csv_formatter.format_rows(rows)
+        for row in csv_rows:
+            yield row
+    profiling.log_report(profile, 'batch')
+
+
+def iterate(async_iterable):
+    """Iterate an async iterable from synchronous code, running the event
+    loop until every item is ready.
+
+    Arguments:
+        async_iterable (object): The async iterable (e.g. an async generator).
+
+    Yields:
+        object: The items of the async iterable.
+    """
+    loop = asyncio.get_event_loop()
+    iterator = async_iterable.__aiter__()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(iterator.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        if (hasattr(iterator, 'aclose')):
+            loop.run_until_complete(iterator.aclose())
+
+
+def stream_query_responses(queries, fetch_conf):
+    """Generator version of iter_query_responses, yielding every query along
+    with its response as soon as the response is received.
+
+    Arguments:
+        queries (list): List of tuples with the query details (transport_type,
+            line_code, station_name, way).
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+
+    Yields:
+        tuple: The query and its response text.
+    """
+    return iterate(iter_query_responses(queries, fetch_conf))
+
+
+def stream_stop_times_batch(queries, fetch_conf):
+    """Generator version of get_stop_times_batch, yielding every response as
+    soon as it is received.
+
+    Arguments:
+        queries (list): List of tuples with the query details (transport_type,
+            line_code, station_name, way).
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+
+    Yields:
+        str: API answer in JSON format.
+    """
+    return iterate(iter_responses(queries, fetch_conf))
+
+
+def stream_stop_times_batch_parsed(queries, fetch_conf):
+    """Generator version of get_stop_times_batch_parsed, yielding the parsed
+    rows of every response as soon as it is received.
 
-    # Fetch all responses within one Client session,
-    # keep connection alive for all requests.
-    connector = TCPConnector(limit=fetch_conf['max_connections'])
-    timeout = ClientTimeout(total=fetch_conf['timeout'])
-    async with ClientSession(connector=connector, timeout=timeout) as session:
-        for query in queries:
-            task = asyncio.ensure_future(fetch(*query, session, fetch_conf))
-            tasks.append(task)
+    Arguments:
+        queries (list): List of tuples with the query details (transport_type,
+            line_code, station_name, way).
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
 
-        responses = await asyncio.gather(*tasks)
-        # you now have all response bodies in this variable
-        return responses
+    Yields:
+        str: Parsed API answer row in CSV format.
+    """
+    return iterate(iter_stop_times(queries, fetch_conf))
 
 
 def get_stop_times_batch(queries, fetch_conf):
@@ -171,16 +684,12 @@ def get_stop_times_batch(queries, fetch_conf):
         (float): Total spent time in seconds.
     """
 
-    dt_1 = datetime.datetime.now()
     loop = asyncio.get_event_loop()
-    future = asyncio.ensure_future(run(queries, fetch_conf))
+    future = asyncio.ensure_future(get_stop_times_batch_async(queries,
+                                                              fetch_conf))
     loop.run_until_complete(future)
-    dt_2 = datetime.datetime.now()
 
-    json_array = list(filter(None, future.result()))
-    total_time = (dt_2 - dt_1).total_seconds()
-
-    return json_array, total_time
+    return future.result()
 
 
 def get_stop_times(query, fetch_conf):
@@ -229,43 +738,54 @@ def get_stop_times_batch_parsed(queries, fetch_conf):
         float: Total spent time in seconds.
     """
 
+    fetch_conf, profile = profiling.start_profile(dict(fetch_conf,
+                                                       raw_body=True))
     json_array, total_time = get_stop_times_batch(queries, fetch_conf)
+    with profiling.span(fetch_conf, 'parse'):
+        csv_array = parse_stop_times(json_array)
+    profiling.log_report(profile, 'batch')
 
-    csv_array = []
+    return csv_array, total_time
 
-    for stop in json_array:
-        try:
-            split_stop = stop.split('{', 1)
-        except AttributeError:
-            logger.warning("Empty answer")
-            continue
 
-        if (len(split_stop) > 1):
-            stop = '{' + split_stop[1]
+async def get_stop_times_batch_parsed_async(queries, fetch_conf,
+                                            session=None):
+    """Coroutine version of get_stop_times_batch_parsed that can reuse a
+    session.
 
-        try:
-            stop_json = json.loads(stop)
-        except ValueError:
-            logger.warning("json error")
-            continue
+    Arguments:
+        queries (list): List of tuples with the query details (transport_type,
+            line_code, station_name, way).
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+        session (ClientSession): Session to reuse (optional).
 
-        try:
-            schedules = stop_json['result']['schedules']
-            metadata = stop_json['_metadata']
-            for schedule in schedules:
-                selected_fields = [
-                        metadata['date'],
-                        metadata['call'],
-                        schedule['message'].replace(' mn', ''),
-                        schedule['destination'],
-                        ]
-                row = ','.join(selected_fields)
-                csv_array.append(row)
-        except (KeyError, TypeError):
-            logger.warning("Answer without times")
-            continue
-        except Exception as e:
-            logger.warning("Unknown error: " + str(e))
-            continue
+    Returns:
+        list: Parsed API answers in CSV format.
+        float: Total spent time in seconds.
+    """
+    json_array, total_time = await get_stop_times_batch_async(
+                                    queries, dict(fetch_conf, raw_body=True),
+                                    session)
 
-    return csv_array, total_time
+    return parse_stop_times(json_array), total_time
+
+
+def parse_stop_times(json_array):
+    """Parse the API answers to CSV rows.
+
+    Arguments:
+        json_array (list): List containing the API answers in JSON format
+            (bytes or str).
+
+    Returns:
+        list: Parsed API answers in CSV format.
+    """
+    csv_formatter = parser.CSVFormatter()
+    csv_array = []
+
+    for stop in json_array:
+        csv_array.extend(csv_formatter.format_rows(
+                            parser.parse_response(stop)))
+
+    return csv_array
@@ -0,0 +1,174 @@
+"""HTTP transports of the fetching sessions.
+
+The default transport is an aiohttp ClientSession whose connector is tuned
+from fetch_conf. With `http2` set, an httpx client multiplexes the requests
+over a few HTTP/2 connections to the API host instead, behind an adapter
+exposing the part of the ClientSession interface used by stop_times.
+"""
+import asyncio
+import logging
+import os
+import ssl
+
+logger = logging.getLogger()
+
+# Defaults of the connector options, the ones of aiohttp
+DNS_TTL = 10
+KEEPALIVE_TIMEOUT = 15.0
+
+# SSL context of the current process, shared by all its sessions so the CA
+# certificates are only loaded once. TLS sessions are not resumed across
+# connections: asyncio never hands a saved session to a new connection.
+_ssl_context = None
+_ssl_context_pid = None
+
+
+def get_ssl_context():
+    """Get the SSL context of the current process, creating it if needed.
+
+    Returns:
+        SSLContext: The context.
+    """
+    global _ssl_context, _ssl_context_pid
+    if (_ssl_context_pid != os.getpid()):
+        _ssl_context = ssl.create_default_context()
+        _ssl_context_pid = os.getpid()
+    return _ssl_context
+
+
+def connector_options(fetch_conf):
+    """Get the TCPConnector arguments from fetch_conf.
+
+    With several base URLs (`api_urls`), `max_connections` is the limit of
+    every host, so the connections scale with the endpoints.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content. `max_connections`, `limit_per_host`
+            (0 for no limit), `dns_ttl` (seconds, None to cache forever) and
+            `keepalive` (seconds an idle connection is kept open) are used.
+
+    Returns:
+        dict: The keyword arguments.
+    """
+    limit = fetch_conf['max_connections']
+    limit_per_host = fetch_conf.get('limit_per_host') or 0
+    hosts = len(fetch_conf.get('api_urls') or ())
+    if (hosts > 1):
+        limit_per_host = limit_per_host or limit
+        limit *= hosts
+    return {
+        'limit': limit,
+        'limit_per_host': limit_per_host,
+        'ttl_dns_cache': fetch_conf.get('dns_ttl', DNS_TTL),
+        'keepalive_timeout': fetch_conf.get('keepalive', KEEPALIVE_TIMEOUT),
+        'ssl': get_ssl_context(),
+    }
+
+
+def http2_available():
+    """Check if httpx with HTTP/2 support is installed."""
+    try:
+        import httpx  # noqa: F401
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class HTTPXResponse:
+    """Adapter of an httpx response to the aiohttp ClientResponse interface.
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self.status = response.status_code
+        self.headers = response.headers
+
+    async def read(self):
+        """Get the body."""
+        return self._response.content
+
+
+class HTTPXRequest:
+    """Asynchronous context manager sending a GET request with an httpx
+    client, translating its errors to the ones handled by stop_times: a
+    timeout raises asyncio.TimeoutError and any other transport error
+    ConnectionError.
+    """
+
+    def __init__(self, client, url, headers, timeout):
+        self._client = client
+        self._url = url
+        self._headers = headers
+        self._timeout = timeout
+
+    async def __aenter__(self):
+        import httpx
+
+        try:
+            response = await asyncio.wait_for(
+                    self._client.get(self._url, headers=self._headers),
+                    self._timeout)
+        except httpx.TimeoutException:
+            raise asyncio.TimeoutError()
+        except httpx.TransportError as e:
+            raise ConnectionError(str(e))
+        return HTTPXResponse(response)
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class HTTPXSession:
+    """Adapter of an httpx AsyncClient to the aiohttp ClientSession interface
+    used by stop_times.
+
+    Arguments:
+        fetch_conf (dict): Dictionary with configuration parameters for
+            fetching the content.
+    """
+
+    def __init__(self, fetch_conf):
+        import httpx
+
+        self.total_timeout = fetch_conf['timeout']
+        timeout = httpx.Timeout(fetch_conf['timeout'],
+                                connect=fetch_conf.get('connect_timeout'),
+                                read=fetch_conf.get('read_timeout'))
+        limits = httpx.Limits(
+                max_connections=fetch_conf['max_connections'],
+                max_keepalive_connections=fetch_conf['max_connections'],
+                keepalive_expiry=fetch_conf.get('keepalive',
+                                                KEEPALIVE_TIMEOUT))
+        self._client = httpx.AsyncClient(http2=True, timeout=timeout,
+                                         limits=limits,
+                                         verify=get_ssl_context())
+
+    def get(self, url, headers=None, timeout=None, trace_request_ctx=None):
+        """Send a GET request.
+
+        Arguments:
+            url (str): The URL.
+            headers (dict): Request headers (optional).
+            timeout (ClientTimeout): Total timeout of the request, the one of
+                the session if not set.
+            trace_request_ctx (object): Ignored, the requests are not traced.
+
+        Returns:
+            HTTPXRequest: Asynchronous context manager of the response.
+        """
+        total = self.total_timeout
+        if (timeout is not None and timeout.total is not None):
+            total = timeout.total
+        return HTTPXRequest(self._client, url, headers, total)
+
+    async def close(self):
+        """Close the connections."""
+        await self._client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
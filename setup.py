@@ -10,6 +10,14 @@ with open('README.md') as readme_file:
 requirements = ['pip>=19', 'Click>=7.0', 'click-log>=0.3', 'aiohttp>=3.6',
                 'filelock>=3']
 
+# Optional dependencies: faster JSON decoding, HTTP/2 (`--http2`) and the
+# vectorized analysis of the fetch logs (`analyze`)
+extras_requirements = {
+    'json': ['orjson'],
+    'http2': ['httpx[http2]'],
+    'analysis': ['numpy'],
+}
+
 setup_requirements = ['pytest-runner', ]
 
 test_requirements = ['pytest>=3', 'pytest-asyncio>=0.10']
@@ -17,15 +25,13 @@ test_requirements = ['pytest>=3', 'pytest-asyncio>=0.10']
 setup(
     author="cgupm",
     author_email='cgupm@autistici.org',
-    python_requires='>=3.5',
+    python_requires='>=3.7',
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
         'Natural Language :: English',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
     ],
@@ -36,6 +42,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="GNU General Public License v3",
     long_description=readme,
     include_package_data=True,
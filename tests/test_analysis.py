@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""Test `analysis` module."""
+
+from ratp_poll.ratp_api import analysis, log_writer
+
+import pytest
+
+
+def write_log(path):
+    rows = [log_writer.fetch_log_csv_columns]
+    # The sweep lasts 4 s with 5 connections and 2 s with 10 or 20
+    for max_connections, resp_time, seconds in ((5, 0.2, 4), (10, 0.1, 2),
+                                                (20, 0.1, 2)):
+        for i in range(100):
+            second = '2020-09-01 10:00:{:02d}.{:06d}'.format(
+                    max_connections + i * seconds // 100, i)
+            timeout = max_connections == 20 and i < 10
+            rows.append(','.join(str(value) for value in (
+                    second, 'buses', '187', 'Division Leclerc, Camille', 'A',
+                    resp_time, None if timeout else 200, 1000, timeout,
+                    False, max_connections, 10)))
+    with open(path, 'w') as f:
+        f.write('\n'.join(rows))
+
+
+class TestAnalysis:
+    def test_aggregates_and_recommends(self, tmpdir):
+        path = str(tmpdir.join('fetch_log.csv'))
+        write_log(path)
+        groups = analysis.analyze([path], chunk_size=1000, vectorized=False)
+        assert sorted(groups) == [('10', 'buses'), ('20', 'buses'),
+                                  ('5', 'buses')]
+        group = groups[('20', 'buses')]
+        assert (group.requests, group.timeouts) == (100, 10)
+        assert group.throughput == 45
+        assert group.little_throughput == pytest.approx(200)
+        assert group.percentile(50) == pytest.approx(0.1, rel=0.06)
+        summary = analysis.summarize(groups)
+        assert [row[:2] for row in summary][:2] == [('5', 'all'),
+                                                    ('5', 'buses')]
+        assert groups[('5', 'buses')].throughput == 25
+        assert analysis.recommend(summary).max_connections == 10
+        assert analysis.recommend(summary,
+                                  tolerance=0.5).max_connections == 5
+
+    def test_vectorized_aggregation_is_equivalent(self, tmpdir):
+        pytest.importorskip('numpy')
+        path = str(tmpdir.join('fetch_log.csv'))
+        write_log(path)
+        groups = analysis.analyze([path], chunk_size=1000, vectorized=False)
+        vectorized = analysis.analyze([path], chunk_size=1000,
+                                      vectorized=True)
+        assert sorted(groups) == sorted(vectorized)
+        for key, group in groups.items():
+            other = vectorized[key]
+            assert (other.requests, other.timeouts, other.seconds,
+                    other.latency_buckets) == (group.requests,
+                                               group.timeouts, group.seconds,
+                                               group.latency_buckets)
+            assert other.latency_sum == pytest.approx(group.latency_sum)
+
+    @pytest.mark.parametrize('vectorized', [False, True])
+    def test_malformed_rows_are_skipped(self, tmpdir, vectorized):
+        if (vectorized):
+            pytest.importorskip('numpy')
+        path = str(tmpdir.join('fetch_log.csv'))
+        write_log(path)
+        with open(path, 'a') as f:
+            f.write('\n2020-09-01 10:00:30.000000,buses,187,x,A,oops,200,1,'
+                    'False,False,10,10\n'
+                    'truncated,row\n\n'
+                    + log_writer.fetch_log_csv_columns + '\n'
+                    '2020-09-01 10:00:30.000000,buses,187,x,A,,,,True,False,'
+                    '10,10')
+        groups = analysis.analyze([path], chunk_size=1000,
+                                  vectorized=vectorized)
+        group = groups[('10', 'buses')]
+        assert (group.requests, group.timeouts) == (101, 1)
+        assert sum(group.latency_buckets) == 100
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+"""Test `cache` module."""
+
+from ratp_poll.ratp_api import cache, stop_times
+
+from aiohttp import ClientSession
+from aioresponses import aioresponses
+import asyncio
+import pytest
+
+
+class TestCache:
+    def test_evicts_least_recently_used(self):
+        response_cache = cache.ResponseCache(60, max_size=2)
+        response_cache.store('a', 'A', {})
+        response_cache.store('b', 'B', {})
+        response_cache.get('a')
+        response_cache.store('c', 'C', {})
+        assert response_cache.get('a') == 'A'
+        assert response_cache.get('b') is None
+        assert response_cache.get('c') == 'C'
+
+    def test_expired_entry_keeps_validators(self):
+        response_cache = cache.ResponseCache(0)
+        response_cache.store('a', 'A', {'ETag': '"1"'})
+        assert response_cache.get('a') is None
+        assert response_cache.validators('a') == {'If-None-Match': '"1"'}
+        assert response_cache.revalidated('a') == 'A'
+
+    @pytest.mark.asyncio
+    async def test_collapses_concurrent_requests(self):
+        url = 'https://api-ratp.pierre-grimaud.fr/v4/schedules/' \
+              'buses/187/Division%20Leclerc%20-%20Camille%20Desmoulins/A'
+        fetch_conf = {
+                'log': None,
+                'timeout': 10,
+                'max_connections': 1,
+                'cache_ttl': 60}
+        query = ('buses', '187', 'Division Leclerc - Camille Desmoulins', 'A')
+        with aioresponses() as m:
+            m.get(url, status=200, body='test')
+            async with ClientSession() as session:
+                responses = await asyncio.gather(
+                        stop_times.fetch(*query, session, fetch_conf),
+                        stop_times.fetch(*query, session, fetch_conf))
+                assert responses == ['test', 'test']
+                assert await stop_times.fetch(*query, session,
+                                              fetch_conf) == 'test'
+            assert sum(len(calls) for calls in m.requests.values()) == 1
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+"""Test `changes` module."""
+
+from ratp_poll.ratp_api import changes
+
+CALL = 'GET /schedules/buses/187/x/A'
+
+
+def rows(date, *messages):
+    return [(date, CALL, message, 'Porte d\'Auteuil') for message in messages]
+
+
+class TestChanges:
+    def test_only_changed_schedules_are_emitted(self):
+        index = changes.ScheduleIndex()
+        assert index.start_tick()
+        assert index.update(rows('10:00', '2', '8'))
+        assert not index.start_tick()
+        assert not index.update(rows('10:01', '2', '8'))
+        assert index.update(rows('10:01', '1', '7'))
+        assert not index.update([])
+        assert len(index) == 1
+
+    def test_periodic_snapshots(self):
+        index = changes.ScheduleIndex(snapshot_every=2)
+        snapshots = [index.start_tick() for _ in range(5)]
+        assert snapshots == [True, False, True, False, True]
+        index.update(rows('10:00', '2'))
+        assert index.update(rows('10:00', '2'), snapshot=True)
+
+    def test_disabled_by_default(self):
+        assert changes.get_schedule_index({}) is None
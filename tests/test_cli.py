@@ -19,5 +19,13 @@ class TestCLI:
         assert '-h, --help                 Show this message and exit.' in \
                help_result.output
 
+    def test_api_weights_must_be_positive(self):
+        result = CliRunner().invoke(cli.main, [
+                '--api-url', 'http://a/', '--api-url', 'http://b/',
+                '--api-weight', '0', '--api-weight', '1', 'gst', 'buses',
+                '187', 'x', 'A'])
+        assert result.exit_code == 2
+        assert 'expected a positive number' in result.output
+
     def fail(self):
         assert 0
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""Test `columnar` module."""
+
+from ratp_poll.daemon import columnar
+
+import json
+import os
+
+BODY = json.dumps({
+    'result': {'schedules': [
+        {'message': '2 mn', 'destination': 'Porte d\'Auteuil'},
+        {'message': 'Train a quai', 'destination': 'Porte d\'Auteuil'}]},
+    '_metadata': {'call': 'GET /schedules/buses/187/x/A',
+                  'date': '2020-09-01T10:00:00+02:00',
+                  'version': 4}}).encode()
+QUERY = ('buses', '187', 'Division Leclerc - Camille Desmoulins', 'A')
+
+
+class TestColumnar:
+    def test_can_read_written_row_groups(self, tmpdir):
+        output_file = str(tmpdir.join('output'))
+        for _ in range(2):
+            with columnar.ColumnarOutput(output_file) as output:
+                output.add((QUERY, BODY))
+                output.commit()
+        rows = list(columnar.read_rows(output_file + columnar.EXTENSION))
+        assert len(rows) == 4
+        assert rows[0][1:] == QUERY + (2, '2', 'Porte d\'Auteuil')
+        assert rows[1][5:7] == (-1, 'Train a quai')
+        assert rows[0][0] == 1598947200
+
+    def test_skips_truncated_row_group(self, tmpdir):
+        path = str(tmpdir.join('output' + columnar.EXTENSION))
+        builder = columnar.RowGroupBuilder()
+        builder.add_response(QUERY, BODY)
+        row_group = builder.encode()
+        with open(path, 'wb') as f:
+            f.write(row_group + row_group[:-3])
+        assert len(list(columnar.read_rows(path))) == 2
+
+    def test_rotates_by_time_and_size(self, tmpdir):
+        output_file = str(tmpdir.join('output'))
+        output_conf = {'rotate_interval': 60, 'rotate_size': 1}
+        first = columnar.segment_path(output_file, output_conf, now=30)
+        assert first.endswith('.000000' + columnar.EXTENSION)
+        with open(first, 'wb') as f:
+            f.write(b'x')
+        second = columnar.segment_path(output_file, output_conf, now=59)
+        assert second.endswith('.000001' + columnar.EXTENSION)
+        other = columnar.segment_path(output_file, output_conf, now=61)
+        assert os.path.dirname(other) == os.path.dirname(first)
+        assert other.endswith('.000000' + columnar.EXTENSION)
+        assert other != first
+
+    def test_size_rotation_ignores_other_files(self, tmpdir):
+        output_file = str(tmpdir.join('output'))
+        # Time rotated files sharing the base
+        tmpdir.join('output.20200901T100000' + columnar.EXTENSION).write('x')
+        tmpdir.join('output.000009' + columnar.EXTENSION).write('x')
+        path = columnar.segment_path(output_file, {'rotate_size': 1})
+        assert path.endswith('output.000010' + columnar.EXTENSION)
+
+    def test_remaining_minutes_fit_the_column(self):
+        assert columnar.remaining_minutes('12') == 12
+        assert columnar.remaining_minutes('99999') == \
+            columnar.MAX_REMAINING_MINUTES
+        assert columnar.remaining_minutes(None) == -1
+        assert columnar.remaining_minutes('Train a quai') == -1
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""Test `concurrency` module."""
+
+from ratp_poll.ratp_api import concurrency
+from ratp_poll.ratp_api import stop_times
+
+from aioresponses import aioresponses
+import aiohttp
+import asyncio
+import pytest
+
+URL = 'https://api-ratp.pierre-grimaud.fr/v4/schedules/' \
+      'buses/187/Division%20Leclerc%20-%20Camille%20Desmoulins/A'
+QUERY = ('buses', '187', 'Division Leclerc - Camille Desmoulins', 'A')
+
+
+@pytest.fixture
+def limiters(monkeypatch):
+    """Start with no limiter in the process."""
+    monkeypatch.setattr(concurrency, '_limiters', {})
+
+
+class TestConcurrency:
+    @pytest.mark.asyncio
+    async def test_limits_requests_in_flight(self):
+        limiter = concurrency.AIMDLimiter(1, 10)
+        await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        limiter.release(0.1)
+        await waiting
+        assert limiter.in_flight == 1
+
+    @pytest.mark.asyncio
+    async def test_adapts_limit(self):
+        limiter = concurrency.AIMDLimiter(10, 20)
+        for _ in range(10):
+            await limiter.acquire()
+            limiter.release(0.1)
+        assert limiter.limit > 10
+        await limiter.acquire()
+        limiter.release(1)
+        assert limiter.limit < 10
+        limit = limiter.limit
+        # Only one decrease per round trip
+        await limiter.acquire()
+        limiter.release(1, failed=True)
+        assert limiter.limit == limit
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('answer, congested', [
+        ({'status': 200}, False),
+        ({'status': 304}, False),
+        ({'status': 429}, True),
+        ({'status': 503}, True),
+        ({'exception': asyncio.TimeoutError()}, True),
+        ({'exception': ConnectionResetError()}, True),
+        ({'exception': aiohttp.ClientConnectorError(
+                None, OSError(111, 'Connection refused'))}, True),
+    ])
+    async def test_fetch_outcomes_adapt_limit(self, limiters, answer,
+                                              congested):
+        fetch_conf = {'log': None, 'timeout': 10, 'adaptive_concurrency': True,
+                      'max_connections': 100}
+        limiter = concurrency.get_concurrency_limiter(fetch_conf)
+        with aioresponses() as m:
+            m.get(URL, body='test', **answer)
+            async with aiohttp.ClientSession() as session:
+                await stop_times.fetch_url(URL, QUERY, session, fetch_conf)
+        assert limiter.in_flight == 0
+        assert (limiter.limit < 10) == congested
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+"""Test `daemon` module."""
+
+from ratp_poll.daemon import daemon
+from ratp_poll.ratp_api import stop_times
+
+from aioresponses import aioresponses
+from multiprocessing.pool import ThreadPool
+import pytest
+import threading
+
+
+class TestDaemon:
+    @pytest.mark.asyncio
+    async def test_persistent_daemon_writes_every_tick(self, tmpdir):
+        output_file = str(tmpdir.join('output'))
+        fetch_conf = {
+                'log': None,
+                'timeout': 10,
+                'max_connections': 1}
+        query = ('buses', '187', 'Division Leclerc - Camille Desmoulins', 'A')
+        with aioresponses() as m:
+            m.get('https://api-ratp.pierre-grimaud.fr/v4/schedules/'
+                  'buses/187/Division%20Leclerc%20-%20Camille%20Desmoulins/A',
+                  status=200, body='test', repeat=True)
+            await daemon.run_persistent_daemon(
+                    stop_times.iter_responses, [query],
+                    output_file, 0, 1, [1, 2], fetch_conf)
+        with open(output_file) as f:
+            assert f.read() == 'test\ntest'
+
+    def test_pending_ticks_are_bounded(self):
+        release = threading.Event()
+        pool = ThreadPool(2)
+        pending = daemon.PendingTicks(1)
+        pending.submit(pool, release.wait, (5,))
+        assert pending.full()
+        assert not pending.wait_slot(0.01)
+        release.set()
+        assert pending.wait_slot(5)
+        assert len(pending) == 0
+        pending.join()
+        pool.close()
+        pool.join()
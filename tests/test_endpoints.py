@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""Test `endpoints` module."""
+
+from ratp_poll.ratp_api import endpoints
+from ratp_poll.ratp_api import stop_times
+from ratp_poll.ratp_api import transport
+
+from aioresponses import aioresponses
+import pytest
+
+MIRROR_A = 'http://mirror-a/v4/schedules/'
+MIRROR_B = 'http://mirror-b/v4/schedules/'
+PATH = 'buses/187/Division%20Leclerc%20-%20Camille%20Desmoulins/A'
+QUERY = ('buses', '187', 'Division Leclerc - Camille Desmoulins', 'A')
+
+
+class TestEndpoints:
+    def test_least_outstanding_weighs_the_requests_in_flight(self):
+        pool = endpoints.EndpointPool([MIRROR_A, MIRROR_B], [2, 1])
+        a, b = pool.endpoints
+        chosen = []
+        for _ in range(3):
+            endpoint = pool.choose()
+            pool.start(endpoint)
+            chosen.append(endpoint)
+        assert chosen.count(a) == 2 and chosen.count(b) == 1
+        assert pool.choose(exclude=[a]) is b
+
+    def test_weighted_round_robin_is_smooth(self):
+        pool = endpoints.EndpointPool([MIRROR_A, MIRROR_B], [3, 1],
+                                      policy='weighted')
+        urls = [pool.choose().url for _ in range(8)]
+        assert urls.count(MIRROR_A) == 6
+        assert urls[:4].count(MIRROR_B) == 1
+
+    def test_failing_endpoint_is_avoided(self):
+        pool = endpoints.EndpointPool([MIRROR_A, MIRROR_B], cooldown=30)
+        a, b = pool.endpoints
+        for _ in range(endpoints.FAILURE_THRESHOLD):
+            pool.start(a)
+            pool.finish(a, False, 0.1, now=100)
+        assert not a.healthy(100) and a.healthy(130)
+        assert pool.choose(now=100) is b
+        assert not pool.untried([b], now=100)
+        # Every endpoint is tried again if none is healthy
+        assert pool.choose(exclude=[b], now=100) is a
+
+    def test_weights_must_be_positive(self):
+        for weight in (0, -1):
+            with pytest.raises(ValueError):
+                endpoints.EndpointPool([MIRROR_A, MIRROR_B], [1, weight])
+
+    def test_connections_scale_with_the_endpoints(self):
+        fetch_conf = {'max_connections': 5, 'api_urls': [MIRROR_A, MIRROR_B]}
+        options = transport.connector_options(fetch_conf)
+        assert options['limit'] == 10 and options['limit_per_host'] == 5
+        options = transport.connector_options({'max_connections': 5})
+        assert options['limit'] == 5 and options['limit_per_host'] == 0
+
+    @pytest.mark.asyncio
+    async def test_fetch_fails_over_to_another_endpoint(self):
+        fetch_conf = {
+                'log': None,
+                'timeout': 10,
+                'max_connections': 1,
+                'api_url': MIRROR_A,
+                'api_urls': [MIRROR_A, MIRROR_B],
+                'balance': 'weighted',
+                'retries': 0}
+        with aioresponses() as m:
+            m.get(MIRROR_A + PATH, status=503, body='error')
+            m.get(MIRROR_B + PATH, status=200, body='test')
+            responses = await stop_times.run([QUERY], fetch_conf)
+        assert responses == ['test']
+        pool = endpoints.get_endpoint_pool(fetch_conf)
+        assert [endpoint.failures for endpoint in pool.endpoints] == [1, 0]
+        assert all(endpoint.outstanding == 0 for endpoint in pool.endpoints)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""Test `metrics` module."""
+
+from ratp_poll.ratp_api import metrics
+from ratp_poll.ratp_api import stop_times
+
+from aioresponses import aioresponses
+import pytest
+
+
+class TestMetrics:
+    def test_histogram_exposition(self):
+        histogram = metrics.Histogram('latency', 'Latency.', ('line',),
+                                      buckets=(0.1, 1.0))
+        histogram.observe(('187',), 0.1)
+        histogram.observe(('187',), 0.5)
+        histogram.observe(('187',), 2.0)
+        assert list(histogram.samples()) == [
+                'latency_bucket{line="187",le="0.1"} 1',
+                'latency_bucket{line="187",le="1"} 2',
+                'latency_bucket{line="187",le="+Inf"} 3',
+                'latency_sum{line="187"} 2.6',
+                'latency_count{line="187"} 3']
+
+    def test_can_merge_drained_metrics(self):
+        worker = metrics.Metrics()
+        worker.requests.inc(('buses', '187', 200))
+        worker.latency.observe(('buses', '187'), 0.2)
+        registry = metrics.Metrics()
+        registry.requests.inc(('buses', '187', 200))
+        registry.merge(worker.drain())
+        assert registry.requests.values == {('buses', '187', 200): 2}
+        assert sum(registry.latency.values[('buses', '187')][:-1]) == 1
+        assert worker.requests.values == {}
+
+    def test_disabled_by_default(self):
+        assert metrics.get_metrics({}) is None
+
+    @pytest.mark.asyncio
+    async def test_fetch_records_request(self):
+        fetch_conf = {
+                'log': None,
+                'timeout': 10,
+                'max_connections': 1,
+                'metrics': True}
+        registry = metrics.get_registry()
+        for metric in registry.metrics():
+            metric.reset()
+        with aioresponses() as m:
+            m.get('https://api-ratp.pierre-grimaud.fr/v4/schedules/'
+                  'buses/187/Division%20Leclerc%20-%20Camille%20Desmoulins/A',
+                  status=200, body='test')
+            session = stop_times.create_session(fetch_conf)
+            await stop_times.fetch('buses', '187',
+                                   'Division Leclerc - Camille Desmoulins',
+                                   'A', session, fetch_conf)
+            await session.close()
+        assert registry.requests.values == {('buses', '187', 200): 1}
+        assert registry.in_flight.values == {('buses',): 0}
+        assert 'ratp_poll_request_duration_seconds_count{transport_type=' \
+               '"buses",line="187"} 1' in registry.exposition()
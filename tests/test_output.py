@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+"""Test `output` module."""
+
+from ratp_poll.daemon import output
+
+from filelock import FileLock
+import os
+import threading
+import time
+
+
+class TestOutput:
+    def test_segments_are_compacted_in_order(self, tmpdir):
+        output_file = str(tmpdir.join('output'))
+        with open(output_file, 'w') as f:
+            f.write('header')
+        for tick in range(3):
+            with output.open_output(output_file,
+                                    {'format': 'segments'}) as tick_output:
+                tick_output.add('tick {} a'.format(tick))
+                tick_output.add('tick {} b'.format(tick))
+                tick_output.commit()
+        with output.open_output(output_file,
+                                {'format': 'segments'}) as tick_output:
+            tick_output.add('uncommitted')
+        segments = output.list_segments(output_file)
+        assert len(segments) == 3
+        assert sorted(os.listdir(output.segments_dir(output_file))) == [
+                os.path.basename(segment) for segment in segments]
+        assert output.compact_segments(output_file) == 3
+        assert output.list_segments(output_file) == []
+        with open(output_file) as f:
+            assert f.read() == ('header\ntick 0 a\ntick 0 b\ntick 1 a\n'
+                                'tick 1 b\ntick 2 a\ntick 2 b')
+
+    def test_overlapping_compactions(self, tmpdir, monkeypatch):
+        output_file = str(tmpdir.join('output'))
+        for tick in range(2):
+            with output.open_output(output_file,
+                                    {'format': 'segments'}) as tick_output:
+                tick_output.add('tick {}'.format(tick))
+                tick_output.commit()
+        results = []
+        with FileLock(output_file + '.lock'):
+            compaction = threading.Thread(target=lambda: results.append(
+                    output.compact_segments(output_file)))
+            compaction.start()
+            # Other compaction holding the lock
+            time.sleep(0.2)
+            with open(output_file, 'w') as f:
+                f.write('tick 0\ntick 1')
+            for segment in output.list_segments(output_file):
+                os.remove(segment)
+        compaction.join()
+        assert results == [0]
+        # A segment removed in between is skipped
+        segments = output.list_segments
+        monkeypatch.setattr(output, 'list_segments', lambda path: [
+                str(tmpdir.join('missing' + output.SEGMENT_EXTENSION))]
+                + segments(path))
+        with output.open_output(output_file,
+                                {'format': 'segments'}) as tick_output:
+            tick_output.add('tick 2')
+            tick_output.commit()
+        assert output.compact_segments(output_file) == 1
+        with open(output_file) as f:
+            assert f.read() == 'tick 0\ntick 1\ntick 2'
+
+    def test_lock_timeout_writes_a_segment(self, tmpdir, monkeypatch):
+        output_file = str(tmpdir.join('output'))
+        monkeypatch.setattr(output, 'FileLock',
+                            lambda path, timeout: FileLock(path, timeout=0))
+        with FileLock(output_file + '.lock'):
+            with output.open_output(output_file) as tick_output:
+                tick_output.add('line')
+                tick_output.commit()
+        assert not os.path.exists(output_file)
+        assert len(output.list_segments(output_file)) == 1
+        output.compact_segments(output_file)
+        with open(output_file) as f:
+            assert f.read() == 'line'
+
+    def test_raw_records_are_framed(self, tmpdir):
+        bodies = [b'{"result": 1}', b'{"result": 2}', b'']
+        newline_file = str(tmpdir.join('newline'))
+        length_file = str(tmpdir.join('length'))
+        for _ in range(2):
+            for path, framing in ((newline_file, 'newline'),
+                                  (length_file, 'length')):
+                with output.open_output(path, {'format': 'raw',
+                                               'framing': framing}) as out:
+                    for body in bodies:
+                        out.add(body)
+                    out.commit()
+        with open(newline_file, 'rb') as f:
+            assert f.read() == b'{"result": 1}\n{"result": 2}\n\n' * 2
+        assert list(output.read_records(length_file)) == bodies * 2
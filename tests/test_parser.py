@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+"""Test `parser` module."""
+
+from ratp_poll.ratp_api import parser
+
+
+class TestParser:
+    body = b'\xef\xbb\xbf{"result": {"schedules": [' \
+           b'{"message": "2 mn", "destination": "Porte d\'Auteuil"},' \
+           b'{"message": "A l\'approche", ' \
+           b'"destination": "La D\xc3\xa9fense, Grande Arche"}]},' \
+           b'"_metadata": {"call": "GET /schedules/buses/187/x/A",' \
+           b'"date": "2020-09-01T10:00:00+02:00", "version": 4}}'
+
+    def test_can_parse_response(self):
+        rows = parser.parse_response(self.body)
+        assert rows == [
+                ('2020-09-01T10:00:00+02:00', 'GET /schedules/buses/187/x/A',
+                 '2', 'Porte d\'Auteuil'),
+                ('2020-09-01T10:00:00+02:00', 'GET /schedules/buses/187/x/A',
+                 'A l\'approche', 'La Défense, Grande Arche')]
+
+    def test_can_not_parse_answer_without_times(self):
+        assert parser.parse_response(b'{"result": {"code": 400}}') == []
+        assert parser.parse_response(b'<html>') == []
+        assert parser.parse_response(None) == []
+
+    def test_quotes_csv_rows(self):
+        rows = parser.parse_response(self.body)
+        lines = parser.CSVFormatter().format_rows(rows)
+        assert lines[1] == '2020-09-01T10:00:00+02:00,' \
+                           'GET /schedules/buses/187/x/A,' \
+                           'A l\'approche,"La Défense, Grande Arche"'
+
+    def test_skips_invalid_schedules(self):
+        body = b'{"result": {"schedules": [' \
+               b'{"message": "2 mn", "destination": null},' \
+               b'{"message": 3, "destination": "Porte d\'Auteuil"},' \
+               b'null,' \
+               b'{"message": "5 mn", "destination": "Porte d\'Auteuil"}]},' \
+               b'"_metadata": {"call": "GET /schedules/buses/187/x/A",' \
+               b'"date": "2020-09-01T10:00:00+02:00", "version": 4}}'
+        rows = parser.parse_response(body)
+        assert [row[2] for row in rows] == ['5']
+        assert len(parser.CSVFormatter().format_rows(rows)) == 1
+        assert parser.parse_response(
+                b'{"result": {"schedules": []}, "_metadata": '
+                b'{"call": "GET /x", "date": null}}') == []
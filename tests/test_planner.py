@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""Test `planner` module."""
+
+from ratp_poll.ratp_api import planner
+from ratp_poll.ratp_api.query_index import Query
+
+from aioresponses import aioresponses
+import json
+import pytest
+
+API_URL = 'https://api-ratp.pierre-grimaud.fr/v4/schedules/'
+STATIONS_URL = 'https://api-ratp.pierre-grimaud.fr/v4/stations/buses/187'
+STATIONS = {'result': {'stations': [
+    {'name': 'Porte d\'Orleans', 'slug': 'porte+d+orleans'},
+    {'name': 'Division Leclerc - Camille Desmoulins',
+     'slug': 'division+leclerc+-+camille+desmoulins'},
+    {'name': 'Alesia'}]}}
+FETCH_CONF = {'log': None, 'timeout': 10, 'max_connections': 1,
+              'api_url': API_URL}
+
+
+class TestPlanner:
+    def test_stations_url(self):
+        assert planner.stations_url(API_URL, 'buses', '187') == STATIONS_URL
+
+    def test_ways_are_merged(self):
+        queries = [Query('buses', '187', 'a', 'A', interval=60),
+                   Query('buses', '187', 'b', 'A'),
+                   Query('buses', '187', 'a', 'R', interval=30),
+                   Query('buses', '187', 'b', 'A+R')]
+        planned = planner.merge_ways(queries)
+        assert planned == [('buses', '187', 'a', 'A+R'),
+                           ('buses', '187', 'b', 'A+R')]
+        assert planned[0].interval == 30
+        assert planned[0].path.endswith('/a/A%2BR')
+
+    def test_lines_are_expanded_from_the_catalogue(self, tmpdir):
+        path = str(tmpdir.join('stops.csv' + planner.CATALOGUE_EXTENSION))
+        queries = [Query('buses', '187', '*', 'A', interval=30),
+                   Query('buses', '187', 'porte+d+orleans', 'R'),
+                   Query('buses', '187', '*', 'R')]
+        with aioresponses() as m:
+            m.get(STATIONS_URL, status=200, body=json.dumps(STATIONS))
+            planned = planner.plan_queries(
+                    queries, planner.StationCatalogue(path), FETCH_CONF,
+                    merge=True)
+        assert planned == [
+            ('buses', '187', 'porte+d+orleans', 'A+R'),
+            ('buses', '187', 'division+leclerc+-+camille+desmoulins', 'A+R'),
+            ('buses', '187', 'Alesia', 'A+R')]
+        assert planned[0].interval == 30
+        # The stations are expanded from their slug, their name if missing
+        assert planned[1].path == ('buses/187/division%2Bleclerc%2B-%2B'
+                                   'camille%2Bdesmoulins/A%2BR')
+        assert planned[2].path == 'buses/187/Alesia/A%2BR'
+        # The cached stations are used until they expire
+        with aioresponses() as m:
+            m.get(STATIONS_URL, status=503, repeat=True)
+            catalogue = planner.StationCatalogue(path)
+            assert len(planner.plan_queries(queries, catalogue,
+                                            FETCH_CONF)) == 6
+            catalogue.ttl = 0
+            assert len(planner.plan_queries(queries, catalogue,
+                                            FETCH_CONF)) == 6
+            with pytest.raises(planner.CatalogueError):
+                planner.plan_queries([Query('buses', '38', '*', 'A')],
+                                     catalogue, FETCH_CONF)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+"""Test `profiling` module."""
+
+from ratp_poll.daemon import daemon
+from ratp_poll.ratp_api import profiling, stop_times
+
+from aiohttp import web
+import os
+import pytest
+
+QUERY = ('buses', '187', 'Division Leclerc - Camille Desmoulins', 'A')
+
+
+class TestProfiling:
+    def test_report_sorts_phases_by_total(self):
+        profile = profiling.TickProfile()
+        profile.add('parse', 0.001)
+        profile.add('response', 0.2)
+        profile.add('response', 0.1)
+        assert profile.phases['response'] == [2, pytest.approx(0.3), 0.2]
+        lines = profile.report().split('\n')
+        assert lines[0].startswith('elapsed: ')
+        assert lines[1] == ('response: 2 spans, total 0.300 s, mean 150.00 '
+                            'ms, max 200.00 ms')
+        assert lines[2].startswith('parse: 1 spans')
+        fetch_conf, profile = profiling.start_profile({'profile': True})
+        assert fetch_conf['tick_profile'] is profile
+        assert profiling.start_profile(fetch_conf) == (fetch_conf, None)
+        assert profiling.start_profile({}) == ({}, None)
+
+    @pytest.mark.asyncio
+    async def test_tick_phases_are_timed(self, tmpdir):
+        async def schedules(request):
+            return web.Response(text='{}')
+
+        app = web.Application()
+        app.router.add_get('/v4/schedules/{path:.*}', schedules)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        profile_dir = str(tmpdir.join('profiles'))
+        fetch_conf = {
+                'log': None,
+                'timeout': 10,
+                'max_connections': 1,
+                'api_url': 'http://127.0.0.1:{}/v4/schedules/'.format(port),
+                'profile': True,
+                'profile_dir': profile_dir}
+        fetch_conf, profile = profiling.start_profile(fetch_conf)
+        try:
+            async with stop_times.create_session(fetch_conf) as session:
+                await daemon.exec_and_write_async(
+                        stop_times.iter_responses, [QUERY],
+                        str(tmpdir.join('output')), fetch_conf, session)
+        finally:
+            await runner.cleanup()
+        assert {'connect', 'request', 'response', 'body_read',
+                'output_add', 'output_commit',
+                'output_lock_wait'} <= set(profile.phases)
+        assert len(os.listdir(profile_dir)) == 1
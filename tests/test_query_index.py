@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+"""Test `query_index` module."""
+
+from ratp_poll.ratp_api import query_index
+
+import os
+import pickle
+import pytest
+
+ROW = ['buses', '187', 'Division Leclerc - Camille Desmoulins', 'A']
+
+
+class TestQueryIndex:
+    def test_query_behaves_as_tuple(self):
+        query = query_index.Query(*ROW)
+        assert query == tuple(ROW)
+        assert {tuple(ROW): 1}[query] == 1
+        assert query[:2] == ('buses', '187')
+        assert list(query) == ROW
+        assert query.path == \
+            'buses/187/Division%20Leclerc%20-%20Camille%20Desmoulins/A'
+        assert pickle.loads(pickle.dumps(query)).path == query.path
+
+    def test_rows_are_validated_and_deduplicated(self):
+        queries = query_index.parse_rows([ROW, [], ROW + ['30'], ROW])
+        assert queries == [tuple(ROW)]
+        with pytest.raises(query_index.StopsFileError) as e:
+            query_index.parse_rows([ROW, ['bus', '1', 'x', 'A'],
+                                    ['buses', '1', 'x', 'B'], ['buses']])
+        assert str(e.value).splitlines()[0].startswith('stops file:2: ')
+        assert len(str(e.value).splitlines()) == 3
+
+    def test_cache_is_invalidated_by_changes(self, tmpdir):
+        stops_file = tmpdir.join('stops.csv')
+        stops_file.write(','.join(ROW) + ',30\n')
+        path = str(stops_file)
+        queries = query_index.load_queries(path, cache=True)
+        assert os.path.exists(path + query_index.CACHE_EXTENSION)
+        cached = query_index.load_queries(path, cache=True)
+        assert cached == queries
+        assert cached[0].interval == 30.0
+        stops_file.write(','.join(ROW[:3]) + ',R\n')
+        assert query_index.load_queries(path, cache=True)[0][3] == 'R'
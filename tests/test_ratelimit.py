@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+"""Test `ratelimit` module."""
+
+from ratp_poll.ratp_api import ratelimit
+
+import os
+
+
+class TestRateLimit:
+    def test_reservations_are_spread(self, tmpdir):
+        bucket = ratelimit.SharedTokenBucket(str(tmpdir.join('state')),
+                                             {'global': 10}, burst=0)
+        assert bucket.reserve(['global'], now=100.0) == 0.0
+        assert abs(bucket.reserve(['global'], now=100.0) - 0.1) < 1e-9
+        assert abs(bucket.reserve(['global'], now=100.0) - 0.2) < 1e-9
+        # Refilled after an idle period, up to the capacity
+        assert bucket.reserve(['global'], now=110.0) == 0.0
+        assert bucket.reserve(['unknown'], now=110.0) == 0.0
+
+    def test_buckets_are_shared(self, tmpdir):
+        path = str(tmpdir.join('state'))
+        rates = {'global': 100, 'buses': 1}
+        first = ratelimit.SharedTokenBucket(path, rates)
+        second = ratelimit.SharedTokenBucket(path, rates)
+        assert first.reserve(['global', 'buses'], now=5.0) == 0.0
+        assert abs(second.reserve(['global', 'buses'], now=5.0) - 1) < 1e-9
+        assert second.reserve(['global', 'metros'], now=5.0) == 0.0
+        first.close()
+        second.close()
+
+    def test_disabled_by_default(self):
+        assert ratelimit.get_rate_limiter({}) is None
+
+    def test_reservations_past_max_wait_are_refused(self, tmpdir):
+        bucket = ratelimit.SharedTokenBucket(str(tmpdir.join('state')),
+                                             {'global': 10}, burst=0)
+        fetched = []
+        # 1000 requests per tick of 60 s at 10 per second
+        for tick in range(3):
+            now = tick * 60.0
+            waits = [bucket.reserve(['global'], now=now, max_wait=59.5)
+                     for _ in range(1000)]
+            fetched.append(sum(wait is not None for wait in waits))
+        # The refused requests leave no debt for the next ticks
+        assert fetched == [596, 596, 596]
+
+    def test_default_state_file_is_private(self):
+        path = ratelimit.default_state_file()
+        bucket = ratelimit.SharedTokenBucket(path, {'global': 1})
+        assert os.stat(os.path.dirname(path)).st_mode & 0o077 == 0
+        bucket.close()
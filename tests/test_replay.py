@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+"""Test `replay` module."""
+
+from ratp_poll.ratp_api import replay, stop_times
+
+from aioresponses import aioresponses
+import asyncio
+import pytest
+
+URL = ('https://api-ratp.pierre-grimaud.fr/v4/schedules/'
+       'buses/187/Division%20Leclerc%20-%20Camille%20Desmoulins/A')
+QUERY = ('buses', '187', 'Division Leclerc - Camille Desmoulins', 'A')
+
+
+class TestReplay:
+    @pytest.mark.asyncio
+    async def test_recorded_answers_are_replayed(self, tmpdir):
+        corpus_file = str(tmpdir.join('corpus'))
+        fetch_conf = {'log': None, 'timeout': 10, 'max_connections': 1,
+                      'record_file': corpus_file}
+        with aioresponses() as m:
+            m.get(URL, status=200, body='first')
+            m.get(URL, status=200, body='second')
+            m.get(URL, exception=asyncio.TimeoutError())
+            async with stop_times.create_session(fetch_conf) as session:
+                for _ in range(3):
+                    await stop_times.fetch_query(QUERY, session, fetch_conf)
+        replay.get_recorder(fetch_conf).close()
+
+        corpus = replay.Corpus(corpus_file)
+        assert len(corpus) == 3
+        assert corpus.queries() == [QUERY]
+        fetch_conf = {'log': None, 'timeout': 10, 'max_connections': 1,
+                      'replay_file': corpus_file, 'replay_speed': 0}
+        async with stop_times.create_session(fetch_conf) as session:
+            bodies = [(await stop_times.fetch_query(QUERY, session,
+                                                    fetch_conf))[1]
+                      for _ in range(4)]
+        assert bodies == ['first', 'second', None, 'first']
+
+    @pytest.mark.asyncio
+    async def test_latency_is_scaled(self, tmpdir):
+        corpus_file = str(tmpdir.join('corpus'))
+        replay.Recorder(corpus_file).record(URL, QUERY, 0, 2.0, 200, b'{}')
+        session = replay.ReplaySession({'replay_file': corpus_file,
+                                        'replay_speed': 100, 'timeout': 10})
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        async with session.get(URL) as response:
+            assert await response.read() == b'{}'
+        assert 0.015 < loop.time() - started < 0.5
+        session = replay.ReplaySession({'replay_file': corpus_file,
+                                        'replay_speed': 1, 'timeout': 0.01})
+        with pytest.raises(asyncio.TimeoutError):
+            async with session.get(URL):
+                pass
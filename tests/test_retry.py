@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""Test `retry` module."""
+
+from ratp_poll.ratp_api import retry
+from ratp_poll.ratp_api import stop_times
+
+from aiohttp import client_exceptions
+from aiohttp import web
+from aioresponses import aioresponses
+import asyncio
+import pytest
+import time
+
+URL = 'https://api-ratp.pierre-grimaud.fr/v4/schedules/' \
+      'buses/187/Division%20Leclerc%20-%20Camille%20Desmoulins/A'
+QUERY = ('buses', '187', 'Division Leclerc - Camille Desmoulins', 'A')
+OTHER_URL = 'https://api-ratp.pierre-grimaud.fr/v4/schedules/' \
+            'buses/187/Porte%20d%27Orleans/A'
+OTHER_QUERY = ('buses', '187', 'Porte d\'Orleans', 'A')
+
+
+class TestRetry:
+    def test_backoff_is_capped(self):
+        fetch_conf = {'backoff': 1.0, 'backoff_max': 3.0}
+        for attempt in range(5):
+            assert 0 <= retry.backoff_delay(attempt, fetch_conf) <= 3.0
+
+    def test_no_retry_near_deadline(self):
+        fetch_conf = {'retries': 3, 'backoff': 0.0}
+        assert retry.retry_delay(0, fetch_conf) == 0.0
+        assert retry.retry_delay(3, fetch_conf) is None
+        fetch_conf['deadline'] = time.monotonic() + 0.1
+        assert retry.retry_delay(0, fetch_conf) is None
+
+    def test_start_deadline(self):
+        assert retry.start_deadline({}) == {}
+        fetch_conf = retry.start_deadline({'budget': 10})
+        assert 9 < retry.remaining(fetch_conf) <= 10
+
+    @pytest.mark.asyncio
+    async def test_fetch_retries_server_errors(self):
+        fetch_conf = {
+                'log': None,
+                'timeout': 10,
+                'max_connections': 1,
+                'retries': 2,
+                'backoff': 0.0}
+        with aioresponses() as m:
+            m.get(URL, status=503, body='error')
+            m.get(URL, status=200, body='test')
+            responses = await stop_times.run([QUERY], fetch_conf)
+        assert responses == ['test']
+
+    @pytest.mark.asyncio
+    async def test_last_attempt_answer_is_kept(self):
+        fetch_conf = {
+                'log': None,
+                'timeout': 10,
+                'max_connections': 1,
+                'retries': 1,
+                'backoff': 0.0}
+        with aioresponses() as m:
+            m.get(URL, status=503, body='error', repeat=True)
+            responses = await stop_times.run([QUERY], fetch_conf)
+        assert responses == ['error']
+
+    @pytest.mark.asyncio
+    async def test_rate_limit_stops_at_deadline(self, tmpdir):
+        fetch_conf = {
+                'log': None,
+                'timeout': 10,
+                'max_connections': 1,
+                'rate_limit': 1,
+                'rate_burst': 0,
+                'rate_limit_file': str(tmpdir.join('rate_limit')),
+                'deadline': time.monotonic() + 1.0}
+        started = time.monotonic()
+        with aioresponses() as m:
+            m.get(URL, status=200, body='test', repeat=True)
+            responses = await stop_times.run([QUERY, QUERY], fetch_conf)
+        # The second token is due past the deadline, so it is not waited for
+        assert sorted(responses, key=str) == [None, 'test']
+        assert time.monotonic() - started < 0.5
+
+    @pytest.mark.asyncio
+    async def test_dropped_connections_are_retried(self):
+        fetch_conf = {
+                'log': None,
+                'timeout': 10,
+                'max_connections': 1,
+                'retries': 2,
+                'backoff': 0.0}
+        with aioresponses() as m:
+            m.get(URL, exception=client_exceptions.ServerDisconnectedError())
+            m.get(URL, status=200, body='test')
+            m.get(OTHER_URL, status=200, body='other')
+            responses = await stop_times.run([QUERY, OTHER_QUERY], fetch_conf)
+        assert responses == ['test', 'other']
+
+    @pytest.mark.asyncio
+    async def test_session_timeout_applies_without_deadline(self):
+        async def schedules(request):
+            await asyncio.sleep(5)
+            return web.Response(text='late')
+
+        app = web.Application()
+        app.router.add_get('/v4/schedules/{path:.*}', schedules)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        fetch_conf = {
+                'log': None,
+                'timeout': 0.5,
+                'max_connections': 1,
+                'api_url': 'http://127.0.0.1:{}/v4/schedules/'.format(port)}
+        started = time.monotonic()
+        try:
+            responses = await stop_times.run([QUERY], fetch_conf)
+        finally:
+            await runner.cleanup()
+        assert responses == [None]
+        assert time.monotonic() - started < 2
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+"""Test `scheduler` module."""
+
+from ratp_poll.daemon import daemon, scheduler
+
+from aioresponses import aioresponses
+import functools
+import pytest
+
+NIGHT = ('noctiliens', '2', 'Chatelet', 'A')
+METRO = ('metros', '1', 'Chatelet', 'A')
+
+
+class TestScheduler:
+    def test_split_query_intervals(self):
+        queries, intervals = scheduler.split_query_intervals(
+                [NIGHT, METRO + (' 15',)])
+        assert queries == [NIGHT, METRO]
+        assert intervals == {METRO: 15.0}
+
+    def test_queries_are_due_after_their_interval(self):
+        poll_scheduler = scheduler.PollScheduler(
+                [NIGHT, METRO], interval=30,
+                type_intervals={'noctiliens': 300}, window=0)
+        now = poll_scheduler.next_due()
+        assert poll_scheduler.pop_due(now) == [NIGHT, METRO]
+        assert poll_scheduler.pop_due(now + 29) == []
+        assert poll_scheduler.pop_due(now + 30) == [METRO]
+        assert poll_scheduler.next_due() == now + 60
+        assert poll_scheduler.pop_due(now + 300) == [METRO, NIGHT]
+
+    def test_adaptive_interval(self):
+        poll_scheduler = scheduler.PollScheduler(
+                [METRO], interval=30, adaptive=True, min_interval=10,
+                max_interval=600, window=0)
+        now = poll_scheduler.next_due()
+        poll_scheduler.pop_due(now)
+        rows = [('date', 'call', '6', 'x'), ('date', 'call', '12', 'x')]
+        poll_scheduler.answered(METRO, rows, now)
+        assert poll_scheduler.next_due() == now + 300
+        poll_scheduler.answered(METRO, [('date', 'call', 'A quai', 'x')],
+                                now)
+        assert poll_scheduler.next_due() == now + 10
+        assert len(poll_scheduler) == 1
+
+    @pytest.mark.asyncio
+    async def test_scheduled_daemon_writes_due_queries(self, tmpdir):
+        output_file = str(tmpdir.join('output'))
+        fetch_conf = {
+                'log': None,
+                'timeout': 10,
+                'max_connections': 1}
+        poll_scheduler = scheduler.PollScheduler([METRO], interval=0)
+        with aioresponses() as m:
+            m.get('https://api-ratp.pierre-grimaud.fr/v4/schedules/'
+                  'metros/1/Chatelet/A', status=200, body='test',
+                  repeat=True)
+            await daemon.run_scheduled_daemon(
+                    functools.partial(scheduler.iter_scheduled,
+                                      scheduler=poll_scheduler),
+                    poll_scheduler, output_file, 1, fetch_conf, ticks=2)
+        with open(output_file) as f:
+            assert f.read() == 'test\ntest'
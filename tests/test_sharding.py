@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+"""Test `sharding` module."""
+
+from ratp_poll.ratp_api import sharding
+
+from aiohttp import web
+import pytest
+
+
+class TestSharding:
+    def test_can_shard_queries(self):
+        queries = [('buses', str(i), 'Station', 'A') for i in range(5)]
+        shards = sharding.shard_queries(queries, 2)
+        assert shards == [queries[0::2], queries[1::2]]
+        assert sharding.shard_queries(queries[:1], 3) == [queries[:1]]
+
+    @pytest.mark.asyncio
+    async def test_shards_are_fetched_from_a_running_loop(self):
+        async def schedules(request):
+            return web.Response(text=request.match_info['station'])
+
+        app = web.Application()
+        app.router.add_get('/v4/schedules/{type}/{line}/{station}/{way}',
+                           schedules)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        fetch_conf = {
+                'log': None,
+                'timeout': 10,
+                'max_connections': 2,
+                'shards': 2,
+                'api_url': 'http://127.0.0.1:{}/v4/schedules/'.format(port)}
+        queries = [('buses', '187', 'Station ' + str(i), 'A')
+                   for i in range(4)]
+        try:
+            responses = [response async for response in
+                         sharding.iter_responses_sharded(queries,
+                                                         fetch_conf)]
+        finally:
+            sharding.shutdown_executor()
+            await runner.cleanup()
+        assert sorted(responses) == ['Station ' + str(i) for i in range(4)]
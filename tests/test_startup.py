@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+
+"""Test the start up imports of the CLI."""
+
+import subprocess
+import sys
+
+# Modules that only the fetching commands need
+HEAVY_MODULES = ['aiohttp', 'filelock', 'multiprocessing',
+                 'concurrent.futures', 'ratp_poll.ratp_api.stop_times',
+                 'ratp_poll.daemon.daemon']
+
+
+class TestStartup:
+    def test_cli_import_is_light(self):
+        output = subprocess.check_output(
+                [sys.executable, '-c',
+                 'import sys, ratp_poll.cli; print("\\n".join(sys.modules))'],
+                universal_newlines=True)
+        modules = set(output.split())
+        assert not modules.intersection(HEAVY_MODULES)
@@ -3,6 +3,7 @@
 """Test `ratp_api` module."""
 
 from ratp_poll import ratp_api
+import ratp_poll.ratp_api.stop_times  # noqa: F401
 
 from aiohttp import ClientSession
 from aioresponses import aioresponses
@@ -23,6 +24,16 @@ class TestAPI:
         ratp_api.stop_times.fetch_log(None, 'a', 'b', 'c')
         assert not os.path.isfile(file)
 
+    def test_can_buffer_fetch_log(self, tmpdir):
+        file = tmpdir.join('fetch_log')
+        writer = ratp_api.log_writer.FetchLogWriter(str(file), max_rows=10,
+                                                    flush_interval=60)
+        writer.write('a', 'b', 'c')
+        writer.write('d', 'e', 'f')
+        assert not os.path.isfile(file)
+        writer.close()
+        assert file.readlines()[1:] == ['a,b,c\n', 'd,e,f']
+
     @pytest.mark.asyncio
     async def test_can_fetch_ok_stop(self):
         with aioresponses() as m:
@@ -42,3 +53,28 @@ class TestAPI:
                                                         fetch_conf)
             assert 'test' in resp_text
             await session.close()
+
+    @pytest.mark.asyncio
+    async def test_can_iter_stop_times(self):
+        body = '{"result": {"schedules": [' \
+               '{"message": "2 mn", "destination": "Porte d\'Auteuil"},' \
+               '{"message": "9 mn", "destination": "Porte d\'Auteuil"}]},' \
+               '"_metadata": {"call": "GET /schedules/buses/187/x/A",' \
+               '"date": "2020-09-01T10:00:00+02:00", "version": 4}}'
+        with aioresponses() as m:
+            m.get('https://api-ratp.pierre-grimaud.fr/v4/schedules/'
+                  'buses/187/Division%20Leclerc%20-%20Camille%20Desmoulins/A',
+                  status=200, body=body)
+            fetch_conf = {
+                    'log': None,
+                    'timeout': 10,
+                    'max_connections': 1}
+            query = ('buses', '187', 'Division Leclerc - Camille Desmoulins',
+                     'A')
+            rows = [row async for row in
+                    ratp_api.stop_times.iter_stop_times([query], fetch_conf)]
+            assert rows == [
+                    '2020-09-01T10:00:00+02:00,'
+                    'GET /schedules/buses/187/x/A,2,Porte d\'Auteuil',
+                    '2020-09-01T10:00:00+02:00,'
+                    'GET /schedules/buses/187/x/A,9,Porte d\'Auteuil']
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+"""Test `transport` module."""
+
+from ratp_poll.ratp_api import stop_times, transport
+
+import pytest
+
+
+class TestTransport:
+    def test_connector_options(self):
+        options = transport.connector_options({'max_connections': 5,
+                                               'limit_per_host': 2,
+                                               'dns_ttl': None})
+        assert options['limit'] == 5
+        assert options['limit_per_host'] == 2
+        assert options['ttl_dns_cache'] is None
+        assert options['keepalive_timeout'] == transport.KEEPALIVE_TIMEOUT
+        assert options['ssl'] is transport.get_ssl_context()
+
+    @pytest.mark.asyncio
+    async def test_sessions_share_the_ssl_context(self):
+        fetch_conf = {'max_connections': 1, 'timeout': 10}
+        first = stop_times.create_session(fetch_conf)
+        second = stop_times.create_session(fetch_conf)
+        assert first.connector._ssl is second.connector._ssl
+        await first.close()
+        await second.close()